@@ -3,10 +3,31 @@ import firebase_admin
 from firebase_admin import credentials, firestore, auth
 import streamlit as st
 import joblib
+import json
+import os
 import numpy as np
 import pandas as pd
 from datetime import datetime
 import plotly.express as px
+import firestore_reads
+import profile_cache
+from results_store import ResultStore
+import dashboard_stats
+import user_stats
+from write_behind import WriteBehindQueue, apply_writes
+import results_pager
+import results_export
+import results_index
+import bulk_screening
+from bulk_screening import PEDIGREE_MAP, SKIN_THICKNESS
+from google.api_core.exceptions import FailedPrecondition
+from prediction_service import PredictionService, PredictionCache, normalize_features
+from micro_batcher import MicroBatcher
+from forest_compiler import ARTIFACT_VERSION, CompiledForest, file_sha256, is_forest
+from model_registry import ModelRegistry, ModelReloader, REGISTRY_DIR, warm_up
+from model_router import CachedPredictor, ModelRouter
+from auth_session import INVALID, UNVERIFIABLE, SessionStore
+from user_directory import UserDirectory, NO_PROFILE_NAME
 
 # แก้ไขตรงส่วน st.set_page_config
 st.set_page_config(
@@ -14,15 +35,9 @@ st.set_page_config(
     page_icon="🩸",
     layout="wide"
 )
-#2. ฟังก์ชันประเมินระดับความเสี่ยง
-def get_risk_status(glucose, prediction):
-    if prediction == "เสี่ยง" and glucose >= 126: 
-        return "🔴 เสี่ยงสูง (น้ำตาลวิกฤต)"
-    elif prediction == "เสี่ยง": 
-        return "🟡 เฝ้าระวัง"
-    else:
-        return "🟢 ปกติ"
-    
+#2. ฟังก์ชันประเมินระดับความเสี่ยง (อยู่ใน risk_status.py เพื่อใช้ร่วมกับ results_store)
+from risk_status import add_status_column, RISK_LEVELS, RISK_DTYPE, RISK_KEY_BY_LABEL
+
 # 3. ส่วนตกแต่งหน้าตาเว็บไซต์ (UI & CSS)
 def inject_custom_css():
     st.markdown("""
@@ -116,15 +131,74 @@ def init_firebase():
 
 db = init_firebase()
 
+# เริ่มนับจำนวน Firestore reads ใหม่ทุกครั้งที่สคริปต์รัน
+firestore_reads.reset()
+
+# ที่เก็บผลการทำนาย (results) ที่แชร์กันทุก session ใน process เดียวกัน
+@st.cache_resource
+def get_result_store():
+    app_cfg = st.secrets.get("app", {})
+    return ResultStore(
+        db,
+        ttl_seconds=app_cfg.get("results_cache_ttl", 600),
+        max_records=app_cfg.get("results_cache_max_records", 200_000),
+    )
+
+result_store = get_result_store()
+
+# สมุดรายชื่อผู้ใช้ (มี index สำหรับค้นหา) ใช้ในหน้าแอดมิน
+@st.cache_resource
+def get_user_directory():
+    return UserDirectory(
+        db,
+        extra_emails=result_store.users,
+        ttl_seconds=st.secrets.get("app", {}).get("user_directory_ttl", 300),
+    )
+
+user_directory = get_user_directory()
+
+# คู่ idToken/refreshToken ของผู้ใช้ที่ล็อกอินแล้ว (ตรวจลายเซ็นในเครื่อง และต่ออายุเบื้องหลังก่อนหมดอายุ)
+@st.cache_resource
+def get_session_store():
+    app_cfg = st.secrets.get("app", {})
+    return SessionStore(idle_seconds=app_cfg.get("session_idle_hours", 12) * 3600)
+
+session_store = get_session_store()
+# ใส่ sid ใน URL ให้กลับเข้าระบบได้หลังปิดแท็บ (ปิดไว้เป็นค่าเริ่มต้น: ใครได้ลิงก์ไปก็เข้าบัญชีได้จนกว่า session
+# จะไม่ได้ใช้งานเกิน session_idle_hours เปิดเฉพาะเครื่องที่ใช้คนเดียว)
+SESSION_RESUME = st.secrets.get("app", {}).get("session_resume", False)
+
+# กลับเข้าระบบจาก sid ที่เก็บไว้ (ใน session นี้ หรือใน URL เมื่อ session ของ Streamlit หมดอายุ)
+# เป็นการตรวจ token ในเครื่อง ไม่ต้องส่งรหัสผ่านไปที่ Firebase ใหม่
+auth_sid = st.session_state.get("auth_sid") or (st.query_params.get("sid") if SESSION_RESUME else None)
+if auth_sid:
+    resume_state, resumed_email = session_store.resume(auth_sid)
+    if resume_state != INVALID:
+        # UNVERIFIABLE: เครือข่ายไป Google มีปัญหาชั่วคราว session ยังอยู่ในฝั่งเซิร์ฟเวอร์ จึงไม่ให้ออกจากระบบ
+        st.session_state.logged_in = True
+        st.session_state.user = resumed_email
+        st.session_state.auth_sid = auth_sid
+        if resume_state == UNVERIFIABLE:
+            st.toast("⚠️ ตรวจสอบการเข้าสู่ระบบกับ Firebase ไม่ได้ชั่วคราว จะลองใหม่อัตโนมัติ")
+    else:
+        st.session_state.logged_in = False
+        st.session_state.user = None
+        st.session_state.pop("auth_sid", None)
+        st.query_params.pop("sid", None)
+
 #7. ดึงข้อมูลโปรไฟล์ผู้ใช้งาน
 def get_current_user_profile():
     user_email = st.session_state.get("user")
     if not user_email:
         return {}
 
-    doc = db.collection("users").document(user_email).get()
-    if doc.exists:
-        return doc.to_dict()
+    # อ่านจากแคชของ session ก่อน (ไม่ต้องอ่าน Firestore ทุก rerun)
+    profile = profile_cache.get_profile(
+        st.session_state, db, user_email,
+        ttl_seconds=st.secrets.get("app", {}).get("profile_cache_ttl", 300),
+    )
+    if profile:
+        return profile
 
     return {
         "email": user_email,
@@ -162,30 +236,155 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # 8. การโหลดโมเดล Machine Learning
-@st.cache_resource
+MODEL_PKL = "optimized_diabetes_model.pkl"
+MODEL_ARTIFACT = "optimized_diabetes_model"   # สร้างด้วย python forest_compiler.py
+
+def artifact_is_current():
+    # ใช้ artifact แบบ mmap ได้ก็ต่อเมื่อสร้างจากไฟล์ .pkl ปัจจุบัน (เทียบ sha256 ใน manifest)
+    manifest_path = os.path.join(MODEL_ARTIFACT, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return False
+    if not os.path.exists(MODEL_PKL):
+        return True
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    # artifact รุ่นเก่า (format_version ไม่ตรง) สร้างใหม่จาก .pkl แทน
+    if manifest.get("format_version") != ARTIFACT_VERSION:
+        return False
+    return manifest.get("source_sha256") == file_sha256(MODEL_PKL)
+
 def load_model():
+    compiled = st.secrets.get("app", {}).get("compiled_model", True)
+    # เปิด artifact แบบ mmap (เร็วกว่า unpickle มาก และแชร์หน้า memory ระหว่าง worker บนเครื่องเดียวกัน)
+    if compiled and artifact_is_current():
+        return CompiledForest.load_artifact(MODEL_ARTIFACT)
+    model = joblib.load(MODEL_PKL)
+    # แปลง RandomForest เป็นตัวประเมินแบบ array (ผลเหมือนเดิมทุกบิต แต่เร็วกว่า) ปิดได้ด้วย app.compiled_model = false
+    if compiled and is_forest(model):
+        model = CompiledForest.from_estimator(model)
+    return model
+
+def load_file_predictor():
+    # โมเดลไฟล์เดิม (ใช้เมื่อ model registry ยังไม่มีรุ่นที่ตั้งเป็น CURRENT)
+    model = load_model()
+    # รุ่นของโมเดล = sha256 ของไฟล์ต้นทาง (ใช้ล้างแคชผลการทำนายเมื่อโมเดลเปลี่ยน)
+    version = getattr(model, "manifest", {}).get("source_sha256") or file_sha256(MODEL_PKL)
+    return PredictionService(model, threshold=st.secrets.get("app", {}).get("threshold", 0.5), version=version)
+
+# ตัวทำนายที่ห่อโมเดลไว้ (คำนวณ probability ครั้งเดียวต่อคำขอ และรองรับหลายแถว)
+# ใช้รุ่น CURRENT ของ model registry และสลับรุ่นเองเมื่อมีการ promote โดยไม่ต้อง restart
+# (โหลดและ warm up รุ่นใหม่ใน thread เบื้องหลังก่อนสลับ) ตั้ง app.model_reload_seconds = 0 เพื่อปิด
+@st.cache_resource
+def get_predictor():
+    app_cfg = st.secrets.get("app", {})
     with st.spinner("กำลังเตรียมระบบ..."):
-        return joblib.load("optimized_diabetes_model.pkl")
+        return ModelReloader(
+            ModelRegistry(app_cfg.get("model_registry", REGISTRY_DIR)),
+            load_file_predictor,
+            threshold=app_cfg.get("threshold", 0.5),
+            compiled=app_cfg.get("compiled_model", True),
+            interval=app_cfg.get("model_reload_seconds", 10),
+        )
+
+# แคชผลการทำนายตามข้อมูล 8 ค่า (ผู้ใช้มักส่งค่าเดิมซ้ำ เช่น ค่าเริ่มต้น Glucose 95 / BP 80)
+@st.cache_resource
+def get_prediction_cache():
+    return PredictionCache(maxsize=st.secrets.get("app", {}).get("prediction_cache_size", 10_000))
+
+# รวมคำขอทำนายจากหลาย session ให้ทำนายเป็น batch เดียว (ปิดได้ด้วย app.micro_batch = false)
+@st.cache_resource
+def get_batcher():
+    app_cfg = st.secrets.get("app", {})
+    if not app_cfg.get("micro_batch", True):
+        return None
+    return MicroBatcher(
+        get_predictor(),
+        max_batch_size=app_cfg.get("micro_batch_size", 64),
+        max_wait_ms=app_cfg.get("micro_batch_wait_ms", 5),
+    )
+
+# โมเดลที่กำลังทดลอง (candidate) จาก model registry: ใช้ shadow scoring และ/หรือแบ่งผู้ใช้ตามเปอร์เซ็นต์
+#   [app] candidate_model = "v0005", candidate_percent = 10, shadow = true
+@st.cache_resource
+def get_model_router():
+    app_cfg = st.secrets.get("app", {})
+    bmi_precision = app_cfg.get("bmi_precision", 1)
+    primary = CachedPredictor(get_predictor(), get_prediction_cache(), get_batcher(), bmi_precision=bmi_precision)
+    candidate, error = None, None
+    version = app_cfg.get("candidate_model")
+    if version and version != primary.version:
+        try:
+            model, _ = get_predictor().registry.load(version, compiled=app_cfg.get("compiled_model", True))
+            service = PredictionService(model, threshold=app_cfg.get("threshold", 0.5), version=version)
+            warm_up(service)
+            candidate = CachedPredictor(service, PredictionCache(maxsize=app_cfg.get("prediction_cache_size", 10_000)),
+                                        bmi_precision=bmi_precision)
+        except Exception as e:
+            error = f"{version}: {e}"
+    router = ModelRouter(
+        primary, candidate,
+        percent=app_cfg.get("candidate_percent", 0),
+        shadow=app_cfg.get("shadow", True),
+        salt=app_cfg.get("routing_salt", ""),
+    )
+    router.load_error = error
+    return router
 
 try:
-    model = load_model()
+    predictor = get_predictor()
+    batcher = get_batcher()
+    prediction_cache = get_prediction_cache()
+    model_router = get_model_router()
 except Exception as e:
     st.error("❌ ไม่พบโมเดลสำหรับทำนายผล กรุณาตรวจสอบไฟล์ optimized_diabetes_model.pkl")
     st.stop()
 
+def predict_features(features):
+    # ทำนายจากแคชก่อน ถ้าไม่มีจึงส่งให้โมเดล (key ของแคชปัด BMI แต่โมเดลได้ค่าจริง ดู CachedPredictor)
+    # คืนค่า (ผลที่ใช้ตอบผู้ใช้, Future ของผล shadow หรือ None) ดู model_router.py
+    return model_router.predict(normalize_features(features), st.session_state.get("user"))
+
 def logout_button():
     if st.sidebar.button("ออกจากระบบ"):
         st.session_state['logged_in'] = False
         st.session_state['user'] = None
+        if st.session_state.get("auth_sid"):
+            session_store.end(st.session_state.pop("auth_sid"))
+        st.query_params.pop("sid", None)
         # แทนที่ st.experimental_rerun() ด้วยการรีโหลดโดยใช้ sys.exit()
         st.rerun()
 
 from datetime import datetime
 
 #9. การบันทึกผลการวิเคราะห์
-def save_result(result_text, user_input):
+# คิวเขียนผลแบบ write-behind (บันทึกลง spool ในเครื่องก่อน แล้วค่อยทยอยเขียนลง Firestore เป็น batch)
+@st.cache_resource
+def get_write_queue():
+    app_cfg = st.secrets.get("app", {})
+    if not app_cfg.get("write_behind", True):
+        return None
+    return WriteBehindQueue(
+        db,
+        spool_path=app_cfg.get("write_spool_path", "write_spool.sqlite3"),
+        max_batch=app_cfg.get("write_batch_size", 100),
+        flush_ms=app_cfg.get("write_flush_ms", 500),
+        max_attempts=app_cfg.get("write_max_attempts", 8),
+        on_flush=result_store.invalidate,
+    )
+
+write_queue = get_write_queue()
+
+def shadow_fields(shadow):
+    # ผลของโมเดล shadow สำหรับเก็บคู่กับผลหลัก
+    out = shadow.result()
+    return {k: out[k] for k in ["arm", "version", "prediction", "proba", "latency_ms", "error"] if k in out}
 
-    db.collection("results").add({
+def save_result(result_text, user_input, served=None, shadow=None):
+    now = datetime.now()
+    # สร้าง id ฝั่ง client เพื่อให้การเขียนซ้ำตอน retry ไม่เกิดเอกสารซ้ำ
+    doc_id = db.collection("results").document().id
+
+    record = {
         # 🔐 ข้อมูลผู้ใช้
         "user": st.session_state.get("user"),          # email
         "name": user_profile.get("name", ""),          # ชื่อจริง
@@ -206,9 +405,45 @@ def save_result(result_text, user_input):
         "diabetes_pedigree": user_input["diabetes_pedigree"],
         "age": user_input["age"],
 
-        # ⏰ เวลา
-        "datetime": datetime.now()
-    })
+        # ⏰ เวลา (saved_at = เวลาที่เขียนลง Firestore จริง ใช้ดึงผลใหม่ใน result_store)
+        "datetime": now,
+        "saved_at": firestore.SERVER_TIMESTAMP,
+    }
+    # 🧠 โมเดลที่ใช้ตอบผู้ใช้ และผลของโมเดล shadow (ถ้าทำนายเสร็จแล้ว)
+    if served is not None:
+        record.update({
+            "model_version": served["version"],
+            "model_arm": served["arm"],
+            "model_latency_ms": served["latency_ms"],
+        })
+    if shadow is not None and shadow.done():
+        record["shadow"] = shadow_fields(shadow)
+    # 🔎 ฟิลด์สำหรับกรองด้วย index ในหน้าแอดมิน (risk_level, name_tokens)
+    record.update(results_index.indexed_fields(record, user_profile))
+    writes = [
+        (f"results/{doc_id}", record, False),
+        # อัปเดตสรุปรายวันสำหรับ Dashboard และสรุปประวัติของผู้ใช้ไปพร้อมกัน
+        dashboard_stats.daily_write(now, user_input["glucose"]),
+        user_stats.stats_write(record["user"], record, doc_id),
+    ]
+
+    job = None
+    if write_queue is not None:
+        job = write_queue.enqueue(writes)
+    else:
+        apply_writes(db, writes)
+        result_store.invalidate()
+
+    # shadow ยังไม่เสร็จ: เติมผลลงเอกสารเดิมเมื่อเสร็จ (merge หลังจากเขียนผลหลักแล้ว ผู้ใช้ไม่ต้องรอ)
+    # after=job: worker จะไม่เขียนงาน shadow ก่อนงานหลัก และถ้างานหลักไป dead_letter งาน shadow ก็ตามไปด้วย
+    if shadow is not None and "shadow" not in record:
+        def write_shadow(future):
+            shadow_write = [(f"results/{doc_id}", {"shadow": shadow_fields(future)}, True)]
+            if write_queue is not None:
+                write_queue.enqueue(shadow_write, after=job)
+            else:
+                apply_writes(db, shadow_write)
+        shadow.add_done_callback(write_shadow)
 # #10. ระบบสมัครสมาชิกและเข้าสู่ระบบ
 def auth_page():
     inject_custom_css()
@@ -261,8 +496,16 @@ def auth_page():
                     with st.spinner("กำลังเข้าสู่ระบบ..."):
                         result = firebase_login(email, password)
                         if "idToken" in result:
+                            try:
+                                sid = session_store.start(email, result)
+                            except Exception as e:
+                                st.error(f"ตรวจสอบ token ไม่ผ่าน: {e}")
+                                st.stop()
                             st.session_state.logged_in = True
                             st.session_state.user = email
+                            st.session_state.auth_sid = sid
+                            if SESSION_RESUME:
+                                st.query_params["sid"] = sid
                             st.success("ยินดีต้อนรับกลับมา!")
                             st.rerun()
                         else:
@@ -296,6 +539,8 @@ def auth_page():
                                 "role": "user",
                                 "created_at": datetime.now()
                             })
+                            profile_cache.evict(email)
+                            user_directory.upsert(email, name="", role="user")
                             st.success("สมัครสมาชิกสำเร็จ! กรุณาเข้าสู่ระบบ")
                             st.session_state.auth_mode = "login"
                             st.rerun()
@@ -394,15 +639,14 @@ def diabetes_page():
             q_preg = st.number_input("จำนวนครั้งที่ตั้งครรภ์", min_value=0, step=1, value=0)
             st.caption("นับตามจำนวนครั้งจริง (หากเป็นเพศชายให้ใส่ 0)")
 
-        skin_thickness = 20 # ค่าคงที่มาตรฐานสำหรับ Model
+        skin_thickness = SKIN_THICKNESS # ค่าคงที่มาตรฐานสำหรับ Model
         
         st.markdown("<br>", unsafe_allow_html=True)
         has_family_radio = st.radio(
             "ระดับความเข้มข้นทางพันธุกรรม (เลือกตามจำนวนญาติสายตรงที่เป็น):",
             ["ไม่มีประวัติ", "มี 1 ท่าน", "มีมากกว่า 1 ท่าน"], horizontal=True
         )
-        pedigree_map = {"ไม่มีประวัติ": 0.2, "มี 1 ท่าน": 0.5, "มีมากกว่า 1 ท่าน": 0.8}
-        diabetes_pedigree = pedigree_map[has_family_radio]
+        diabetes_pedigree = PEDIGREE_MAP[has_family_radio]
 
         submit_button = st.form_submit_button(label='🚀 วิเคราะห์ผลความเสี่ยง')
 
@@ -486,15 +730,14 @@ def diabetes_page():
             q_preg = st.number_input("จำนวนครั้งที่ตั้งครมภ์", min_value=0, step=1, value=0)
             st.caption("นับตามจำนวนครั้งจริง (หากเป็นเพศชายให้ใส่ 0)")
 
-        skin_thickness = 20 # ค่าคงที่มาตรฐาน
+        skin_thickness = SKIN_THICKNESS # ค่าคงที่มาตรฐาน
         
         st.markdown("<br>", unsafe_allow_html=True)
         has_family_radio = st.radio(
             "ระดับความเข้มข้นทางพันธุกรรม (เลือกตามจำนวนญาติสายตรงที่เป็น):",
             ["ไม่มีประวัติ", "มี 1 ท่าน", "มีมากกว่า 1 ท่าน"], horizontal=True
         )
-        pedigree_map = {"ไม่มีประวัติ": 0.2, "มี 1 ท่าน": 0.5, "มีมากกว่า 1 ท่าน": 0.8}
-        diabetes_pedigree = pedigree_map[has_family_radio]
+        diabetes_pedigree = PEDIGREE_MAP[has_family_radio]
 
         submit_button = st.form_submit_button(label='🚀 วิเคราะห์ผลความเสี่ยง')
 
@@ -506,15 +749,14 @@ def diabetes_page():
             st.warning("💡 หากไม่ทราบค่าระดับน้ำตาลหรือความดัน แนะนำให้ใช้ค่าเฉลี่ยสุขภาพดี (Glucose: 95, Blood Pressure: 80)")
         else:
             with st.spinner("🤖 AI กำลังวิเคราะห์ข้อมูลของคุณ..."):
-                input_data = np.array([[q_preg, glucose, blood_pressure, skin_thickness, 
-                                        insulin, bmi, diabetes_pedigree, age]])
-                
-                prediction = model.predict(input_data)
-                proba = model.predict_proba(input_data)[0][1]
+                features = [q_preg, glucose, blood_pressure, skin_thickness,
+                            insulin, bmi, diabetes_pedigree, age]
+                served, shadow = predict_features(features)
+                prediction, proba = served["prediction"], served["proba"]
 
                 st.markdown("---")
                 
-                if prediction[0] == 1 or behavior_score >= 2:
+                if prediction == 1 or behavior_score >= 2:
                     st.error(f"### ⚠️ ผลการวิเคราะห์: มีความเสี่ยง")
                     st.write(f"ความน่าจะเป็นจากการประเมิน: **{proba:.1%}**")
                     
@@ -538,7 +780,7 @@ def diabetes_page():
                     "pregnancies": q_preg, "glucose": glucose, "blood_pressure": blood_pressure,
                     "skin_thickness": skin_thickness, "insulin": insulin, "bmi": bmi,
                     "diabetes_pedigree": diabetes_pedigree, "age": age, "weight": weight, "height_cm": height_cm
-                })
+                }, served, shadow)
                 st.balloons()
 
 #13.หน้าแสดงประวัติการตรวจย้อนหลัง
@@ -547,24 +789,24 @@ def history_page():
     render_styled_header("📊 ประวัติสุขภาพย้อนหลัง", "ติดตามแนวโน้มระดับน้ำตาลและค่า BMI ของคุณ")
 
     try:
-        docs = (
-            db.collection("results")
-            .where("user", "==", st.session_state["user"])
-            .order_by("datetime")
-            .stream()
-        )
+        user_email = st.session_state["user"]
 
-        data = []
-        for doc in docs:
-            d = doc.to_dict()
+        # อ่านเอกสารสรุปประวัติของผู้ใช้ (1 read) ถ้ายังไม่เคย rebuild ให้สร้างจากผลเดิมครั้งเดียว
+        entries = user_stats.load_entries(db, user_email)
+        if entries is None:
+            entries = user_stats.rebuild(db, user_email)
 
+        data = []
+        for d in entries:
             # ✅ ป้องกัน KeyError: datetime
-            if "datetime" not in d:
+            if not d.get("datetime"):
                 continue
 
             # Firestore timestamp → python datetime
+            d = dict(d)
             d["datetime"] = d["datetime"].replace(tzinfo=None)
             data.append(d)
+        data.sort(key=lambda d: d["datetime"])
 
         # ✅ ถ้าไม่มีข้อมูลเลย
         if not data:
@@ -662,10 +904,13 @@ def profile_page():
     # 1. ดึง ID จาก Session
     user_id = st.session_state.user['localId'] if isinstance(st.session_state.user, dict) else st.session_state.user
     user_ref = db.collection('users').document(user_id)
-    doc = user_ref.get()
-    u_data = doc.to_dict() if doc.exists else {}
+    # ใช้แคชโปรไฟล์ของ session (ถูกล้างทุกครั้งที่โปรไฟล์หรือสิทธิ์ถูกแก้ไข)
+    u_data = profile_cache.get_profile(
+        st.session_state, db, user_id,
+        ttl_seconds=st.secrets.get("app", {}).get("profile_cache_ttl", 300),
+    )
     
-    # ดึงสิทธิ์จากข้อมูลล่าสุดใน DB (เพื่อความแม่นยำในการเช็ค)
+    # ดึงสิทธิ์จากข้อมูลล่าสุด (เพื่อความแม่นยำในการเช็ค)
     is_admin = u_data.get("role") == "admin"
 
     with st.form("profile_form"):
@@ -728,9 +973,9 @@ def profile_page():
             # บันทึกด้วย merge=True
             user_ref.set(save_data, merge=True)
             
-            # อัปเดตข้อมูลใน session_state ทันทีเพื่อให้ Sidebar เปลี่ยนตาม
-            if 'user_profile' in st.session_state:
-                st.session_state.user_profile.update(save_data)
+            # อัปเดตแคชโปรไฟล์ทันทีเพื่อให้ Sidebar เปลี่ยนตามโดยไม่ต้องอ่านใหม่
+            profile_cache.update(st.session_state, user_id, save_data)
+            user_directory.upsert(user_id, **save_data)
             
             st.success("✅ บันทึกข้อมูลสำเร็จ! ระบบทำการอัปเดตข้อมูลล่าสุดของคุณแล้ว")
             st.rerun()
@@ -742,12 +987,17 @@ def delete_user(email):
         user = auth.get_user_by_email(email)
         auth.delete_user(user.uid)
         db.collection("users").document(email).delete()
+        profile_cache.evict(email)
+        session_store.end_user(email)
+        user_directory.remove(email)
         return True
     except Exception as e:
         st.error(f"ไม่สามารถลบผู้ใช้ได้: {e}")
         return False
     
 #16.หน้าผู้ดูแลระบบ (Admin)
+ROLE_PICKER_LIMIT = 200
+
 def admin_page():
     if user_profile.get("role") != "admin":
         st.error("⛔ คุณไม่มีสิทธิ์เข้าถึงหน้านี้")
@@ -755,38 +1005,28 @@ def admin_page():
 
     st.subheader("🛠 ระบบจัดการผู้ใช้")
 
-    # 1. ดึงข้อมูลจาก Collection users
-    users_ref = db.collection("users").stream()
-    users_data = {u.id: u.to_dict() for u in users_ref}
+    # 1. ค้นหาจากสมุดรายชื่อที่มี index (ผู้ใช้ในระบบ + อีเมลที่เคยมาทำนายผลแต่ไม่มีโปรไฟล์)
+    f1, f2 = st.columns([3, 1])
+    search_text = f1.text_input("🔍 ค้นหาชื่อหรืออีเมล", key="admin_user_search",
+                                placeholder="พิมพ์บางส่วนของชื่อ นามสกุล หรืออีเมล")
+    page_size = f2.selectbox("แสดงต่อหน้า", [20, 50, 100], key="admin_user_page_size")
 
-    # 2. ดึงอีเมลทั้งหมดที่เคยมาทำนายผลจาก Collection results (เพื่อหาคนที่ตกหล่น)
-    results_ref = db.collection("results").stream()
-    all_emails_from_results = set()
-    for r in results_ref:
-        email = r.to_dict().get("user")
-        if email:
-            all_emails_from_results.add(email)
-
-    # 3. รวมรายชื่อเข้าด้วยกัน
-    combined_emails = set(users_data.keys()).union(all_emails_from_results)
-    
-    final_users = []
-    for email in combined_emails:
-        user_info = users_data.get(email, {})
-        final_users.append({
-            "email": email,
-            "name": user_info.get("name", "ผู้ใช้ใหม่ (ไม่มีข้อมูลโปรไฟล์)"),
-            "role": user_info.get("role", "user")
-        })
+    matches = user_directory.search(search_text)
+    st.subheader(f"👥 รายชื่อผู้ใช้ ({len(matches)} จาก {len(user_directory)} คน)")
 
-    df = pd.DataFrame(final_users)
-    st.subheader(f"👥 รายชื่อผู้ใช้ทั้งหมด ({len(df)} คน)")
+    # 2. แบ่งหน้า: สร้าง widget เฉพาะแถวของหน้าปัจจุบัน
+    if st.session_state.get("admin_user_filter") != (search_text, page_size):
+        st.session_state.admin_user_filter = (search_text, page_size)
+        st.session_state.admin_user_page = 0
+    total_pages = max(1, -(-len(matches) // page_size))
+    page_no = min(st.session_state.get("admin_user_page", 0), total_pages - 1)
+    page_rows = matches[page_no * page_size:(page_no + 1) * page_size]
 
     # แสดงรายชื่อพร้อมปุ่มลบ
     # แสดงรายชื่อผู้ใช้
-    for _, row in df.iterrows():
+    for row in page_rows:
         col1, col2, col3 = st.columns([2.5, 2.5, 2]) # ปรับขนาดคอลัมน์เพิ่มที่ว่างให้ปุ่ม
-        col1.write(f"**{row['name']}**")
+        col1.write(f"**{row['name'] if row['has_profile'] else NO_PROFILE_NAME}**")
         col2.write(row["email"])
 
         with col3:
@@ -826,26 +1066,35 @@ def admin_page():
                     st.session_state[f"reset_mode_{row['email']}"] = False
                     st.rerun()
 
+    nav1, nav2, nav3 = st.columns([1, 2, 1])
+    if nav1.button("⬅️ ก่อนหน้า", key="admin_user_prev", disabled=page_no == 0, use_container_width=True):
+        st.session_state.admin_user_page = page_no - 1
+        st.rerun()
+    nav2.markdown(f"<p style='text-align: center;'>หน้า {page_no + 1} / {total_pages}</p>", unsafe_allow_html=True)
+    if nav3.button("ถัดไป ➡️", key="admin_user_next", disabled=page_no >= total_pages - 1, use_container_width=True):
+        st.session_state.admin_user_page = page_no + 1
+        st.rerun()
+
     st.markdown("---")
     st.subheader("🔄 เปลี่ยนสิทธิ์ผู้ใช้")
 
-    # สร้างรายชื่อสำหรับแสดงผลในตัวเลือก (เช่น "ชื่อ - email@example.com")
-    search_options = [f"{u['name']} ({u['email']})" for u in final_users]
-    
+    # ตัวเลือกมาจากผลการค้นหาด้านบน (จำกัดจำนวนเพื่อไม่ให้ selectbox ใหญ่เกินไป)
+    role_candidates = matches[:ROLE_PICKER_LIMIT]
+    if len(matches) > ROLE_PICKER_LIMIT:
+        st.caption(f"แสดง {ROLE_PICKER_LIMIT} รายชื่อแรกจาก {len(matches)} รายการ พิมพ์คำค้นด้านบนเพื่อจำกัดผลลัพธ์")
+
     # ใช้ selectbox ซึ่ง Streamlit รองรับการพิมพ์ค้นหาในตัวอยู่แล้ว
-    selected_display = st.selectbox(
+    target_email = st.selectbox(
         "ค้นหาชื่อหรืออีเมลที่ต้องการเปลี่ยนสิทธิ์",
-        options=search_options,
+        options=[u["email"] for u in role_candidates],
+        format_func=lambda e: f"{(user_directory.get(e) or {}).get('name') or NO_PROFILE_NAME} ({e})",
         index=None,
         placeholder="พิมพ์เพื่อค้นหาชื่อหรืออีเมล..."
     )
 
-    if selected_display:
-        # ดึง email ออกมาจากข้อความที่เลือก (ค่าในวงเล็บสุดท้าย)
-        target_email = selected_display.split("(")[-1].replace(")", "")
-        
-        # ค้นหาข้อมูลผู้ใช้ที่เลือก
-        user_to_update = next((u for u in final_users if u["email"] == target_email), None)
+    if target_email:
+        # ค้นหาข้อมูลผู้ใช้ที่เลือกผ่าน index อีเมล
+        user_to_update = user_directory.get(target_email)
         
         if user_to_update:
             current_role = user_to_update["role"]
@@ -865,12 +1114,17 @@ def admin_page():
                     db.collection("users").document(target_email).set({
                         "email": target_email,
                         "role": new_role,
-                        "name": user_to_update['name'] if user_to_update['name'] != "ผู้ใช้ใหม่ (ไม่มีข้อมูลโปรไฟล์)" else ""
+                        "name": user_to_update['name']
                     }, merge=True)
+                    profile_cache.evict(target_email)
+                    user_directory.upsert(target_email, role=new_role)
                     st.success(f"✅ เปลี่ยนสิทธิ์ {target_email} เป็น {new_role} แล้ว")
                     st.rerun()
 
 #17. ระบบจัดการข้อมูลผู้ป่วย (Admin Results)
+NAME_TOKEN_MAX = 12  # ตรงกับ max_prefix ของ user_directory.search_tokens
+NAME_TOKEN_MIN = 2   # ตรงกับ min_prefix ของ user_directory.search_tokens
+
 def admin_results_page():
     if user_profile.get("role") != "admin":
         st.error("⛔ ไม่มีสิทธิ์")
@@ -878,71 +1132,163 @@ def admin_results_page():
 
     render_styled_header("👨‍⚕️ ระบบบริหารจัดการข้อมูลคนไข้", "จัดการผลการคัดกรองและส่งออกรายงาน")
 
-    # 1. โหลดข้อมูลพื้นฐาน
-    users_docs = db.collection("users").stream()
-    users_map = {}
-    for u in users_docs:
-        u_data = u.to_dict()
-        if u_data.get("role") != "admin":
-            users_map[u_data.get("email")] = u_data
-    
-    records = db.collection("results").order_by("datetime", direction=firestore.Query.DESCENDING).stream()
-    
-    all_results = []
-    for r in records:
-        d = r.to_dict()
-        d["สถานะ"] = get_risk_status(d.get("glucose", 0), d.get("result"))
-        p_info = users_map.get(d.get('user'), {})
-        d["ชื่อ-นามสกุล"] = f"{p_info.get('name', '')} {p_info.get('lastname', '')}"
-        all_results.append(d)
+    # 1. ชื่อผู้ใช้จากสมุดรายชื่อที่แชร์กันทั้ง process (ไม่อ่าน collection users ทุก rerun)
+    def full_name(email):
+        p_info = user_directory.get(email) or {}
+        return f"{p_info.get('name', '')} {p_info.get('lastname', '')}".strip()
 
-    if not all_results:
-        st.info("ยังไม่มีข้อมูลการทำนายในระบบ"); return
+    def row_name(row):
+        # ผลที่นำเข้าจากไฟล์ของคลินิกอาจไม่มีบัญชีผู้ใช้ (หรือไม่มีอีเมล) ใช้ชื่อที่บันทึกไว้ในผลแทน
+        return full_name(row.get("user")) or row.get("name") or ""
 
     # --- [ส่วนที่ 1] สลับเอาตารางรวมและตัวกรองขึ้นมาก่อน ---
     st.subheader("📂 ตารางรวมคนไข้และจัดการข้อมูลทั้งหมด")
-    full_df = pd.DataFrame(all_results)
     
     # ส่วนคัดกรองและส่งออกข้อมูล
-    col_f1, col_f2 = st.columns([2, 1])
+    col_f1, col_f2, col_f3 = st.columns([2, 1, 1])
     with col_f1:
-        search_query = st.text_input("🔍 ค้นหาชื่อหรืออีเมลในระบบ:", key="admin_search_main")
+        search_query = st.text_input("🔍 ค้นหาชื่อหรืออีเมลในระบบ:", key="admin_search_main",
+                                     help="ค้นหาจากต้นคำของชื่อ นามสกุล หรืออีเมล (อย่างน้อย 2 ตัวอักษร) "
+                                          "เช่น 'สม' เจอ 'สมชาย' แต่ 'ชาย' ไม่เจอ ติ๊ก 'ค้นหากลางคำ' เพื่อค้นทุกตำแหน่ง")
+        substring_search = st.checkbox("ค้นหากลางคำ (ช้ากว่า ค้นจากแคชของผลทั้งหมด)", key="admin_search_substring")
     with col_f2:
         risk_filter = st.selectbox("🚑 กรองตามระดับความเสี่ยง:", 
-                                 ["ทั้งหมด", "🔴 เสี่ยงสูง (น้ำตาลวิกฤต)", "🟡 เฝ้าระวัง", "🟢 ปกติ"])
+                                 ["ทั้งหมด"] + RISK_LEVELS)
+    with col_f3:
+        page_sizes = [25, 50, 100, 200]
+        default_size = st.secrets.get("app", {}).get("results_page_size", 50)
+        page_size = st.selectbox("📄 จำนวนรายการต่อหน้า:", page_sizes,
+                                 index=page_sizes.index(default_size) if default_size in page_sizes else 1)
+
+    # เปลี่ยนตัวกรองเมื่อไหร่ให้กลับไปหน้าแรก
+    filter_key = (search_query, risk_filter, page_size, substring_search)
+    if st.session_state.get("results_filter_key") != filter_key:
+        st.session_state.results_filter_key = filter_key
+        st.session_state.results_page_no = 0
+        st.session_state.results_cursors = [None]
+    page_no = st.session_state.results_page_no
+    cursors = st.session_state.results_cursors
+
+    # ตัวกรองแบบ indexed: ใช้ composite index ของ Firestore (อ่านเฉพาะเอกสารที่ตรงเงื่อนไข)
+    # รองรับระดับความเสี่ยง + คำค้น 1 คำที่เป็นต้นคำยาวอย่างน้อย NAME_TOKEN_MIN ตัวอักษร
+    # กรณีอื่น (หลายคำ, 1 ตัวอักษร, ค้นหากลางคำ, ยังไม่ได้ backfill ผลเก่า, ยังไม่ได้ deploy index) ใช้แคช result_store
+    filter_mode = st.secrets.get("app", {}).get("results_filter_mode", "indexed")
+    search_terms = search_query.lower().split()
+    index_filters = {
+        "risk_level": None if risk_filter == "ทั้งหมด" else RISK_KEY_BY_LABEL[risk_filter],
+        "token": search_terms[0][:NAME_TOKEN_MAX] if search_terms else None,
+    }
+    use_index = (filter_mode == "indexed" and len(search_terms) <= 1 and not substring_search
+                 and all(len(t) >= NAME_TOKEN_MIN for t in search_terms)
+                 and (search_query or risk_filter != "ทั้งหมด"))
+    if use_index and not results_index.backfill_done(db):
+        # ผลที่บันทึกก่อนมี risk_level / name_tokens ยังหาไม่เจอด้วย index
+        st.caption("ℹ️ ยังไม่ได้เติมฟิลด์สำหรับค้นหาด้วย index ให้ผลเก่า (ดูเมนูด้านล่าง) จึงค้นจากแคชแทน")
+        use_index = False
+    if use_index:
+        try:
+            docs, has_next = results_pager.fetch_page(db, page_size, cursors[page_no], **index_filters)
+            if has_next and len(cursors) == page_no + 1:
+                cursors.append(docs[-1])
+            page_rows = add_status_column([doc.to_dict() for doc in docs])
+            total = dashboard_stats.count(results_pager.filtered_query(db, **index_filters))
+            st.caption(f"พบ {total} รายการ")
+        except FailedPrecondition:
+            st.warning("⚠️ ยังไม่ได้สร้าง composite index ของ Firestore (firestore.indexes.json) ใช้ข้อมูลจากแคชแทน")
+            use_index = False
+
+    if not use_index and (search_query or risk_filter != "ทั้งหมด"):
+        # มีตัวกรอง: ค้นหาผ่าน index ของ result_store (ไม่ต้องไล่ str.contains ทั้งตาราง)
+        users = None
+        if search_query:
+            q = search_query.lower()
+            users = [email for email in result_store.users()
+                     if q in email.lower() or q in full_name(email).lower()]
+        matches = result_store.query(users=users, status=None if risk_filter == "ทั้งหมด" else risk_filter)
+        page_items = matches[page_no * page_size:(page_no + 1) * page_size]
+        has_next = len(matches) > (page_no + 1) * page_size
+        page_rows = []
+        for d, status in page_items:
+            row = dict(d)
+            row["สถานะ"] = status
+            page_rows.append(row)
+        st.caption(f"พบ {len(matches)} รายการ")
+    elif not use_index:
+        # ไม่มีตัวกรอง: ดึงจาก Firestore ทีละหน้าด้วย cursor
+        docs, has_next = results_pager.fetch_page(db, page_size, cursors[page_no])
+        if has_next and len(cursors) == page_no + 1:
+            cursors.append(docs[-1])
+        page_rows = add_status_column([doc.to_dict() for doc in docs])
+
+    if not page_rows and page_no == 0:
+        st.info("ยังไม่มีข้อมูลการทำนายในระบบ" if not search_query and risk_filter == "ทั้งหมด"
+                else "ไม่พบข้อมูลที่ตรงกับเงื่อนไข")
+    else:
+        for row in page_rows:
+            row["ชื่อ-นามสกุล"] = row_name(row)
+        page_df = pd.DataFrame(page_rows)
+        page_df["สถานะ"] = page_df["สถานะ"].astype(RISK_DTYPE)
+
+        # แสดงผลทุกคอลัมน์ (เอาคอลัมน์สำคัญไว้หน้า)
+        important_cols = ["สถานะ", "ชื่อ-นามสกุล", "result", "glucose", "bmi", "datetime", "user"]
+        other_cols = [c for c in page_df.columns if c not in important_cols]
+        st.dataframe(page_df[[c for c in (important_cols + other_cols) if c in page_df.columns]],
+                     use_container_width=True)
+
+    # ปุ่มเปลี่ยนหน้า
+    nav1, nav2, nav3 = st.columns([1, 2, 1])
+    with nav1:
+        if st.button("◀ ก่อนหน้า", disabled=page_no == 0, key="results_prev"):
+            st.session_state.results_page_no -= 1
+            st.rerun()
+    with nav2:
+        st.markdown(f"<p style='text-align: center;'>หน้า {page_no + 1}</p>", unsafe_allow_html=True)
+    with nav3:
+        if st.button("ถัดไป ▶", disabled=not has_next, key="results_next"):
+            st.session_state.results_page_no += 1
+            st.rerun()
 
-    # ตรรกะการกรองข้อมูล
-    df_to_show = full_df.copy()
-    if search_query:
-        df_to_show = df_to_show[df_to_show["ชื่อ-นามสกุล"].str.contains(search_query, case=False, na=False) |
-                              df_to_show["user"].str.contains(search_query, case=False, na=False)]
-    
-    if risk_filter != "ทั้งหมด":
-        df_to_show = df_to_show[df_to_show["สถานะ"] == risk_filter]
+    # ปุ่มดาวน์โหลด 2 รูปแบบ (สร้างไฟล์เมื่อกดปุ่มเท่านั้น อ่าน Firestore ทีละหน้า แต่ไฟล์ทั้งไฟล์อยู่ในหน่วยความจำ ดู results_export.py)
+    def to_row(d, status):
+        return {**d, "สถานะ": status, "ชื่อ-นามสกุล": row_name(d)}
+
+    def export_filtered():
+        if use_index:
+            chunks = export_all_chunks(**index_filters)
+        elif search_query or risk_filter != "ทั้งหมด":
+            chunks = ([to_row(d, status) for d, status in chunk]
+                      for chunk in results_export.iter_chunks(matches))
+        else:
+            chunks = export_all_chunks()
+        return results_export.export(export_fmt, chunks)
+
+    export_page_size = st.secrets.get("app", {}).get("export_page_size", 500)
 
-    # แสดงผลทุกคอลัมน์ (เอาคอลัมน์สำคัญไว้หน้า)
-    important_cols = ["สถานะ", "ชื่อ-นามสกุล", "result", "glucose", "bmi", "datetime", "user"]
-    other_cols = [c for c in df_to_show.columns if c not in important_cols]
-    final_df = df_to_show[[c for c in (important_cols + other_cols) if c in df_to_show.columns]]
+    def export_all_chunks(**filters):
+        for rows in results_export.iter_firestore_rows(db, export_page_size, **filters):
+            for row in rows:
+                row["ชื่อ-นามสกุล"] = row_name(row)
+            yield rows
 
-    st.dataframe(final_df, use_container_width=True)
+    export_fmt = st.radio("รูปแบบไฟล์", ["csv", "xlsx"], horizontal=True, key="export_fmt",
+                          format_func=lambda f: "CSV" if f == "csv" else "Excel (XLSX)")
+    mime = "text/csv" if export_fmt == "csv" else "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
 
-    # ปุ่มดาวน์โหลด 2 รูปแบบ
     col_dl1, col_dl2 = st.columns(2)
     with col_dl1:
         st.download_button(
             label=f"📥 ดาวน์โหลดเฉพาะกลุ่ม: {risk_filter}",
-            data=final_df.to_csv(index=False).encode("utf-8-sig"),
-            file_name=f"report_{risk_filter}.csv",
-            mime="text/csv",
+            data=export_filtered,
+            file_name=f"report_{risk_filter}.{export_fmt}",
+            mime=mime,
             key="dl_filtered_top"
         )
     with col_dl2:
         st.download_button(
             label="📥 ดาวน์โหลดข้อมูลทั้งหมดทุกรายการ",
-            data=full_df.to_csv(index=False).encode("utf-8-sig"),
-            file_name="all_patient_data.csv",
-            mime="text/csv",
+            data=lambda: results_export.export(export_fmt, export_all_chunks()),
+            file_name=f"all_patient_data.{export_fmt}",
+            mime=mime,
             key="dl_all_top"
         )
 
@@ -951,15 +1297,22 @@ def admin_results_page():
     # --- [ส่วนที่ 2] ระบบค้นหาและดูประวัติรายคน (ย้ายลงมาข้างล่าง) ---
     with st.expander("🔍 ค้นหาและดูประวัติเชิงลึกรายบุคคล"):
         st.subheader("ข้อมูลคนไข้รายบุคคล")
-        patient_emails = list(users_map.keys())
+        patient_emails = [u["email"] for u in user_directory.search() if u["has_profile"] and u["role"] != "admin"]
         selected_email = st.selectbox(
             "เลือกชื่อคนไข้เพื่อดูโปรไฟล์และประวัติ:",
             options=[""] + patient_emails,
-            format_func=lambda x: f"{users_map.get(x, {}).get('name', '')} {users_map.get(x, {}).get('lastname', '')} ({x})" if x else "เลือกรายชื่อ..."
+            format_func=lambda x: f"{full_name(x)} ({x})" if x else "เลือกรายชื่อ..."
         )
 
         if selected_email:
-            p = users_map.get(selected_email, {})
+            # อ่านโปรไฟล์เต็ม (เบอร์โทร/โรคประจำตัว) เฉพาะคนที่เลือก แล้วใช้ซ้ำจนกว่าโปรไฟล์จะถูกแก้ไข
+            cache_key = (selected_email, profile_cache.current_version(selected_email))
+            cached = st.session_state.get("admin_patient_profile")
+            if not cached or cached[0] != cache_key:
+                doc = firestore_reads.tracked_get(db.collection("users").document(selected_email))
+                cached = (cache_key, doc.to_dict() if doc.exists else {})
+                st.session_state.admin_patient_profile = cached
+            p = cached[1]
             st.markdown(f"### 👤 ข้อมูลคนไข้: {p.get('name')} {p.get('lastname')}")
             
             c1, c2 = st.columns(2)
@@ -968,14 +1321,60 @@ def admin_results_page():
             with c2:
                 st.warning(f"💊 **โรคประจำตัว:** {p.get('disease', 'ไม่มี')}\n\n🚫 **ประวัติแพ้ยา:** {p.get('allergy', 'ไม่มี')}")
 
-            # ตารางประวัติ 10 รายการล่าสุดของคนนั้น
-            user_history = [r for r in all_results if r.get('user') == selected_email]
+            # ตารางประวัติ 10 รายการล่าสุดของคนนั้น (จาก index รายผู้ใช้)
+            user_history = [d for d, _ in result_store.query(users=[selected_email])[:10]]
             if user_history:
                 h_df = pd.DataFrame(user_history)
                 st.write("**ประวัติการวินิจฉัยล่าสุด**")
-                st.table(h_df[["datetime", "result", "glucose", "bmi", "age"]].head(10))
+                st.table(h_df[["datetime", "result", "glucose", "bmi", "age"]])
             else:
                 st.write("ยังไม่พบประวัติการวินิจฉัยของคนไข้รายนี้")
+
+    with st.expander("⚙️ เติมฟิลด์สำหรับค้นหาด้วย index"):
+        st.caption("ใช้กับผลที่บันทึกไว้ก่อนมีฟิลด์ risk_level / name_tokens หรือหลังผู้ใช้เปลี่ยนชื่อ")
+        if st.button("🔄 เติม risk_level และ name_tokens ให้ผลทั้งหมด"):
+            with st.spinner("กำลังอัปเดตข้อมูล..."):
+                profiles = {u["email"]: u for u in user_directory.search()}
+                updated = results_index.backfill(db, profiles)
+            st.success(f"✅ อัปเดตแล้ว {updated} รายการ")
+
+    # นำเข้าผลคัดกรองจากไฟล์ของคลินิก (อ่าน/ทำนาย/บันทึกทีละก้อน ดู bulk_screening.py)
+    with st.expander("📤 นำเข้าผลคัดกรองจากไฟล์ CSV / Excel"):
+        st.caption("คอลัมน์ที่ต้องมี: " + ", ".join(bulk_screening.REQUIRED_COLUMNS) +
+                   " · ไม่บังคับ: " + ", ".join(list(bulk_screening.OPTIONAL_COLUMNS) +
+                                               bulk_screening.BEHAVIOR_COLUMNS + bulk_screening.INFO_COLUMNS))
+        st.download_button("📄 ดาวน์โหลดไฟล์ตัวอย่าง", bulk_screening.template_csv(),
+                           file_name="screening_template.csv", mime="text/csv")
+        upload = st.file_uploader("เลือกไฟล์", type=["csv", "xlsx"], key="bulk_upload_file")
+        dry_run = st.checkbox("ตรวจสอบและทำนายอย่างเดียว (ยังไม่บันทึก)", key="bulk_upload_dry_run")
+        if upload is not None and st.button("🚀 เริ่มนำเข้า"):
+            progress = st.progress(0.0, text="กำลังอ่านไฟล์...")
+
+            def on_progress(done, total):
+                fraction = min(done / total, 1.0) if total else 0.0
+                progress.progress(fraction, text=f"ประมวลผลแล้ว {done:,} แถว" + (f" จาก {total:,}" if total else ""))
+
+            summary = bulk_screening.run(
+                db, predictor, upload, upload.name,
+                uploaded_by=st.session_state.get("user"),
+                chunk_size=st.secrets.get("app", {}).get("bulk_chunk_rows", bulk_screening.CHUNK_ROWS),
+                on_progress=on_progress, dry_run=dry_run,
+            )
+            if summary["written"]:
+                result_store.invalidate()
+                user_directory.invalidate()
+            if summary["error"]:
+                where = (f"บันทึกถึงแถว {summary['last_row']:,} ของไฟล์แล้ว · อัปโหลดไฟล์เดิมอีกครั้งเพื่อทำต่อ"
+                         if summary["last_row"] else "ยังไม่ได้บันทึกแถวใด")
+                st.error(f"❌ {summary['error']} ({where})")
+            else:
+                progress.progress(1.0, text="เสร็จแล้ว")
+                st.success(f"✅ {summary['rows']:,} แถว ใน {summary['seconds']:.1f} วินาที: "
+                           f"บันทึก {summary['written']:,} รายการ, ข้าม (เคยนำเข้าแล้ว) {summary['skipped']:,} รายการ, "
+                           f"เสี่ยง {summary['risky']:,} ราย, "
+                           f"ข้อมูลไม่ครบ {summary['invalid']:,} แถว (รหัสนำเข้า {summary['upload_id']})")
+            if summary["errors"]:
+                st.dataframe(pd.DataFrame(summary["errors"], columns=["แถวในไฟล์", "ปัญหา"]), hide_index=True)
     # ----------------------------
     # st.subheader("👤 ดูผลเฉพาะรายบุคคล")
 
@@ -1003,25 +1402,108 @@ def dashboard_page():
 
     st.subheader("📊 Dashboard ภาพรวมระบบ")
 
-    users = list(db.collection("users").stream())
-    results = list(db.collection("results").stream())
-
-    users_df = pd.DataFrame([u.to_dict() for u in users])
-    results_df = pd.DataFrame([r.to_dict() for r in results])
-
+    # นับจำนวนด้วย aggregation query ฝั่ง Firestore (ไม่ดึงเอกสารทั้งหมดลงมา)
+    results_ref = db.collection("results")
     col1, col2, col3 = st.columns(3)
-    col1.metric("👥 ผู้ใช้ทั้งหมด", len(users_df))
-    col2.metric("🧪 การทำนายทั้งหมด", len(results_df))
+    col1.metric("👥 ผู้ใช้ทั้งหมด", dashboard_stats.count(db.collection("users")))
+    col2.metric("🧪 การทำนายทั้งหมด", dashboard_stats.count(results_ref))
     col3.metric(
         "⚠ ผู้ที่เสี่ยง",
-        (results_df["result"] == "เสี่ยง").sum()
+        dashboard_stats.count(results_ref.where(filter=firestore.FieldFilter("result", "==", "เสี่ยง")))
     )
 
-    if not results_df.empty:
-        results_df["datetime"] = pd.to_datetime(results_df["datetime"])
-        st.line_chart(
-            results_df.groupby(results_df["datetime"].dt.date)["glucose"].mean()
-        )
+    # ค่าเฉลี่ย glucose รายวันจากเอกสารสรุปรายวัน (daily_stats)
+    daily = dashboard_stats.daily_glucose(db)
+    if daily:
+        st.line_chart(pd.Series(daily, name="glucose"))
+
+    # สถิติของตัวรวม batch การทำนาย (เฉพาะ process นี้)
+    if batcher is not None:
+        stats = batcher.stats()
+        st.markdown("##### ⚡ ประสิทธิภาพการทำนาย")
+        m1, m2, m3, m4 = st.columns(4)
+        m1.metric("คำขอทั้งหมด", stats["requests"])
+        m2.metric("Throughput (req/s)", f"{stats['throughput_rps']:.1f}")
+        m3.metric("Latency p50 / p99 (ms)", f"{stats['p50_ms']:.1f} / {stats['p99_ms']:.1f}")
+        m4.metric("ขนาด batch เฉลี่ย", f"{stats['avg_batch']:.1f}")
+
+    cache_stats = prediction_cache.stats()
+    st.caption(f"🗂️ แคชผลการทำนาย: hit {cache_stats['hits']} / miss {cache_stats['misses']} "
+               f"({cache_stats['hit_rate']:.0%}), เก็บอยู่ {cache_stats['size']} รายการ")
+
+    # รุ่นโมเดลที่ process นี้ใช้อยู่ (สลับรุ่นเองเมื่อ CURRENT ใน registry เปลี่ยน)
+    if predictor.manifest:
+        st.caption(f"🧠 โมเดลรุ่น {predictor.version} ({predictor.manifest['name']}, สร้างเมื่อ "
+                   f"{predictor.manifest['created']}), สลับรุ่นแล้ว {predictor.swaps} ครั้ง, "
+                   f"warm up {predictor.warmup_ms:.0f} ms")
+    else:
+        st.caption(f"🧠 ใช้โมเดลไฟล์ {MODEL_PKL} (model registry ยังไม่มีรุ่นที่ใช้งาน)")
+    if predictor.last_error:
+        in_use = "รุ่นเดิม" if predictor.manifest else f"โมเดลไฟล์ {MODEL_PKL}"
+        st.warning(f"โหลดโมเดลรุ่นใหม่ไม่สำเร็จ ยังใช้{in_use}อยู่: {predictor.last_error}")
+    # A/B และ shadow scoring: latency แยกตามรุ่นโมเดล (เฉพาะ process นี้)
+    if model_router.load_error:
+        st.warning(f"โหลดโมเดล candidate ไม่สำเร็จ: {model_router.load_error}")
+    router_stats = model_router.stats()
+    if model_router.retired:
+        st.info(f"โมเดล candidate {model_router.retired} ถูกใช้เป็นรุ่นหลักแล้ว หยุดแบ่งคำขอและ shadow "
+                f"(ลบ candidate_model ออกจาก secrets หรือเปลี่ยนเป็นรุ่นถัดไป)")
+    if (model_router.arms["candidate"] is not None or model_router.retired) and router_stats["histograms"]:
+        if model_router.arms["candidate"] is not None:
+            st.markdown(f"##### 🧪 โมเดล candidate {model_router.arms['candidate'].version}: "
+                        f"ให้บริการผู้ใช้ {model_router.percent}%" + (", shadow เปิดอยู่" if model_router.shadow else ""))
+        st.caption(f"เทียบผลแล้ว {router_stats['compared']} ครั้ง, ผลไม่ตรงกัน {router_stats['disagreed']} ครั้ง, "
+                   f"ข้าม shadow {router_stats['shadow_skipped']} ครั้ง, ใช้ primary แทน {router_stats['fallbacks']} ครั้ง")
+        # latency นับเฉพาะคำขอที่โมเดลทำนายจริง (ผลจากแคชแยกไว้ในคอลัมน์ cache hit)
+        hist_df = pd.DataFrame({name: h["buckets"] for name, h in router_stats["histograms"].items()})
+        st.bar_chart(hist_df, x_label="latency (ms)", y_label="จำนวนคำขอ", sort=False, stack=False)
+        st.dataframe(pd.DataFrame([
+            {"โมเดล": name, "ทำนายจริง": h["count"], "cache hit": h["cache_hits"],
+             "hit rate (%)": round(h["hit_rate"] * 100, 1), "เฉลี่ย (ms)": round(h["mean_ms"], 2),
+             "p50 (ms)": h["p50_ms"], "p99 (ms)": h["p99_ms"]}
+            for name, h in router_stats["histograms"].items()
+        ]), hide_index=True)
+
+    registry_versions = predictor.registry.versions()
+    if registry_versions:
+        with st.expander("⚙️ เปลี่ยนรุ่นโมเดล"):
+            chosen = st.selectbox(
+                "รุ่นโมเดล", list(reversed(registry_versions)),
+                format_func=lambda v: f"{v} · {predictor.registry.manifest(v)['name']} · "
+                                      f"{predictor.registry.manifest(v)['metrics']}",
+            )
+            if st.button("🚀 ใช้รุ่นนี้"):
+                predictor.registry.promote(chosen)
+                with st.spinner("กำลังโหลดและ warm up โมเดล..."):
+                    predictor.reload()
+                st.success(f"✅ ใช้โมเดลรุ่น {predictor.version} แล้ว (worker อื่นจะสลับตามภายใน "
+                           f"{predictor.interval} วินาที)")
+
+    if write_queue is not None:
+        st.caption(f"📝 คิวบันทึกผล: ค้าง {write_queue.pending()} งาน, เขียนแล้ว {write_queue.flushed} งาน, "
+                   f"ล้มเหลว {write_queue.failures} ครั้ง" +
+                   (f" (ล่าสุด: {write_queue.last_error})" if write_queue.last_error else ""))
+        dead = write_queue.dead_letters()
+        if dead:
+            # งานที่ล้มเหลวครบจำนวนครั้งแล้ว (ข้อมูลหรือสิทธิ์ผิด) ถูกพักไว้ใน dead_letter ของ spool
+            st.warning(f"⚠️ มีงานบันทึกผลที่ล้มเหลวจนถูกพักไว้ {dead} งาน")
+            if st.button("🔁 ลองบันทึกงานที่ถูกพักไว้อีกครั้ง"):
+                st.success(f"✅ นำกลับเข้าคิว {write_queue.requeue_dead()} งาน")
+
+    from firebase_auth import auth_stats
+    for endpoint, s in auth_stats().items():
+        st.caption(f"🔐 Firebase Auth `{endpoint}`: {s['requests']} ครั้ง, ผิดพลาด {s['errors']}, "
+                   f"ลองใหม่ {s['retries']}, p50 {s['p50_ms']:.0f} ms / p99 {s['p99_ms']:.0f} ms")
+    token_stats = session_store.stats()
+    st.caption(f"🎫 Session ที่ถือ token อยู่ {token_stats['sessions']} รายการ, ต่ออายุแล้ว {token_stats['refreshed']} ครั้ง")
+
+    with st.expander("⚙️ สรุปข้อมูลรายวันใหม่"):
+        st.caption("ใช้เมื่อกราฟไม่ตรงกับข้อมูลจริง เช่น มีผลที่บันทึกไว้ก่อนเปิดใช้สรุปรายวัน")
+        if st.button("🔄 สร้างสรุปรายวันใหม่จากผลทั้งหมด"):
+            with st.spinner("กำลังสรุปข้อมูล..."):
+                days = dashboard_stats.rebuild_daily(db)
+            st.success(f"✅ สรุปข้อมูลใหม่แล้ว {days} วัน")
+            st.rerun()
 
 #19.หน้าให้ความรู้เกี่ยวกับโรคเบาหวาน
 def about_page():
@@ -1257,25 +1739,37 @@ else:
         "โปรไฟล์ของฉัน"
     ]
 
-# --- ส่วนการแสดงเนื้อหาหลัก (ย้ายมาไว้ด้านบนสุดของเนื้อหา) ---
-tabs = st.tabs([f" {m}" for m in menu]) # สร้างแท็บตามรายการ menu
-
-for i, tab in enumerate(tabs):
-    with tab:
-        current_menu = menu[i]
-        # เรียกฟังก์ชันหน้าต่างๆ ตามชื่อเมนู
-        if current_menu == "วินิจฉัยโรคเบาหวาน":
-            diabetes_page()
-        elif current_menu == "ผลย้อนหลัง":
-            history_page()
-        elif current_menu == "โปรไฟล์ของฉัน":
-            profile_page()
-        elif current_menu == "เกี่ยวกับโรคเบาหวาน":
-            about_page()
-        elif current_menu == "Dashboard":
-            dashboard_page()
-        elif current_menu == "ระบบแอดมิน":
-            admin_page()
-        elif current_menu == "ระบบค้นหาประวัติคนไข้":
-            admin_results_page()
+# --- ส่วนการแสดงเนื้อหาหลัก ---
+PAGES = {
+    "วินิจฉัยโรคเบาหวาน": diabetes_page,
+    "ผลย้อนหลัง": history_page,
+    "โปรไฟล์ของฉัน": profile_page,
+    "เกี่ยวกับโรคเบาหวาน": about_page,
+    "Dashboard": dashboard_page,
+    "ระบบแอดมิน": admin_page,
+    "ระบบค้นหาประวัติคนไข้": admin_results_page,
+}
+
+# โหมดนำทาง: "lazy" (ค่าเริ่มต้น) รันเฉพาะหน้าที่เลือก / "tabs" แบบเดิมที่รันทุกหน้าในทุก rerun
+NAV_MODE = st.secrets.get("app", {}).get("nav_mode", "lazy")
+
+if NAV_MODE == "tabs":
+    tabs = st.tabs([f" {m}" for m in menu]) # สร้างแท็บตามรายการ menu
 
+    for i, tab in enumerate(tabs):
+        with tab:
+            PAGES[menu[i]]()
+else:
+    # ถ้าสิทธิ์เปลี่ยนจนเมนูเดิมไม่อยู่ในรายการแล้ว ให้กลับไปหน้าแรก
+    if st.session_state.get("current_menu") not in menu:
+        st.session_state.current_menu = menu[0]
+
+    current_menu = st.radio(
+        "เมนู", menu, key="current_menu",
+        horizontal=True, label_visibility="collapsed"
+    )
+    PAGES[current_menu]()
+
+# แสดงจำนวน Firestore reads ของ rerun นี้ (เฉพาะแอดมิน เพื่อใช้ตรวจสอบประสิทธิภาพ)
+if user_profile.get("role") == "admin":
+    st.sidebar.caption(f"📡 Firestore reads (รอบนี้): {firestore_reads.count()}")
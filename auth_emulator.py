@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# เซิร์ฟเวอร์ Firebase Auth จำลองสำหรับทดสอบบนเครื่อง (ไม่ต้องเชื่อมต่อ Google)
+# รองรับ endpoint ที่ firebase_auth.py เรียก: accounts:signUp, accounts:signInWithPassword และ token (ต่ออายุ)
+# - path เหมือน Firebase Auth Emulator: /identitytoolkit.googleapis.com/v1/accounts:<method>
+#   และ /securetoken.googleapis.com/v1/token
+# - ข้อความ error ใช้รูปแบบเดียวกับของจริง ({"error": {"code", "message", "errors"}})
+# - idToken เป็น JWT แบบไม่เซ็น (alg "none") ตามที่ Firebase Emulator ออกให้
+# - เก็บผู้ใช้ในหน่วยความจำ รหัสผ่านแฮชด้วย scrypt เพื่อให้ต้นทุน CPU ใกล้เคียงของจริง
+# ตั้ง latency_ms / error_rate เพื่อจำลองเครือข่ายช้าหรือ 503 (ใช้ทดสอบการ retry)
+PROJECT_ID = os.environ.get("GCLOUD_PROJECT", "demo-diabetes-checker")
+TOKEN_LIFETIME = 3600
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def make_id_token(uid, email, project_id=PROJECT_ID, lifetime=TOKEN_LIFETIME):
+    now = int(time.time())
+    header = {"alg": "none", "typ": "JWT"}
+    claims = {
+        "iss": f"https://securetoken.google.com/{project_id}",
+        "aud": project_id,
+        "auth_time": now,
+        "user_id": uid,
+        "sub": uid,
+        "iat": now,
+        "exp": now + lifetime,
+        "email": email,
+        "email_verified": False,
+        "firebase": {"identities": {"email": [email]}, "sign_in_provider": "password"},
+    }
+    return f"{_b64(json.dumps(header).encode())}.{_b64(json.dumps(claims).encode())}."
+
+
+class AuthState:
+    def __init__(self, scrypt_n=2 ** 12, latency_ms=0, error_rate=0.0):
+        self.scrypt_n = scrypt_n
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._users = {}
+        self._refresh_tokens = {}
+
+    def _hash(self, password, salt):
+        return hashlib.scrypt(password.encode(), salt=salt, n=self.scrypt_n, r=8, p=1)
+
+    def _session(self, user):
+        refresh_token = uuid.uuid4().hex
+        with self._lock:
+            self._refresh_tokens[refresh_token] = user["email"]
+        return {
+            "kind": "identitytoolkit#VerifyPasswordResponse",
+            "localId": user["uid"],
+            "email": user["email"],
+            "idToken": make_id_token(user["uid"], user["email"]),
+            "refreshToken": refresh_token,
+            "expiresIn": str(TOKEN_LIFETIME),
+        }
+
+    def sign_up(self, body):
+        email = (body.get("email") or "").strip().lower()
+        password = body.get("password") or ""
+        if not EMAIL_RE.match(email):
+            return 400, "INVALID_EMAIL"
+        if len(password) < 6:
+            return 400, "WEAK_PASSWORD : Password should be at least 6 characters"
+        salt = os.urandom(16)
+        user = {"uid": uuid.uuid4().hex[:28], "email": email, "salt": salt,
+                "hash": self._hash(password, salt)}
+        with self._lock:
+            if email in self._users:
+                return 400, "EMAIL_EXISTS"
+            self._users[email] = user
+        return 200, self._session(user)
+
+    def sign_in(self, body):
+        email = (body.get("email") or "").strip().lower()
+        with self._lock:
+            user = self._users.get(email)
+        if user is None or self._hash(body.get("password") or "", user["salt"]) != user["hash"]:
+            return 400, "INVALID_LOGIN_CREDENTIALS"
+        return 200, self._session(user)
+
+    def refresh(self, body):
+        if body.get("grant_type") != "refresh_token":
+            return 400, "INVALID_GRANT_TYPE"
+        with self._lock:
+            email = self._refresh_tokens.get(body.get("refresh_token"))
+            user = self._users.get(email)
+        if user is None:
+            return 400, "INVALID_REFRESH_TOKEN"
+        return 200, {
+            "expires_in": str(TOKEN_LIFETIME),
+            "token_type": "Bearer",
+            "refresh_token": body["refresh_token"],
+            "id_token": make_id_token(user["uid"], user["email"]),
+            "user_id": user["uid"],
+            "project_id": PROJECT_ID,
+        }
+
+
+class AuthHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive ให้ connection pool ของ client ใช้ซ้ำได้
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message):
+        self._send(status, {"error": {"code": status, "message": message,
+                                      "errors": [{"message": message, "domain": "global", "reason": "invalid"}]}})
+
+    def do_POST(self):
+        state = self.server.state
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._error(400, "INVALID_JSON")
+
+        if state.latency_ms:
+            time.sleep(state.latency_ms / 1000)
+        if state.error_rate and random.random() < state.error_rate:
+            return self._error(503, "UNAVAILABLE")
+
+        method = urlparse(self.path).path.rsplit("/", 1)[-1]
+        if method == "accounts:signUp":
+            status, result = state.sign_up(body)
+        elif method == "accounts:signInWithPassword":
+            status, result = state.sign_in(body)
+        elif method == "token":
+            status, result = state.refresh(body)
+        else:
+            return self._error(404, f"NOT_FOUND : {method}")
+        if status != 200:
+            return self._error(status, result)
+        self._send(status, result)
+
+
+def start_server(host="127.0.0.1", port=9099, **state_options):
+    # เปิดเซิร์ฟเวอร์ใน thread เบื้องหลัง คืนค่า server (เรียก server.shutdown() เพื่อปิด)
+    server = ThreadingHTTPServer((host, port), AuthHandler)
+    server.daemon_threads = True
+    server.state = AuthState(**state_options)
+    threading.Thread(target=server.serve_forever, name="auth-emulator", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    host, _, port = (sys.argv[1] if len(sys.argv) > 1 else "127.0.0.1:9099").partition(":")
+    server = ThreadingHTTPServer((host, int(port or 9099)), AuthHandler)
+    server.daemon_threads = True
+    server.state = AuthState(
+        latency_ms=float(os.environ.get("AUTH_EMULATOR_LATENCY_MS", 0)),
+        error_rate=float(os.environ.get("AUTH_EMULATOR_ERROR_RATE", 0)),
+    )
+    print(f"🔐 Firebase Auth จำลองที่ http://{host}:{server.server_port}")
+    print(f"   ตั้งค่า FIREBASE_AUTH_EMULATOR_HOST={host}:{server.server_port} ก่อนเปิดแอป")
+    server.serve_forever()
@@ -0,0 +1,69 @@
+import argparse
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# ทดสอบโหลดเส้นทางล็อกอิน: สมัครสมาชิก N คน แล้วล็อกอิน N ครั้งพร้อมกันหลาย thread
+# เรียกผ่าน firebase_auth.py ตัวจริง (connection pool, timeout, retry) ไปยังเซิร์ฟเวอร์ที่
+# FIREBASE_AUTH_EMULATOR_HOST ชี้อยู่ ถ้าไม่ได้ตั้งไว้จะเปิด auth_emulator.py ใน process นี้ให้เอง
+#
+#   python auth_loadtest.py --users 500 --concurrency 32
+#   python auth_loadtest.py --latency-ms 40 --error-rate 0.05   # จำลองเครือข่ายช้า + 503
+
+
+def _run_phase(label, fn, jobs, concurrency):
+    def timed(args):
+        started = time.perf_counter()
+        result = fn(*args)
+        return time.perf_counter() - started, "idToken" in result
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, jobs))
+    elapsed = time.perf_counter() - started
+
+    ms = np.array([r[0] for r in results]) * 1000
+    errors = sum(1 for r in results if not r[1])
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    print(f"{label:<10} {len(jobs):>6} ครั้ง | {len(jobs) / elapsed:8.1f} req/s | "
+          f"p50 {p50:7.1f} ms | p95 {p95:7.1f} ms | p99 {p99:7.1f} ms | max {ms.max():7.1f} ms | "
+          f"ผิดพลาด {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ทดสอบโหลดการสมัคร/ล็อกอินผ่าน firebase_auth.py")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=0, help="หน่วงเวลาฝั่งเซิร์ฟเวอร์จำลอง")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="สัดส่วนคำขอที่ตอบ 503")
+    parser.add_argument("--scrypt-n", type=int, default=2 ** 12,
+                        help="ต้นทุนแฮชรหัสผ่านของเซิร์ฟเวอร์จำลอง (ลดลงเพื่อวัดเฉพาะฝั่ง client)")
+    args = parser.parse_args()
+
+    server = None
+    if not os.environ.get("FIREBASE_AUTH_EMULATOR_HOST"):
+        from auth_emulator import start_server
+        server = start_server(port=0, scrypt_n=args.scrypt_n,
+                              latency_ms=args.latency_ms, error_rate=args.error_rate)
+        os.environ["FIREBASE_AUTH_EMULATOR_HOST"] = f"127.0.0.1:{server.server_port}"
+
+    # import หลังตั้ง FIREBASE_AUTH_EMULATOR_HOST เพราะ firebase_auth อ่านค่าตอน import
+    import firebase_auth
+
+    print(f"ปลายทาง: {firebase_auth.AUTH_BASE_URL} | ผู้ใช้ {args.users} คน | พร้อมกัน {args.concurrency} thread")
+    run_id = uuid.uuid4().hex[:6]
+    accounts = [(f"load{run_id}-{i}@example.com", f"pw-{i}-secret") for i in range(args.users)]
+    _run_phase("signUp", firebase_auth.firebase_register, accounts, args.concurrency)
+    _run_phase("signIn", firebase_auth.firebase_login, accounts, args.concurrency)
+
+    for endpoint, s in firebase_auth.auth_stats().items():
+        print(f"  {endpoint}: ลองใหม่ {s['retries']} ครั้ง, ล้มเหลวหลังลองใหม่ {s['errors']} ครั้ง")
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import hashlib
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from firebase_admin import auth
+
+import firebase_auth
+
+# ตรวจ idToken ในเครื่องด้วย firebase_admin.auth.verify_id_token
+# (public key ของ Google ถูกแคชตาม Cache-Control ภายใน firebase_admin อยู่แล้ว)
+# และจำผลที่ตรวจผ่านแล้วไว้ตามแฮชของ token จนกว่า token จะหมดอายุ rerun ถัดไปจึงไม่ต้องตรวจลายเซ็นซ้ำ
+MAX_VERIFIED = 10_000
+CLOCK_SKEW_SECONDS = 10
+# ข้อความ error จาก securetoken ที่หมายถึงต้องล็อกอินด้วยรหัสผ่านใหม่
+REFRESH_REJECTED = ("INVALID_REFRESH_TOKEN", "TOKEN_EXPIRED", "USER_DISABLED", "USER_NOT_FOUND",
+                    "INVALID_GRANT_TYPE", "MISSING_REFRESH_TOKEN")
+# ผลของ SessionStore.resume()
+RESUMED = "resumed"
+INVALID = "invalid"            # session ไม่มีอยู่/ถูกเพิกถอน ต้องล็อกอินใหม่
+UNVERIFIABLE = "unverifiable"  # ตรวจไม่ได้ชั่วคราว (ดึง public key หรือต่ออายุ token ไม่ได้) ยังไม่ต้องออกจากระบบ
+
+_verified_lock = threading.Lock()
+_verified = OrderedDict()
+
+
+def verify(id_token):
+    # คืนค่า claims ของ token (โยน exception ของ firebase_admin ถ้าไม่ผ่าน)
+    key = hashlib.sha256(id_token.encode()).hexdigest()
+    now = time.time()
+    with _verified_lock:
+        claims = _verified.get(key)
+        if claims is not None:
+            if claims["exp"] > now:
+                _verified.move_to_end(key)
+                return claims
+            del _verified[key]
+
+    claims = auth.verify_id_token(id_token, clock_skew_seconds=CLOCK_SKEW_SECONDS)
+    with _verified_lock:
+        _verified[key] = claims
+        while len(_verified) > MAX_VERIFIED:
+            _verified.popitem(last=False)
+    return claims
+
+
+class TokenSession:
+    def __init__(self, email, id_token, refresh_token, expires_in):
+        self.email = email
+        self.lock = threading.Lock()
+        self.last_seen = time.time()
+        self._set(id_token, refresh_token, expires_in)
+
+    def _set(self, id_token, refresh_token, expires_in):
+        self.id_token = id_token
+        self.refresh_token = refresh_token
+        self.expires_at = time.time() + int(expires_in)
+
+    def refresh(self):
+        # แลก refreshToken เป็น idToken ใหม่ คืนค่า False ถ้า refreshToken ใช้ไม่ได้แล้ว
+        # (ถูกเพิกถอน/ผู้ใช้ถูกลบหรือปิดใช้งาน) และโยน RuntimeError ถ้าเป็นปัญหาชั่วคราวของเครือข่าย
+        result = firebase_auth.firebase_refresh(self.refresh_token)
+        if "id_token" in result:
+            self._set(result["id_token"], result["refresh_token"], result["expires_in"])
+            return True
+        message = result.get("error", {}).get("message", "")
+        if message.startswith(REFRESH_REJECTED):
+            return False
+        raise RuntimeError(message or "ต่ออายุ token ไม่สำเร็จ")
+
+
+# เก็บคู่ idToken/refreshToken ของทุก session ที่ล็อกอินไว้ (ฝั่งเซิร์ฟเวอร์ ใช้ร่วมกันทั้ง process)
+# - start(): เรียกหลัง firebase_login สำเร็จ คืนค่า sid สำหรับกลับเข้าระบบภายหลัง
+# - resume(): ตรวจ idToken ในเครื่อง ถ้าใกล้หมดอายุจะต่ออายุด้วย refreshToken (ไม่ต้องใช้รหัสผ่าน)
+#   คืนค่า (RESUMED, อีเมล) / (INVALID, None) / (UNVERIFIABLE, อีเมล) เมื่อเครือข่ายมีปัญหาชั่วคราว
+# - worker เบื้องหลังต่ออายุ token ของ session ที่ยังใช้งานอยู่ก่อนหมดอายุ refresh_margin วินาที
+# - session ที่ไม่ได้ใช้เกิน idle_seconds จะถูกลบ ต้องล็อกอินด้วยรหัสผ่านใหม่
+class SessionStore:
+    def __init__(self, idle_seconds=12 * 3600, refresh_margin=300, active_seconds=3600, interval=30):
+        self.idle_seconds = idle_seconds
+        self.refresh_margin = refresh_margin
+        self.active_seconds = active_seconds
+        self.interval = interval
+        self.refreshed = 0
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._thread = threading.Thread(target=self._run, name="token-refresher", daemon=True)
+        self._thread.start()
+
+    def start(self, email, login_result):
+        # ตรวจ idToken ที่ได้จากการล็อกอิน แล้วเก็บคู่ token ไว้ คืนค่า sid
+        claims = verify(login_result["idToken"])
+        if claims.get("email", "").lower() != email.strip().lower():
+            raise ValueError("idToken ไม่ตรงกับอีเมลที่ล็อกอิน")
+        sid = secrets.token_urlsafe(24)
+        with self._lock:
+            self._sessions[sid] = TokenSession(
+                email, login_result["idToken"], login_result["refreshToken"], login_result.get("expiresIn", 3600)
+            )
+        return sid
+
+    def resume(self, sid):
+        # คืนค่า (สถานะ, อีเมล) ดูค่าสถานะที่ RESUMED / INVALID / UNVERIFIABLE
+        with self._lock:
+            tokens = self._sessions.get(sid)
+        if tokens is None:
+            return INVALID, None
+        with tokens.lock:
+            refresh_failed = False
+            if tokens.expires_at - time.time() < self.refresh_margin:
+                try:
+                    if not tokens.refresh():
+                        self.end(sid)
+                        return INVALID, None
+                    self.refreshed += 1
+                except RuntimeError:
+                    # เครือข่ายมีปัญหา ใช้ idToken เดิมต่อถ้ายังไม่หมดอายุ
+                    refresh_failed = True
+            try:
+                claims = verify(tokens.id_token)
+            except auth.CertificateFetchError:
+                # ดึง public key ไม่ได้ชั่วคราว ไม่ลบ session ให้ลองใหม่รอบถัดไป
+                return UNVERIFIABLE, tokens.email
+            except auth.ExpiredIdTokenError:
+                if refresh_failed:
+                    # token หมดอายุเพราะต่ออายุไม่ได้ชั่วคราว ไม่ใช่เพราะถูกเพิกถอน
+                    return UNVERIFIABLE, tokens.email
+                self.end(sid)
+                return INVALID, None
+            except (ValueError, auth.InvalidIdTokenError):
+                self.end(sid)
+                return INVALID, None
+        if claims.get("email", "").lower() != tokens.email.strip().lower():
+            self.end(sid)
+            return INVALID, None
+        tokens.last_seen = time.time()
+        return RESUMED, tokens.email
+
+    def end(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def end_user(self, email):
+        # ลบทุก session ของผู้ใช้ (เช่น เมื่อแอดมินลบบัญชี) ไม่ต้องรอให้ token หมดอายุ
+        with self._lock:
+            for sid in [sid for sid, t in self._sessions.items() if t.email.lower() == email.lower()]:
+                del self._sessions[sid]
+
+    def stats(self):
+        with self._lock:
+            n = len(self._sessions)
+        return {"sessions": n, "refreshed": self.refreshed}
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.time()
+            with self._lock:
+                items = list(self._sessions.items())
+            for sid, tokens in items:
+                if now - tokens.last_seen > self.idle_seconds:
+                    self.end(sid)
+                    continue
+                # ต่ออายุเฉพาะ session ที่เพิ่งใช้งาน ส่วน session ที่พักไว้จะต่ออายุตอน resume()
+                if now - tokens.last_seen > self.active_seconds:
+                    continue
+                if tokens.expires_at - now >= self.refresh_margin:
+                    continue
+                if not tokens.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if tokens.refresh():
+                        self.refreshed += 1
+                    else:
+                        self.end(sid)
+                except RuntimeError:
+                    # เครือข่ายมีปัญหา ปล่อยให้รอบถัดไปหรือ resume() ลองใหม่
+                    pass
+                finally:
+                    tokens.lock.release()
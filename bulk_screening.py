@@ -0,0 +1,356 @@
+import csv
+import hashlib
+import io
+import time
+import zipfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from firebase_admin import firestore
+from google.api_core.exceptions import GoogleAPICallError
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+
+import dashboard_stats
+import user_stats
+from risk_status import RISK_KEYS, risk_codes
+from user_directory import search_tokens
+from write_behind import MAX_BATCH_WRITES, apply_writes
+
+# นำเข้าผลคัดกรองจากไฟล์ CSV/XLSX ของคลินิก (หน้าแอดมิน)
+# - อ่านไฟล์ทีละก้อน (pandas chunksize / openpyxl แบบ read_only) ไม่สร้างตารางของทั้งไฟล์ในหน่วยความจำ
+# - ตรวจและเติมค่าเหมือนฟอร์มใน diabetes_page: น้ำหนัก ส่วนสูง อายุ น้ำตาล ความดัน ต้องมากกว่า 0,
+#   BMI คำนวณจากน้ำหนัก/ส่วนสูง, skin_thickness = 20, diabetes_pedigree จากจำนวนญาติที่เป็นเบาหวาน
+# - ทำนายทั้งก้อนเป็น matrix เดียว แล้วเขียนผลด้วย WriteBatch ละไม่เกิน 500 รายการ
+# - แต่ละ batch ครบในตัว: ผลของแถวในช่วงนั้น + สรุปรายวัน/สรุปของผู้ใช้ของแถวเหล่านั้น + เอกสารบันทึกว่า
+#   batch นี้เขียนแล้ว (bulk_uploads/{upload_id}/batches/{แถวแรก}-{แถวสุดท้าย}) จึงสำเร็จหรือล้มเหลวทั้งก้อน
+# - upload_id มาจาก sha256 ของเนื้อไฟล์: อัปโหลดไฟล์เดิมซ้ำ (เช่น retry หลังล้มเหลวกลางทาง) จะข้าม batch
+#   ที่เขียนไปแล้ว ตัวนับรายวัน/ของผู้ใช้จึงไม่ถูกบวกซ้ำ (ใช้ chunk_size เดิม ช่วงแถวของแต่ละ batch จึงตรงกัน)
+CHUNK_ROWS = 2000
+MAX_ERRORS = 200
+
+# ค่าที่ฟอร์มใช้ (diabetes_page ใช้ค่าชุดเดียวกันนี้)
+SKIN_THICKNESS = 20
+PEDIGREE_MAP = {"ไม่มีประวัติ": 0.2, "มี 1 ท่าน": 0.5, "มีมากกว่า 1 ท่าน": 0.8}
+
+REQUIRED_COLUMNS = ["weight", "height_cm", "age", "glucose", "blood_pressure"]
+# คอลัมน์ที่ไม่บังคับ: ค่าเริ่มต้นเหมือนฟอร์ม (0 = ไม่มีผลตรวจ / ไม่มีประวัติ / ไม่มีอาการ)
+OPTIONAL_COLUMNS = {"pregnancies": 0, "insulin": 0, "family_history": 0}
+BEHAVIOR_COLUMNS = ["q_sugar", "q_night", "q_wound", "q_family"]
+INFO_COLUMNS = ["email", "name", "screened_at"]
+TEMPLATE_COLUMNS = REQUIRED_COLUMNS + list(OPTIONAL_COLUMNS) + BEHAVIOR_COLUMNS + INFO_COLUMNS
+TRUE_VALUES = {"1", "1.0", "true", "yes", "y", "x", "ใช่", "มี"}
+
+
+# ไฟล์อ่านไม่ได้หรือไม่มีคอลัมน์ที่จำเป็น (run() แสดงเป็นข้อความ ส่วน ValueError อื่นเป็นบั๊กที่ต้องโยนต่อ)
+class FileFormatError(Exception):
+    pass
+
+
+def template_csv():
+    # ไฟล์ตัวอย่างสำหรับให้คลินิกกรอก
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(TEMPLATE_COLUMNS)
+    writer.writerow([65, 165, 45, 110, 80, 0, 0, 1, 1, 0, 0, 1, "patient@example.com", "สมชาย ใจดี", "2025-01-31"])
+    return out.getvalue().encode("utf-8-sig")
+
+
+def _scan(file):
+    # อ่านทีละ 1 MB: คืนค่า (sha256 ของเนื้อไฟล์, จำนวนบรรทัด) แล้วกลับไปต้นไฟล์
+    digest = hashlib.sha256()
+    lines = 0
+    for block in iter(lambda: file.read(1 << 20), b""):
+        digest.update(block)
+        lines += block.count(b"\n")
+    file.seek(0)
+    return digest.hexdigest(), lines
+
+
+def _parsed(chunks):
+    # ข้อผิดพลาดของการแยกข้อมูล (CSV ผิดรูปแบบ, ไม่ใช่ UTF-8) เกิดตอนอ่านก้อนถัดไป
+    while True:
+        try:
+            df = next(chunks)
+        except StopIteration:
+            return
+        except ValueError as e:
+            raise FileFormatError(f"อ่านไฟล์ไม่ได้: {e}") from e
+        yield df
+
+
+def read_chunks(file, filename, chunk_size=CHUNK_ROWS):
+    # คืนค่า (sha256 ของไฟล์, จำนวนแถวโดยประมาณ หรือ None, generator ของ DataFrame ทีละ chunk_size แถว)
+    # index ของ DataFrame = ลำดับแถวข้อมูลในไฟล์ (เริ่มที่ 0) ใช้บอกแถวที่ผิดพลาด
+    digest, lines = _scan(file)
+    if filename.lower().endswith((".xlsx", ".xlsm")):
+        try:
+            wb = load_workbook(file, read_only=True, data_only=True)
+        except ValueError as e:
+            raise FileFormatError(f"เปิดไฟล์ Excel ไม่ได้: {e}") from e
+        ws = wb.worksheets[0]
+        total = ws.max_row - 1 if ws.max_row else None
+
+        def chunks():
+            try:
+                rows = ws.iter_rows(values_only=True)
+                header = [str(h) if h is not None else "" for h in next(rows, ())]
+                buffer, index = [], []
+                for i, row in enumerate(rows):
+                    # ข้ามแถวว่าง (มักมีท้ายชีตที่เคยจัดรูปแบบไว้)
+                    if any(v is not None and v != "" for v in row):
+                        buffer.append(row)
+                        index.append(i)
+                    if len(buffer) == chunk_size:
+                        yield pd.DataFrame(buffer, columns=header, index=index, dtype=object)
+                        buffer, index = [], []
+                if buffer:
+                    yield pd.DataFrame(buffer, columns=header, index=index, dtype=object)
+            finally:
+                wb.close()
+        return digest, total, _parsed(chunks())
+
+    total = max(lines - 1, 0)
+    try:
+        reader = pd.read_csv(file, chunksize=chunk_size, dtype=str, encoding="utf-8-sig", skip_blank_lines=True)
+    except ValueError as e:
+        raise FileFormatError(f"อ่านไฟล์ไม่ได้: {e}") from e
+    return digest, total, _parsed(iter(reader))
+
+
+def _normalize_columns(df):
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    missing = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if missing:
+        raise FileFormatError(f"ไฟล์ไม่มีคอลัมน์ที่จำเป็น: {', '.join(missing)}")
+    return df
+
+
+def _number(df, column, default=None):
+    # ช่องว่างใช้ค่าเริ่มต้น (ถ้ามี) ส่วนข้อความที่ไม่ใช่ตัวเลขเป็น NaN เสมอ (ไม่ผ่านการตรวจ)
+    if column not in df.columns:
+        return pd.Series(np.nan if default is None else default, index=df.index, dtype=float)
+    values = pd.to_numeric(df[column], errors="coerce")
+    if default is not None:
+        values = values.where(df[column].notna(), default)
+    return values
+
+
+def _plain(value):
+    # ตัวเลขจำนวนเต็มเก็บเป็น int เหมือนค่าจากฟอร์ม
+    return int(value) if float(value).is_integer() else float(value)
+
+
+def _flag(df, column):
+    if column not in df.columns:
+        return pd.Series(False, index=df.index)
+    return df[column].map(lambda v: str(v).strip().lower() in TRUE_VALUES if v is not None else False)
+
+
+def _dates(values):
+    # รับทั้ง ISO (2025-01-31) และแบบวัน/เดือน/ปี (31/01/2025) ค่าที่อ่านไม่ได้เป็น NaT (ใช้เวลานำเข้าแทน)
+    iso = pd.to_datetime(values, errors="coerce", format="ISO8601")
+    return iso.fillna(pd.to_datetime(values, errors="coerce", format="%d/%m/%Y"))
+
+
+def _pedigree(df):
+    # family_history: จำนวนญาติสายตรงที่เป็นเบาหวาน (0, 1, 2 ขึ้นไป) หรือข้อความเดียวกับตัวเลือกในฟอร์ม
+    if "family_history" not in df.columns:
+        return pd.Series(PEDIGREE_MAP["ไม่มีประวัติ"], index=df.index)
+    raw = df["family_history"]
+    by_label = raw.map(lambda v: PEDIGREE_MAP.get(str(v).strip()) if v is not None else None)
+    count = pd.to_numeric(raw, errors="coerce").where(raw.notna(), 0)
+    by_count = np.select(
+        [count >= 2, count == 1, count == 0],
+        [PEDIGREE_MAP["มีมากกว่า 1 ท่าน"], PEDIGREE_MAP["มี 1 ท่าน"], PEDIGREE_MAP["ไม่มีประวัติ"]],
+        default=np.nan,
+    )
+    return by_label.astype(float).fillna(pd.Series(by_count, index=df.index))
+
+
+def prepare(df):
+    # แปลงข้อมูลหนึ่งก้อนให้อยู่ในรูปเดียวกับที่ฟอร์มส่งให้โมเดล
+    # คืนค่า (DataFrame ของแถวที่ถูกต้อง, list ของ (แถวในไฟล์, เหตุผล) ที่ไม่ผ่าน)
+    df = _normalize_columns(df)
+    out = pd.DataFrame(index=df.index)
+    for column in REQUIRED_COLUMNS:
+        out[column] = _number(df, column)
+    for column, default in OPTIONAL_COLUMNS.items():
+        if column != "family_history":
+            out[column] = _number(df, column, default)
+    out["skin_thickness"] = SKIN_THICKNESS
+    out["diabetes_pedigree"] = _pedigree(df)
+    out["bmi"] = out["weight"] / (out["height_cm"] / 100) ** 2
+    out["behavior_score"] = sum(_flag(df, c).astype(int) for c in BEHAVIOR_COLUMNS)
+    out["email"] = df["email"].str.strip().str.lower() if "email" in df.columns else None
+    out["name"] = df["name"].fillna("").astype(str).str.strip() if "name" in df.columns else ""
+    out["screened_at"] = _dates(df["screened_at"]) if "screened_at" in df.columns else pd.NaT
+    out["row"] = df.index + 2  # แถวที่ 1 ของไฟล์คือหัวตาราง
+
+    # เงื่อนไขเดียวกับฟอร์ม: ค่าที่จำเป็นต้องมากกว่า 0
+    reasons = pd.Series("", index=df.index, dtype=object)
+    for column in REQUIRED_COLUMNS:
+        bad = ~(out[column] > 0)
+        reasons = reasons.where(~bad | (reasons != ""), f"{column} ต้องเป็นตัวเลขมากกว่า 0")
+    for column in ["pregnancies", "insulin"]:
+        bad = out[column].isna() | (out[column] < 0)
+        reasons = reasons.where(~bad | (reasons != ""), f"{column} ต้องเป็นตัวเลขตั้งแต่ 0")
+    reasons = reasons.where(out["diabetes_pedigree"].notna() | (reasons != ""), "family_history ไม่ถูกต้อง")
+
+    invalid = reasons != ""
+    errors = list(zip(out.loc[invalid, "row"].tolist(), reasons[invalid].tolist()))
+    return out[~invalid], errors
+
+
+def score(predictor, prepared):
+    # ทำนายทั้งก้อนในครั้งเดียว (ลำดับคอลัมน์ตาม prediction_service.FEATURES)
+    # รุ่นโมเดลมาจากการทำนายครั้งเดียวกัน (ถ้าโมเดลสลับรุ่นระหว่างนำเข้า แต่ละก้อนยังระบุรุ่นที่ทำนายจริง)
+    X = np.column_stack([
+        prepared["pregnancies"], prepared["glucose"], prepared["blood_pressure"], prepared["skin_thickness"],
+        prepared["insulin"], prepared["bmi"], prepared["diabetes_pedigree"], prepared["age"],
+    ]).astype(np.float64)
+    labels, _, version = predictor.predict_with_version(X)
+    # เหมือนฟอร์ม: ผลโมเดลเป็น 1 หรือมีอาการ/พฤติกรรมเสี่ยงตั้งแต่ 2 ข้อ ถือว่าเสี่ยง
+    risky = (labels == 1) | (prepared["behavior_score"].to_numpy() >= 2)
+    scored = prepared.copy()
+    scored["result"] = np.where(risky, "เสี่ยง", "ไม่เสี่ยง")
+    scored["model_version"] = version
+    scored["risk_level"] = np.asarray(RISK_KEYS, dtype=object)[risk_codes(scored["glucose"], scored["result"])]
+    return scored
+
+
+def _record(r, upload_id, uploaded_by, started, tokens):
+    # ไม่มีวันที่ตรวจในไฟล์: ใช้เวลานำเข้า + ลำดับแถว (ไมโครวินาที) ให้เรียงตามแถวในไฟล์
+    when = r["screened_at"].to_pydatetime() if pd.notna(r["screened_at"]) else started + timedelta(microseconds=r["row"])
+    email = r["email"] if isinstance(r["email"], str) and r["email"] else None
+    if (email, r["name"]) not in tokens:
+        tokens[(email, r["name"])] = search_tokens(email, r["name"])
+    return {
+        "user": email,
+        "name": r["name"],
+        "role": "user",
+        "result": r["result"],
+        "pregnancies": _plain(r["pregnancies"]),
+        "glucose": _plain(r["glucose"]),
+        "blood_pressure": _plain(r["blood_pressure"]),
+        "skin_thickness": SKIN_THICKNESS,
+        "insulin": _plain(r["insulin"]),
+        "weight": _plain(r["weight"]),
+        "height_cm": _plain(r["height_cm"]),
+        "bmi": r["bmi"],
+        "diabetes_pedigree": r["diabetes_pedigree"],
+        "age": _plain(r["age"]),
+        "datetime": when,
+        "saved_at": firestore.SERVER_TIMESTAMP,
+        "risk_level": r["risk_level"],
+        "name_tokens": tokens[(email, r["name"])],
+        "model_version": r["model_version"],
+        "source": "bulk_upload",
+        "upload_id": upload_id,
+        "uploaded_by": uploaded_by,
+    }
+
+
+def _batch(upload_id, rows, results):
+    # รวมผลของช่วงแถวหนึ่งกับสรุปรายวัน/สรุปของผู้ใช้ของแถวเหล่านั้น และเอกสารบันทึกว่า batch นี้เขียนแล้ว
+    # คืนค่า (key, จำนวนแถว, แถวสุดท้ายในไฟล์, การเขียน)
+    daily = defaultdict(lambda: [0, 0])
+    by_user = defaultdict(list)
+    writes = []
+    for doc_id, record in results:
+        writes.append((f"results/{doc_id}", record, False))
+        day = daily[record["datetime"].date()]
+        day[0] += record["glucose"]
+        day[1] += 1
+        if record["user"]:
+            by_user[record["user"]].append(dict(record, id=doc_id))
+    for day, (glucose_sum, n) in daily.items():
+        writes.append(dashboard_stats.daily_write(day, glucose_sum, n))
+    for email, records in by_user.items():
+        writes.append(user_stats.stats_write_many(email, records))
+    key = f"{rows[0]:07d}-{rows[-1]:07d}"
+    writes.append((f"bulk_uploads/{upload_id}/batches/{key}", {"rows": len(results), "written_at": datetime.now()}, False))
+    return key, len(results), rows[-1], writes
+
+
+def build_batches(scored, upload_id, uploaded_by, started):
+    # แบ่งผลทั้งก้อนเป็น batch ละไม่เกิน MAX_BATCH_WRITES การเขียน คืนค่า list ของผลจาก _batch()
+    # นับที่ต้องใช้ต่อแถว: ผล 1 + วันใหม่ 1 + ผู้ใช้ใหม่ 1 (+ เอกสารบันทึก batch อีก 1)
+    batches = []
+    results, rows, days, users = [], [], set(), set()
+    tokens = {}  # ไฟล์ของคลินิกมักมีคนเดิมหลายแถว
+    for r in scored.to_dict("records"):
+        record = _record(r, upload_id, uploaded_by, started, tokens)
+        day, email = record["datetime"].date(), record["user"]
+        needed = 1 + (day not in days) + (email is not None and email not in users)
+        if results and len(results) + len(days) + len(users) + needed + 1 > MAX_BATCH_WRITES:
+            batches.append(_batch(upload_id, rows, results))
+            results, rows, days, users = [], [], set(), set()
+        # id คงที่ต่อแถว: อัปโหลดไฟล์เดิมซ้ำเขียนทับเอกสารเดิม ไม่เกิดเอกสารซ้ำ
+        results.append((f"bulk-{upload_id}-{r['row']:07d}", record))
+        rows.append(r["row"])
+        days.add(day)
+        if email is not None:
+            users.add(email)
+    if results:
+        batches.append(_batch(upload_id, rows, results))
+    return batches
+
+
+def committed_batches(db, upload_id):
+    # key ของ batch ที่เขียนไปแล้วในการอัปโหลดไฟล์นี้ครั้งก่อน
+    return {doc.id for doc in db.collection("bulk_uploads").document(upload_id).collection("batches").stream()}
+
+
+def run(db, predictor, file, filename, uploaded_by=None, chunk_size=CHUNK_ROWS,
+        on_progress=None, dry_run=False):
+    # นำเข้าทั้งไฟล์ทีละก้อน เรียก on_progress(แถวที่ทำแล้ว, จำนวนแถวโดยประมาณหรือ None) หลังแต่ละก้อน
+    # dry_run=True: ตรวจและทำนายอย่างเดียว ไม่เขียน Firestore
+    # หยุดกลางทาง (ไฟล์ผิดรูปแบบ/ไม่มีคอลัมน์ที่จำเป็น, XLSX เสีย, Firestore ล้มเหลว) ไม่โยน traceback ให้หน้าเว็บ:
+    # summary["error"] = ข้อความ, summary["last_row"] = แถวสุดท้ายในไฟล์ที่บันทึกแล้ว
+    # (batch ที่บันทึกแล้วครบทั้ง batch อัปโหลดไฟล์เดิมซ้ำจะทำต่อจาก batch ที่ยังไม่ได้บันทึก)
+    started_at = time.perf_counter()
+    started = datetime.now()
+    summary = {"upload_id": None, "rows": 0, "written": 0, "skipped": 0, "invalid": 0, "risky": 0,
+               "errors": [], "error": None, "last_row": None}
+    try:
+        digest, total, chunks = read_chunks(file, filename, chunk_size)
+        upload_id = summary["upload_id"] = digest[:16]
+        done = set() if dry_run else committed_batches(db, upload_id)
+        if not dry_run:
+            db.collection("bulk_uploads").document(upload_id).set(
+                {"filename": filename, "uploaded_by": uploaded_by, "started_at": started, "status": "running"},
+                merge=True)
+        for df in chunks:
+            prepared, errors = prepare(df)
+            summary["rows"] += len(df)
+            summary["invalid"] += len(errors)
+            summary["errors"].extend(errors[:MAX_ERRORS - len(summary["errors"])])
+            if len(prepared):
+                scored = score(predictor, prepared)
+                summary["risky"] += int((scored["result"] == "เสี่ยง").sum())
+                if not dry_run:
+                    for key, n, last_row, writes in build_batches(scored, upload_id, uploaded_by, started):
+                        if key in done:
+                            summary["skipped"] += n
+                        else:
+                            apply_writes(db, writes)
+                            summary["written"] += n
+                        summary["last_row"] = last_row
+            if on_progress:
+                on_progress(summary["rows"], total)
+        if not dry_run:
+            db.collection("bulk_uploads").document(upload_id).set(
+                {"status": "done", "rows": summary["rows"], "finished_at": datetime.now()}, merge=True)
+    except zipfile.BadZipFile:
+        summary["error"] = "ไฟล์ XLSX เสียหรือไม่ใช่ไฟล์ Excel"
+    except InvalidFileException as e:
+        summary["error"] = f"เปิดไฟล์ Excel ไม่ได้: {e}"
+    except GoogleAPICallError as e:
+        summary["error"] = f"บันทึกลง Firestore ไม่สำเร็จ: {e.message or e}"
+    except FileFormatError as e:
+        summary["error"] = str(e)
+    summary["seconds"] = time.perf_counter() - started_at
+    return summary
@@ -0,0 +1,79 @@
+from collections import defaultdict
+
+from firebase_admin import firestore
+
+import firestore_reads
+
+# สรุปผลรายวันเก็บใน collection นี้ (1 เอกสารต่อ 1 วัน, id = "YYYY-MM-DD")
+DAILY_COLLECTION = "daily_stats"
+
+
+def count(query):
+    # ใช้ count aggregation ฝั่งเซิร์ฟเวอร์ ไม่ต้องดึงเอกสารลงมา
+    result = query.count().get()
+    firestore_reads.add(1)
+    return int(result[0][0].value)
+
+
+def daily_write(when, glucose, count=1):
+    # การเขียน (path, data, merge) ที่เพิ่มค่าเข้า rollup ของวันนั้น ใช้เขียนพร้อมกับการบันทึกผล
+    # (นำเข้าหลายผลพร้อมกัน: glucose = ผลรวมของวันนั้น, count = จำนวนผล)
+    return (f"{DAILY_COLLECTION}/{when.strftime('%Y-%m-%d')}", {
+        "date": when.strftime("%Y-%m-%d"),
+        "glucose_sum": firestore.Increment(glucose),
+        "count": firestore.Increment(count),
+    }, True)
+
+
+def daily_glucose(db):
+    # คืนค่า {date_str: ค่าเฉลี่ย glucose} เรียงตามวันที่
+    docs = firestore_reads.tracked(db.collection(DAILY_COLLECTION).order_by("date").stream())
+    series = {}
+    for doc in docs:
+        d = doc.to_dict()
+        if d.get("count"):
+            series[d["date"]] = d.get("glucose_sum", 0) / d["count"]
+    return series
+
+
+def _iter_results(db, page_size):
+    # ไล่อ่าน results ทั้ง collection ทีละหน้าด้วย cursor (อ่านเฉพาะฟิลด์ datetime/glucose)
+    # ไม่ใช้แคชของ result_store ซึ่งเก็บไว้ไม่ครบทุกผลเมื่อข้อมูลมาก
+    after = None
+    while True:
+        query = db.collection("results").select(["datetime", "glucose"]).order_by("datetime").limit(page_size)
+        if after is not None:
+            query = query.start_after(after)
+        docs = list(firestore_reads.tracked(query.stream()))
+        for doc in docs:
+            yield doc.to_dict()
+        if len(docs) < page_size:
+            return
+        after = docs[-1]
+
+
+def rebuild_daily(db, page_size=1000):
+    # สร้าง rollup ใหม่ทั้งหมดจากผลทุกรายการใน Firestore (ใช้ครั้งแรกหรือเมื่อข้อมูลไม่ตรงกัน)
+    # ผลที่ไม่มี datetime ไม่อยู่ใน query ที่เรียงตาม datetime อยู่แล้ว
+    totals = defaultdict(lambda: [0.0, 0])
+    for r in _iter_results(db, page_size):
+        key = r["datetime"].strftime("%Y-%m-%d")
+        totals[key][0] += r.get("glucose", 0) or 0
+        totals[key][1] += 1
+
+    batch = db.batch()
+    pending = 0
+    for key, (glucose_sum, n) in totals.items():
+        batch.set(db.collection(DAILY_COLLECTION).document(key), {
+            "date": key,
+            "glucose_sum": glucose_sum,
+            "count": n,
+        })
+        pending += 1
+        if pending == 500:  # Firestore จำกัด 500 การเขียนต่อ batch
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return len(totals)
@@ -0,0 +1,150 @@
+import functools
+import hashlib
+import io
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from prediction_service import FEATURES
+
+# ชุดข้อมูลสำหรับเทรน (Pima Indians Diabetes dataset) ใช้ร่วมกันทุกสคริปต์
+# - เก็บเป็น cache ในเครื่องแบบมีเลขรุ่น: data/pima-v{DATASET_VERSION}/ (X.npy, y.npy, manifest.json)
+# - ตรวจ sha256 ของทุกไฟล์กับ manifest ทุกครั้งที่โหลด
+# - ดาวน์โหลดเฉพาะเมื่อสั่ง (python dataset.py fetch) หรือนำเข้าไฟล์ CSV ที่มีอยู่แล้ว
+#   (python dataset.py import <ไฟล์.csv>) หลังจากนั้นเทรนได้โดยไม่ต้องต่อเน็ต
+DATASET_URL = "https://raw.githubusercontent.com/jbrownlee/Datasets/master/pima-indians-diabetes.data.csv"
+DATASET_VERSION = 1
+TARGET = "Outcome"
+COLUMNS = FEATURES + [TARGET]
+DTYPES = {
+    "Pregnancies": "int16", "Glucose": "int16", "BloodPressure": "int16", "SkinThickness": "int16",
+    "Insulin": "int16", "BMI": "float64", "DiabetesPedigreeFunction": "float64", "Age": "int16",
+    "Outcome": "int8",
+}
+EXPECTED_ROWS = 768
+CACHE_DIR = os.environ.get("DIABETES_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+
+def cache_path(cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"pima-v{DATASET_VERSION}")
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_cache(raw, source, cache_dir=CACHE_DIR):
+    # แปลง CSV ครั้งเดียวแล้วเก็บเป็น .npy (X เป็น float64, y เป็น int8) พร้อม manifest
+    df = pd.read_csv(io.BytesIO(raw), names=COLUMNS, dtype=DTYPES)
+    if len(df) != EXPECTED_ROWS:
+        raise ValueError(f"จำนวนแถวไม่ถูกต้อง: {len(df)} (ควรเป็น {EXPECTED_ROWS})")
+
+    path = cache_path(cache_dir)
+    os.makedirs(path, exist_ok=True)
+    arrays = {
+        "X.npy": df[FEATURES].to_numpy(dtype=np.float64),
+        "y.npy": df[TARGET].to_numpy(dtype=np.int8),
+    }
+    files = {}
+    for name, array in arrays.items():
+        tmp = os.path.join(path, f".{name}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, array, allow_pickle=False)
+        os.replace(tmp, os.path.join(path, name))
+        files[name] = _file_sha256(os.path.join(path, name))
+
+    manifest = {
+        "version": DATASET_VERSION,
+        "source": source,
+        "source_sha256": _sha256(raw),
+        "columns": COLUMNS,
+        "dtypes": DTYPES,
+        "rows": len(df),
+        "files": files,
+    }
+    # เขียน manifest เป็นไฟล์สุดท้าย (ไม่มี manifest = cache ยังไม่สมบูรณ์)
+    tmp = os.path.join(path, ".manifest.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, os.path.join(path, "manifest.json"))
+    load_arrays.cache_clear()
+    return manifest
+
+
+def fetch(url=DATASET_URL, cache_dir=CACHE_DIR, timeout=30):
+    import requests
+
+    r = requests.get(url, timeout=timeout)
+    r.raise_for_status()
+    return build_cache(r.content, url, cache_dir)
+
+
+def import_csv(csv_path, cache_dir=CACHE_DIR):
+    with open(csv_path, "rb") as f:
+        return build_cache(f.read(), os.path.abspath(csv_path), cache_dir)
+
+
+@functools.lru_cache(maxsize=None)
+def load_arrays(cache_dir=CACHE_DIR):
+    # คืนค่า (X, y) จาก cache หลังตรวจ checksum (โหลดครั้งเดียวต่อ process)
+    path = cache_path(cache_dir)
+    manifest_path = os.path.join(path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(
+            f"ไม่พบชุดข้อมูลใน {path} กรุณารัน 'python dataset.py fetch' "
+            f"หรือ 'python dataset.py import <ไฟล์.csv>' ก่อน"
+        )
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("version") != DATASET_VERSION or manifest.get("columns") != COLUMNS:
+        raise ValueError(f"cache ใน {path} ไม่ตรงกับรุ่นชุดข้อมูล v{DATASET_VERSION}")
+    for name, digest in manifest["files"].items():
+        if _file_sha256(os.path.join(path, name)) != digest:
+            raise ValueError(f"checksum ของ {name} ไม่ตรงกับ manifest (ไฟล์เสียหรือถูกแก้ไข)")
+
+    X = np.load(os.path.join(path, "X.npy"), allow_pickle=False)
+    y = np.load(os.path.join(path, "y.npy"), allow_pickle=False)
+    X.flags.writeable = False
+    y.flags.writeable = False
+    return X, y
+
+
+def read_manifest(cache_dir=CACHE_DIR):
+    # manifest ของ cache ที่ผ่านการตรวจ checksum แล้ว (ใช้บันทึกว่าโมเดลเทรนจากข้อมูลชุดไหน)
+    load_arrays(cache_dir)
+    with open(os.path.join(cache_path(cache_dir), "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_frame(cache_dir=CACHE_DIR):
+    # DataFrame แบบเดียวกับ pd.read_csv(url, names=columns) เดิม (คอลัมน์และ dtype ตาม DTYPES)
+    X, y = load_arrays(cache_dir)
+    df = pd.DataFrame(X, columns=FEATURES).astype({c: DTYPES[c] for c in FEATURES})
+    df[TARGET] = y
+    return df
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "info"
+    if command == "fetch":
+        manifest = fetch(sys.argv[2] if len(sys.argv) > 2 else DATASET_URL)
+    elif command == "import" and len(sys.argv) > 2:
+        manifest = import_csv(sys.argv[2])
+    elif command == "info":
+        manifest = read_manifest()
+    else:
+        print("ใช้งาน: python dataset.py [fetch [url] | import <ไฟล์.csv> | info]")
+        sys.exit(1)
+    print(f"✅ ชุดข้อมูล v{manifest['version']}: {manifest['rows']} แถว จาก {manifest['source']}")
+    print(f"   source sha256 {manifest['source_sha256']}")
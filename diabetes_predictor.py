@@ -1,14 +1,10 @@
-import pandas as pd
+from dataset import load_frame
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score
 
 # โหลดชุดข้อมูลตัวอย่าง (Pima Indians Diabetes dataset)
-url = "https://raw.githubusercontent.com/jbrownlee/Datasets/master/pima-indians-diabetes.data.csv"
-columns = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness',
-           'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age', 'Outcome']
-
-df = pd.read_csv(url, names=columns)
+df = load_frame()  # จาก cache ในเครื่อง (ดู dataset.py)
 
 # แยก features กับผลลัพธ์
 X = df.drop('Outcome', axis=1)
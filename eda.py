@@ -1,12 +1,9 @@
-import pandas as pd
+from dataset import load_frame
 import matplotlib.pyplot as plt
 import seaborn as sns
 
 # โหลดข้อมูล
-url = "https://raw.githubusercontent.com/jbrownlee/Datasets/master/pima-indians-diabetes.data.csv"
-columns = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness',
-           'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age', 'Outcome']
-df = pd.read_csv(url, names=columns)
+df = load_frame()  # จาก cache ในเครื่อง (ดู dataset.py)
 
 # สรุปข้อมูลเบื้องต้น
 print(df.info())
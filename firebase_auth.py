@@ -1,24 +1,128 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import numpy as np
 import requests
 import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+
+# ปลายทาง Identity Toolkit ตั้งค่าได้ 2 ทาง
+# - ตัวแปรแวดล้อม FIREBASE_AUTH_EMULATOR_HOST (เช่น "127.0.0.1:9099") ใช้กับ auth_emulator.py หรือ Firebase Emulator
+#   ไม่ต้องมี secrets (ใช้กับการทดสอบโหลดแบบออฟไลน์)
+# - st.secrets["firebase"]["auth_base_url"] (ค่าเริ่มต้นคือเซิร์ฟเวอร์จริงของ Google)
+# (ต่ออายุ idToken ใช้ securetoken ซึ่งตั้งค่าได้แบบเดียวกันผ่าน token_base_url)
+DEFAULT_AUTH_BASE_URL = "https://identitytoolkit.googleapis.com/v1"
+DEFAULT_TOKEN_BASE_URL = "https://securetoken.googleapis.com/v1"
+EMULATOR_HOST = os.environ.get("FIREBASE_AUTH_EMULATOR_HOST")
+if EMULATOR_HOST:
+    AUTH_BASE_URL = f"http://{EMULATOR_HOST}/identitytoolkit.googleapis.com/v1"
+    TOKEN_BASE_URL = f"http://{EMULATOR_HOST}/securetoken.googleapis.com/v1"
+    FIREBASE_API_KEY = os.environ.get("FIREBASE_API_KEY", "fake-api-key")
+else:
+    AUTH_BASE_URL = st.secrets["firebase"].get("auth_base_url", DEFAULT_AUTH_BASE_URL).rstrip("/")
+    TOKEN_BASE_URL = st.secrets["firebase"].get("token_base_url", DEFAULT_TOKEN_BASE_URL).rstrip("/")
+    FIREBASE_API_KEY = st.secrets["firebase"]["api_key"]
+
+# เชื่อมต่อแบบ keep-alive ผ่าน Session เดียวทั้ง process (ไม่ต้อง TLS handshake ใหม่ทุกครั้งที่ล็อกอิน)
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+MAX_RETRIES = 3
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.25
+BACKOFF_MAX = 4.0
+
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# สถิติ latency ต่อ endpoint (เก็บล่าสุดไม่เกิน 5,000 ครั้ง)
+_stats_lock = threading.Lock()
+_latencies = {}
+_counters = {}
+
+
+def _record(endpoint, seconds, ok, retries):
+    with _stats_lock:
+        _latencies.setdefault(endpoint, deque(maxlen=5000)).append(seconds)
+        c = _counters.setdefault(endpoint, {"requests": 0, "errors": 0, "retries": 0})
+        c["requests"] += 1
+        c["retries"] += retries
+        if not ok:
+            c["errors"] += 1
+
+
+def auth_stats():
+    # คืนค่า {endpoint: {requests, errors, retries, p50_ms, p99_ms}}
+    with _stats_lock:
+        snapshot = {k: (list(v), dict(_counters[k])) for k, v in _latencies.items()}
+    stats = {}
+    for endpoint, (latencies, counters) in snapshot.items():
+        ms = np.array(latencies) * 1000
+        stats[endpoint] = {
+            **counters,
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p99_ms": float(np.percentile(ms, 99)),
+        }
+    return stats
+
+
+def _not_sent(error):
+    # True เมื่อ error เกิดก่อนส่งคำขอออกไป (ต่อ TCP/TLS ไม่สำเร็จ หรือ DNS ไม่พบ) เซิร์ฟเวอร์จึงไม่ได้ประมวลผลแน่นอน
+    # read timeout หรือการเชื่อมต่อหลุดระหว่างรอคำตอบไม่นับ เพราะเซิร์ฟเวอร์อาจทำงานไปแล้ว
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _post(endpoint, payload, url=None, idempotent=True):
+    # POST ไปยัง Identity Toolkit พร้อม timeout และลองใหม่เมื่อเจอ 429/5xx หรือเชื่อมต่อไม่ได้
+    # (รอแบบ exponential backoff + full jitter เพื่อไม่ให้ทุกคนยิงซ้ำพร้อมกัน)
+    # idempotent=False (เช่น signUp): ไม่ลองใหม่เมื่อ timeout หลังส่งคำขอไปแล้ว ลองใหม่เฉพาะเมื่อส่งไม่ออกหรือได้ 429/5xx
+    url = url or f"{AUTH_BASE_URL}/accounts:{endpoint}?key={FIREBASE_API_KEY}"
+    started = time.perf_counter()
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            r = _session.post(url, json=payload, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT))
+            if r.status_code not in RETRY_STATUS or attempt == MAX_RETRIES:
+                _record(endpoint, time.perf_counter() - started, r.ok, attempt)
+                return r.json()
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == MAX_RETRIES or not (idempotent or _not_sent(e)):
+                _record(endpoint, time.perf_counter() - started, False, attempt)
+                return {"error": {"message": f"ไม่สามารถเชื่อมต่อระบบยืนยันตัวตนได้: {e.__class__.__name__}"}}
+        except ValueError:
+            # ตอบกลับมาไม่ใช่ JSON
+            _record(endpoint, time.perf_counter() - started, False, attempt)
+            return {"error": {"message": f"ระบบยืนยันตัวตนตอบกลับผิดรูปแบบ (HTTP {r.status_code})"}}
+        time.sleep(random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt)))
 
-FIREBASE_API_KEY = st.secrets["firebase"]["api_key"]
 
 def firebase_register(email, password):
-    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={FIREBASE_API_KEY}"
     payload = {
         "email": email,
         "password": password,
         "returnSecureToken": True
     }
-    r = requests.post(url, json=payload)
-    return r.json()
+    # signUp ไม่ idempotent: ถ้าส่งซ้ำหลังเซิร์ฟเวอร์สร้างบัญชีไปแล้วจะได้ EMAIL_EXISTS แทนผลจริง
+    return _post("signUp", payload, idempotent=False)
 
 def firebase_login(email, password):
-    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_API_KEY}"
     payload = {
         "email": email,
         "password": password,
         "returnSecureToken": True
     }
-    r = requests.post(url, json=payload)
-    return r.json()
+    return _post("signInWithPassword", payload, idempotent=True)
+
+def firebase_refresh(refresh_token):
+    # แลก refreshToken เป็น idToken ใหม่ (คืนค่า id_token, refresh_token, expires_in, user_id)
+    payload = {
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token
+    }
+    return _post("token", payload, url=f"{TOKEN_BASE_URL}/token?key={FIREBASE_API_KEY}", idempotent=True)
@@ -0,0 +1,31 @@
+import threading
+
+# ตัวนับจำนวนเอกสารที่อ่านจาก Firestore ต่อการรันสคริปต์หนึ่งรอบ (rerun)
+# Streamlit รันสคริปต์ของแต่ละ session ใน thread ของตัวเอง จึงเก็บค่าไว้แบบ thread-local
+_local = threading.local()
+
+
+def reset():
+    _local.count = 0
+
+
+def add(n=1):
+    _local.count = getattr(_local, "count", 0) + n
+
+
+def count():
+    return getattr(_local, "count", 0)
+
+
+def tracked(docs):
+    # ห่อ stream() ของ Firestore เพื่อนับทีละเอกสารที่ดึงมาจริง
+    for doc in docs:
+        add(1)
+        yield doc
+
+
+def tracked_get(ref):
+    # ห่อ document(...).get() (นับ 1 read แม้เอกสารจะไม่มีอยู่)
+    snap = ref.get()
+    add(1)
+    return snap
@@ -0,0 +1,290 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from collections import deque
+
+import joblib
+import numpy as np
+
+# รุ่นของรูปแบบไฟล์ artifact (เพิ่มเมื่อเปลี่ยนโครงสร้าง array)
+ARTIFACT_VERSION = 2
+
+# แปลง RandomForestClassifier ที่เทรนแล้วให้เป็น array ต่อเนื่อง (feature, threshold, children, leaf values)
+# แล้วประเมินผลทุกต้นพร้อมกันทั้ง batch ด้วย NumPy โดยไม่ผ่านกลไกของ sklearn
+#
+# โครงสร้าง array:
+# - node ของทุกต้นต่อกันเป็น array เดียว จัดลำดับใหม่แบบ BFS ให้ลูกของแต่ละ node อยู่ติดกัน
+#   (first_child = ลูกขวา, first_child + 1 = ลูกซ้าย) จึงเดินต่อได้ด้วย first_child[node] + go_left
+# - leaf ชี้กลับมาที่ตัวเองและมี threshold = -inf จึงเดินซ้ำจนครบความลึกได้โดยไม่ต้องเช็กเงื่อนไข
+# - ค่าที่หายไป (NaN) ไปทางเดียวกับ sklearn: ซ้ายถ้า missing_go_to_left ของ node นั้นเป็นจริง มิฉะนั้นขวา
+#   (NaN <= threshold เป็นเท็จเสมอ จึงเก็บเฉพาะ node ที่ต้องไปซ้าย ส่วน leaf เป็นเท็จเพื่อไม่ให้เดินออกจาก leaf)
+#
+# ผลลัพธ์ predict_proba ตรงกับ sklearn แบบ bit-for-bit:
+# - sklearn แปลง X เป็น float32 แล้วเทียบ x <= threshold (float64)
+#   สำหรับ x ที่เป็น float32 เงื่อนไขนี้เท่ากับ x <= (float32 ที่มากที่สุดที่ไม่เกิน threshold) เสมอ
+#   จึงเก็บ threshold เป็น float32 แบบปัดลง และเทียบกันใน float32 ได้เลย
+# - บวกผลของแต่ละต้นเรียงตามลำดับ estimators_ แล้วค่อยหารด้วยจำนวนต้น เหมือน sklearn
+
+
+def _round_down_float32(threshold):
+    t32 = threshold.astype(np.float32)
+    too_big = t32.astype(np.float64) > threshold
+    return np.where(too_big, np.nextafter(t32, np.float32(-np.inf)), t32).astype(np.float32)
+
+
+def _bfs_order(tree):
+    # คืนค่า (ลำดับ node เดิมตามตำแหน่งใหม่, ตำแหน่งใหม่ของลูกตัวแรกของแต่ละ node)
+    # (leaf จะไม่มีอยู่ใน first_child)
+    left, right = tree.children_left, tree.children_right
+    order = [0]
+    first_child = {}
+    queue = deque([0])
+    while queue:
+        node = queue.popleft()
+        if left[node] == -1:
+            continue
+        first_child[node] = len(order)
+        order.extend([right[node], left[node]])
+        queue.extend([right[node], left[node]])
+    return np.asarray(order), first_child
+
+
+def export_forest(model):
+    n_classes = len(model.classes_)
+    features, thresholds, firsts, values, roots, missing = [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for est in model.estimators_:
+        tree = est.tree_
+        order, first_child = _bfs_order(tree)
+        is_leaf = tree.children_left[order] == -1
+        position = np.arange(len(order))
+
+        first = np.array([first_child.get(node, -1) for node in order])
+        firsts.append(np.where(is_leaf, position, first) + offset)
+        features.append(np.where(is_leaf, 0, tree.feature[order]))
+        thresholds.append(np.where(is_leaf, -np.inf, _round_down_float32(tree.threshold[order])))
+        missing.append(~is_leaf & (tree.missing_go_to_left[order] != 0))
+
+        v = tree.value[order, 0, :n_classes]
+        # sklearn < 1.4 เก็บเป็นจำนวนตัวอย่างแล้วหารตอน predict_proba / รุ่นใหม่เก็บเป็นสัดส่วนอยู่แล้ว
+        sums = v.sum(axis=1)
+        if not np.allclose(sums[is_leaf], 1.0):
+            sums[sums == 0.0] = 1.0
+            v = v / sums[:, np.newaxis]
+        values.append(v)
+
+        roots.append(offset)
+        offset += len(order)
+        max_depth = max(max_depth, tree.max_depth)
+
+    return {
+        "feature": np.ascontiguousarray(np.concatenate(features), dtype=np.intp),
+        "threshold": np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float32),
+        "first_child": np.ascontiguousarray(np.concatenate(firsts), dtype=np.intp),
+        "missing_left": np.ascontiguousarray(np.concatenate(missing), dtype=bool),
+        "value": np.ascontiguousarray(np.concatenate(values).T, dtype=np.float64),   # (n_classes, n_nodes)
+        "roots": np.asarray(roots, dtype=np.intp),
+        "max_depth": np.asarray(max_depth, dtype=np.intp),
+        "classes": np.asarray(model.classes_),
+    }
+
+
+class CompiledForest:
+    def __init__(self, arrays):
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.first_child = arrays["first_child"]
+        self.missing_left = arrays["missing_left"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.max_depth = int(np.asarray(arrays["max_depth"]).ravel()[0])
+        self.classes_ = np.asarray(arrays["classes"])
+        self._is_leaf = self.threshold == -np.inf
+
+    @classmethod
+    def from_estimator(cls, model):
+        return cls(export_forest(model))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls({k: data[k] for k in data.files})
+
+    def arrays(self):
+        return {
+            "feature": self.feature, "threshold": self.threshold, "first_child": self.first_child,
+            "missing_left": self.missing_left, "value": self.value, "roots": self.roots,
+            "max_depth": np.asarray(self.max_depth, dtype=np.intp), "classes": self.classes_,
+        }
+
+    def save(self, path):
+        # บันทึกแบบไม่บีบอัด
+        np.savez(path, **self.arrays())
+
+    def save_artifact(self, directory, features, source=None):
+        # บันทึกเป็นโฟลเดอร์: array ละ 1 ไฟล์ .npy (ไม่บีบอัด เพื่อเปิดแบบ mmap ได้) + manifest.json
+        os.makedirs(directory, exist_ok=True)
+        for name, array in self.arrays().items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.ascontiguousarray(array))
+        manifest = {
+            "format_version": ARTIFACT_VERSION,
+            "features": list(features),
+            "n_trees": int(len(self.roots)),
+            "n_nodes": int(len(self.feature)),
+            "max_depth": self.max_depth,
+            "source": os.path.basename(source) if source else None,
+            "source_sha256": file_sha256(source) if source else None,
+        }
+        with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        return manifest
+
+    @classmethod
+    def load_artifact(cls, directory, mmap=True):
+        # เปิดไฟล์ .npy แบบ mmap_mode="r": ไม่ต้อง unpickle และหลาย process บนเครื่องเดียวกันใช้หน้า memory ร่วมกันได้
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != ARTIFACT_VERSION:
+            raise ValueError(f"artifact รุ่น {manifest.get('format_version')} ไม่รองรับ (ต้องเป็นรุ่น {ARTIFACT_VERSION})")
+        names = ["feature", "threshold", "first_child", "missing_left", "value", "roots", "max_depth", "classes"]
+        # np.asarray ให้ ndarray ธรรมดาที่ชี้ไปยังหน้า mmap เดิม (ไม่ copy) ซึ่ง take() เร็วกว่า np.memmap
+        arrays = {
+            name: np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None))
+            for name in names
+        }
+        forest = cls(arrays)
+        forest.manifest = manifest
+        return forest
+
+    def apply(self, X):
+        # index ของ leaf ที่แต่ละแถวตกลงไปในทุกต้น: shape (n_trees, n_samples)
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n = X.shape[0]
+        n_trees = len(self.roots)
+
+        # เก็บ X แบบเรียงตาม feature เพื่อหา X[row, feature] ได้จาก feature * n + row
+        x_flat = np.ascontiguousarray(X.T).ravel()
+        feature_offset = self.feature * n
+        rows = np.tile(np.arange(n, dtype=np.intp), n_trees)
+        has_nan = bool(np.isnan(x_flat).any())
+        node = np.repeat(self.roots, n)
+
+        out = np.empty(n * n_trees, dtype=np.intp)
+        active = np.arange(n * n_trees)
+        for depth in range(self.max_depth):
+            idx = feature_offset.take(node)
+            idx += rows
+            x = x_flat.take(idx)
+            go_left = x <= self.threshold.take(node)
+            if has_nan:
+                go_left |= np.isnan(x) & self.missing_left.take(node)
+            node = self.first_child.take(node)
+            node += go_left
+
+            # ทุกๆ 4 ชั้น ตัดแถวที่ถึง leaf แล้วออก เพื่อไม่ต้องเดินซ้ำจนครบความลึกสูงสุด
+            if depth % 4 == 3:
+                done = self._is_leaf.take(node)
+                out[active[done]] = node[done]
+                keep = ~done
+                active, node, rows = active[keep], node[keep], rows[keep]
+                if not active.size:
+                    break
+        out[active] = node
+        return out.reshape(n_trees, n)
+
+    def predict_proba(self, X):
+        leaves = self.apply(X)
+        proba = np.empty((leaves.shape[1], len(self.classes_)), dtype=np.float64)
+        for k, value in enumerate(self.value):
+            # บวกทีละต้นตามลำดับ ให้ผลเหมือนการสะสมใน sklearn
+            acc = value.take(leaves[0])
+            for tree_leaves in leaves[1:]:
+                acc += value.take(tree_leaves)
+            proba[:, k] = acc
+        proba /= len(self.roots)
+        return proba
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+
+def is_forest(model):
+    # RandomForest (หรือ ensemble ของ DecisionTree) ที่แปลงเป็น CompiledForest ได้
+    return hasattr(model, "estimators_") and hasattr(model.estimators_[0], "tree_")
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _measure_cold_load(code):
+    # วัดเวลาโหลด (รวมเวลา import) และ RSS ใน process ใหม่ (เหมือน worker ที่เพิ่งเริ่ม)
+    # อ่าน VmRSS จาก /proc เพราะ ru_maxrss บน Linux ติดค่ามาจาก process แม่ข้าม execve
+    probe = (
+        "import time, warnings; warnings.simplefilter('ignore'); t = time.perf_counter(); "
+        f"{code}; "
+        "elapsed = time.perf_counter() - t; "
+        "rss = [l.split()[1] for l in open('/proc/self/status') if l.startswith('VmRSS')][0]; "
+        "print(elapsed, rss)"
+    )
+    out = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True, check=True)
+    seconds, rss_kb = out.stdout.split()
+    return float(seconds) * 1000, int(rss_kb) / 1024
+
+
+def _benchmark(fn, X, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+# ใช้งาน: python forest_compiler.py [model.pkl] [output_dir]
+if __name__ == "__main__":
+    src = sys.argv[1] if len(sys.argv) > 1 else "optimized_diabetes_model.pkl"
+    dst = sys.argv[2] if len(sys.argv) > 2 else "optimized_diabetes_model"
+
+    model = joblib.load(src)
+    compiled = CompiledForest.from_estimator(model)
+    features = getattr(model, "feature_names_in_", None)
+    if features is None:
+        from prediction_service import FEATURES as features
+    compiled.save_artifact(dst, features, source=src)
+    compiled = CompiledForest.load_artifact(dst)
+
+    # ตรวจสอบว่าให้ผลตรงกับ sklearn ทุกบิต
+    rng = np.random.default_rng(0)
+    X = rng.uniform([0, 40, 30, 0, 0, 15, 0.05, 18], [15, 200, 120, 60, 500, 55, 2.5, 85], size=(1000, 8))
+    X = np.round(X, 1)
+    # ค่าที่หายไป (NaN) ต้องไปทางเดียวกับ sklearn ด้วย
+    X_nan = np.where(rng.random(X.shape) < 0.05, np.nan, X)
+    if hasattr(model, "feature_names_in_"):
+        # เรียก sklearn ด้วย DataFrame เหมือนตอนเทรน (ไม่มีคำเตือน feature names)
+        import pandas as pd
+        sk_proba = lambda x: model.predict_proba(pd.DataFrame(x, columns=features))
+    else:
+        sk_proba = model.predict_proba
+    if not all(np.array_equal(sk_proba(x), compiled.predict_proba(x)) for x in (X, X_nan)):
+        print("❌ ผลลัพธ์ไม่ตรงกับ sklearn")
+        sys.exit(1)
+
+    print(f"✅ บันทึก {dst}/ แล้ว ({len(compiled.roots)} ต้น, {len(compiled.feature)} nodes, ลึกสุด {compiled.max_depth})")
+    for label, rows, repeat in [("1 แถว", X[:1], 200), ("64 แถว", X[:64], 200), ("1,000 แถว", X, 20)]:
+        t_sk = _benchmark(sk_proba, rows, repeat)
+        t_np = _benchmark(compiled.predict_proba, rows, repeat)
+        print(f"{label}: sklearn {t_sk:.3f} ms | compiled {t_np:.3f} ms ({t_sk / t_np:.1f}x)")
+
+    # เวลาเริ่มต้น (cold start) และหน่วยความจำของ process ใหม่
+    t_pkl, rss_pkl = _measure_cold_load(f"import joblib; joblib.load({src!r})")
+    t_mm, rss_mm = _measure_cold_load(f"from forest_compiler import CompiledForest; CompiledForest.load_artifact({dst!r})")
+    print(f"cold load: joblib.load {t_pkl:.1f} ms, RSS {rss_pkl:.1f} MB | mmap artifact {t_mm:.1f} ms, RSS {rss_mm:.1f} MB")
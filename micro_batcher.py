@@ -0,0 +1,86 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+# รวมคำขอทำนายจากหลาย session ที่เข้ามาพร้อมกันให้เป็น batch เดียว
+# - รอไม่เกิน max_wait_ms หรือจนได้ max_batch_size แถว แล้วทำนายทั้งก้อนในครั้งเดียว
+# - คืนค่าเป็น Future ต่อคำขอ ได้ผลเป็น (label, proba)
+# - เก็บสถิติ throughput และ latency (p50/p99) ไว้ดูย้อนหลัง
+class MicroBatcher:
+    def __init__(self, predictor, max_batch_size=64, max_wait_ms=5, stats_window=10_000):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=stats_window)   # (เวลาเสร็จ, latency วินาที)
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._total = 0
+
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, features):
+        future = Future()
+        self._queue.put((features, future, time.perf_counter()))
+        return future
+
+    def predict_one(self, features, timeout=10):
+        return self.submit(features).result(timeout=timeout)
+
+    def _collect(self):
+        # บล็อกรอคำขอแรก แล้วเก็บคำขอที่ตามมาภายในเวลาที่กำหนด
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                labels, proba = self.predictor.predict(np.array([b[0] for b in batch], dtype=np.float64))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            done = time.perf_counter()
+            for i, (_, future, started) in enumerate(batch):
+                future.set_result((int(labels[i]), float(proba[i])))
+            with self._stats_lock:
+                self._total += len(batch)
+                self._batch_sizes.append(len(batch))
+                self._latencies.extend((done, done - started) for _, _, started in batch)
+
+    def stats(self):
+        with self._stats_lock:
+            latencies = list(self._latencies)
+            sizes = list(self._batch_sizes)
+            total = self._total
+        if not latencies:
+            return {"requests": total, "throughput_rps": 0.0, "p50_ms": 0.0, "p99_ms": 0.0, "avg_batch": 0.0}
+
+        ends = np.array([t for t, _ in latencies])
+        lat_ms = np.array([l for _, l in latencies]) * 1000
+        span = ends[-1] - ends[0]
+        return {
+            "requests": total,
+            "throughput_rps": len(ends) / span if span > 0 else float(len(ends)),
+            "p50_ms": float(np.percentile(lat_ms, 50)),
+            "p99_ms": float(np.percentile(lat_ms, 99)),
+            "avg_batch": float(np.mean(sizes)),
+        }
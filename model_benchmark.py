@@ -0,0 +1,82 @@
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import joblib
+import numpy as np
+
+from forest_compiler import CompiledForest, is_forest
+from prediction_service import FEATURES, PredictionService
+
+# วัดต้นทุนการให้บริการของโมเดล (ในรูปแบบที่แอปใช้จริง)
+# - latency ของ predict_proba ผ่าน PredictionService: ทีละ 1 แถว (คำขอจากฟอร์ม) และทีละ 1,000 แถว (ส่งออก/ประมวลผลเป็นชุด)
+# - ขนาดไฟล์ที่บันทึก และเวลาโหลดไฟล์กลับขึ้นมา
+# RandomForest วัดในรูป CompiledForest (artifact แบบ mmap) เพราะ load_model() ใน app.py เปิดแบบนั้นเป็นค่าเริ่มต้น
+# โมเดลอื่นวัดจากไฟล์ .pkl ของ joblib
+BATCH_ROWS = 1000
+
+
+def _timings(fn, repeat):
+    # คืนค่าเวลาแต่ละรอบเป็น ms (เรียกก่อน 1 ครั้งเพื่อไม่นับการ warm-up)
+    fn()
+    out = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        out.append((time.perf_counter() - started) * 1000)
+    return out
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def _save_and_load(model, directory):
+    # บันทึกในรูปแบบที่ใช้ให้บริการ คืนค่า (ฟังก์ชันโหลด, ขนาดไฟล์เป็นไบต์, ชนิด)
+    if is_forest(model):
+        path = os.path.join(directory, "artifact")
+        CompiledForest.from_estimator(model).save_artifact(path, FEATURES)
+        return lambda: CompiledForest.load_artifact(path), _dir_size(path), "compiled"
+    path = os.path.join(directory, "model.pkl")
+    joblib.dump(model, path)
+    return lambda: joblib.load(path), os.path.getsize(path), "pickle"
+
+
+def benchmark(model, X, single_repeat=200, batch_repeat=20, load_repeat=5, seed=0):
+    # X: ข้อมูลตัวอย่าง (เช่นชุด train) ใช้สุ่มแถวมาทำนาย
+    X = np.asarray(X, dtype=np.float64)
+    rng = np.random.default_rng(seed)
+    batch = X[rng.integers(0, len(X), BATCH_ROWS)]
+    rows = X[rng.integers(0, len(X), single_repeat + 1)]
+
+    directory = tempfile.mkdtemp(prefix="model_benchmark_")
+    try:
+        load, size, served_as = _save_and_load(model, directory)
+        load_ms = _timings(load, load_repeat)
+        service = PredictionService(load())
+        it = iter(rows)
+        single_ms = _timings(lambda: service.predict_proba(next(it)), single_repeat)
+        batch_ms = _timings(lambda: service.predict_proba(batch), batch_repeat)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    single_ms.sort()
+    return {
+        "served_as": served_as,
+        "single_p50_ms": statistics.median(single_ms),
+        "single_p99_ms": single_ms[min(len(single_ms) - 1, int(len(single_ms) * 0.99))],
+        "batch_1k_ms": statistics.median(batch_ms),
+        "size_kb": size / 1024,
+        "load_ms": statistics.median(load_ms),
+    }
+
+
+def within_budget(row, max_latency_ms=None, max_batch_ms=None, max_size_kb=None, max_load_ms=None):
+    # None = ไม่จำกัด
+    limits = [
+        ("single_p50_ms", max_latency_ms), ("batch_1k_ms", max_batch_ms),
+        ("size_kb", max_size_kb), ("load_ms", max_load_ms),
+    ]
+    return all(limit is None or row[key] <= limit for key, limit in limits)
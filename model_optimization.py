@@ -1,54 +1,130 @@
-import pandas as pd
-from sklearn.model_selection import train_test_split, GridSearchCV
+import argparse
+import json
+import sys
+import time
+
+import joblib
+from dataset import load_frame, read_manifest
+from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.linear_model import LogisticRegression
 from sklearn.svm import SVC
-from sklearn.metrics import classification_report
-
-# โหลดข้อมูล
-url = "https://raw.githubusercontent.com/jbrownlee/Datasets/master/pima-indians-diabetes.data.csv"
-columns = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness',
-           'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age', 'Outcome']
-df = pd.read_csv(url, names=columns)
+from sklearn.calibration import CalibratedClassifierCV
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from sklearn.metrics import classification_report, get_scorer
 
-X = df.drop("Outcome", axis=1)
-y = df["Outcome"]
-
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+from model_benchmark import benchmark, within_budget
+from model_registry import ModelRegistry, data_fingerprint
+from model_search import ModelSearch
 
 # สร้างโมเดลและพารามิเตอร์ที่ต้องการทดลอง
-models = {
-    "RandomForest": RandomForestClassifier(),
-    "LogisticRegression": LogisticRegression(max_iter=1000),
-    "SVM": SVC()
-}
-
-params = {
-    "RandomForest": {
+# (LogisticRegression/SVM ปรับสเกลข้อมูลก่อน ไม่อย่างนั้น SVM แบบ linear แทบไม่ converge กับค่า Insulin/Glucose ดิบ
+#  และ SVC ต้องห่อด้วย CalibratedClassifierCV เพราะแอปใช้ predict_proba)
+CANDIDATES = {
+    "RandomForest": (RandomForestClassifier(random_state=42), {
         "n_estimators": [50, 100],
         "max_depth": [5, 10, None]
-    },
-    "LogisticRegression": {
-        "C": [0.1, 1, 10]
-    },
-    "SVM": {
-        "C": [0.1, 1, 10],
-        "kernel": ["linear", "rbf"]
-    }
+    }),
+    "LogisticRegression": (make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000)), {
+        "logisticregression__C": [0.1, 1, 10]
+    }),
+    "SVM": (make_pipeline(StandardScaler(), CalibratedClassifierCV(SVC(), ensemble=False)), {
+        "calibratedclassifiercv__estimator__C": [0.1, 1, 10],
+        "calibratedclassifiercv__estimator__kernel": ["linear", "rbf"]
+    }),
 }
 
-best_models = {}
 
-for name in models:
-    print(f"Training and tuning {name}...")
-    grid = GridSearchCV(models[name], params[name], cv=5, scoring="accuracy")
-    grid.fit(X_train, y_train)
-    print(f"Best parameters for {name}: {grid.best_params_}")
-    y_pred = grid.predict(X_test)
-    print(classification_report(y_test, y_pred))
-    best_models[name] = grid.best_estimator_
+def main():
+    parser = argparse.ArgumentParser(description="ค้นหาโมเดลที่ดีที่สุดแล้วบันทึกเป็นรุ่นใหม่ใน model registry")
+    parser.add_argument("--search", choices=["grid", "halving"], default="grid")
+    parser.add_argument("--factor", type=int, default=3, help="อัตราตัดผู้เข้ารอบของ successive halving")
+    parser.add_argument("--cv", type=int, default=5)
+    parser.add_argument("--n-jobs", type=int, default=-1)
+    parser.add_argument("--scoring", default="accuracy")
+    parser.add_argument("--no-promote", action="store_true", help="บันทึกรุ่นใหม่แต่ยังไม่ให้แอปใช้")
+    parser.add_argument("--output", help="บันทึกเป็นไฟล์ .pkl เพิ่ม (รูปแบบเดิม)")
+    parser.add_argument("--leaderboard", default="model_leaderboard.json")
+    # งบต้นทุนการให้บริการ (ไม่ระบุ = ไม่จำกัด) เลือกโมเดลคะแนน CV สูงสุดที่อยู่ในงบทุกข้อ
+    parser.add_argument("--max-latency-ms", type=float, help="latency p50 ของการทำนายทีละ 1 แถว")
+    parser.add_argument("--max-batch-ms", type=float, help="latency p50 ของการทำนายทีละ 1,000 แถว")
+    parser.add_argument("--max-size-kb", type=float, help="ขนาดไฟล์โมเดลที่บันทึก")
+    parser.add_argument("--max-load-ms", type=float, help="เวลาโหลดไฟล์โมเดล")
+    args = parser.parse_args()
 
-# บันทึกโมเดลที่ดีที่สุด (RandomForest สมมติเป็นดีที่สุด)
-import joblib
-joblib.dump(best_models["RandomForest"], "optimized_diabetes_model.pkl")
-print("✅ บันทึกโมเดล optimized_diabetes_model.pkl เรียบร้อยแล้ว")
\ No newline at end of file
+    # โหลดข้อมูล
+    df = load_frame()  # จาก cache ในเครื่อง (ดู dataset.py)
+
+    X = df.drop("Outcome", axis=1)
+    y = df["Outcome"]
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    search = ModelSearch(CANDIDATES, scoring=args.scoring, cv=args.cv, n_jobs=args.n_jobs)
+    started = time.perf_counter()
+    if args.search == "halving":
+        ranked, history = search.halving(X_train, y_train, factor=args.factor)
+        rounds = max(res["round"] for res in history) + 1
+        print(f"Successive halving: {len(history)} รายการใน {rounds} รอบ")
+    else:
+        ranked = search.grid(X_train, y_train)
+    elapsed = time.perf_counter() - started
+    print(f"ใช้เวลา {elapsed:.1f} วินาที: เทรนใหม่ {search.fits} fold, ใช้ผลจาก cache {search.cached} fold")
+
+    # เทรนทุกผู้เข้ารอบสุดท้ายด้วยข้อมูล train ทั้งหมด แล้ววัดต้นทุนการให้บริการ
+    budget = {
+        "max_latency_ms": args.max_latency_ms, "max_batch_ms": args.max_batch_ms,
+        "max_size_kb": args.max_size_kb, "max_load_ms": args.max_load_ms,
+    }
+    models = []
+    for res in ranked:
+        model = search.refit(res, X_train, y_train)
+        res.update(benchmark(model, X_train))
+        res["within_budget"] = within_budget(res, **budget)
+        models.append(model)
+
+    print(f"\n{'อันดับ':<6} {'โมเดล':<20} {args.scoring:>9} {'±':>7} {'1 แถว':>9} {'1k แถว':>9} "
+          f"{'ขนาด':>10} {'โหลด':>9}  พารามิเตอร์")
+    for i, res in enumerate(ranked, 1):
+        mark = " " if res["within_budget"] else "✗"
+        print(f"{i:<5}{mark} {res['model']:<20} {res['mean_score']:9.4f} {res['std_score']:7.4f} "
+              f"{res['single_p50_ms']:7.3f}ms {res['batch_1k_ms']:7.2f}ms {res['size_kb']:8.1f}KB "
+              f"{res['load_ms']:7.2f}ms  {res['params']}")
+
+    # เลือกโมเดลที่ได้คะแนน CV สูงสุดในบรรดาโมเดลที่อยู่ในงบ
+    chosen = next((i for i, res in enumerate(ranked) if res["within_budget"]), None)
+    for i, res in enumerate(ranked):
+        res["selected"] = i == chosen
+    with open(args.leaderboard, "w", encoding="utf-8") as f:
+        json.dump({"scoring": args.scoring, "search": args.search, "budget": budget, "candidates": ranked},
+                  f, ensure_ascii=False, indent=2)
+    print(f"บันทึกตารางอันดับ {args.leaderboard}")
+    if chosen is None:
+        print(f"❌ ไม่มีโมเดลที่อยู่ในงบ {budget} จึงไม่บันทึกโมเดล")
+        sys.exit(1)
+
+    best, model = ranked[chosen], models[chosen]
+    print(f"\nโมเดลที่เลือก: {best['model']} {best['params']}")
+    if chosen:
+        print(f"   (อันดับ {chosen + 1} ตามคะแนน CV เพราะอันดับที่สูงกว่าเกินงบ)")
+    print(classification_report(y_test, model.predict(X_test)))
+    test_score = get_scorer(args.scoring)(model, X_test, y_test)
+    print(f"{args.scoring} บนชุดทดสอบ: {test_score:.4f}")
+
+    # บันทึกโมเดลที่เลือกเป็นรุ่นใหม่ใน registry (แอปที่รันอยู่จะสลับมาใช้เองเมื่อ promote)
+    metrics = {f"cv_{args.scoring}": best["mean_score"], f"test_{args.scoring}": float(test_score)}
+    metrics.update({key: best[key] for key in ["single_p50_ms", "batch_1k_ms", "size_kb", "load_ms"]})
+    manifest = ModelRegistry().register(
+        model, name=best["model"], params=best["params"], metrics=metrics,
+        data=data_fingerprint(read_manifest()), source="model_optimization.py", promote=not args.no_promote,
+    )
+    print(f"✅ บันทึกโมเดลรุ่น {manifest['version']} เรียบร้อยแล้ว" + ("" if args.no_promote else " และตั้งเป็นรุ่นที่ใช้งาน"))
+    if args.no_promote:
+        print(f"   รัน python model_registry.py promote {manifest['version']} เมื่อต้องการใช้งาน")
+    if args.output:
+        joblib.dump(model, args.output)
+        print(f"   บันทึกไฟล์ {args.output} ด้วย")
+
+if __name__ == "__main__":
+    main()
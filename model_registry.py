@@ -0,0 +1,285 @@
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+import joblib
+import numpy as np
+
+from forest_compiler import CompiledForest, file_sha256, is_forest
+from prediction_service import FEATURES, PredictionService
+
+# คลังโมเดลในเครื่อง (model registry)
+#
+#   models/
+#     CURRENT              ชื่อรุ่นที่แอปใช้อยู่ (เปลี่ยนด้วย os.replace จึงไม่มีใครอ่านเจอไฟล์ครึ่งๆ กลางๆ)
+#     v0001/
+#       manifest.json      คะแนน, พารามิเตอร์, ลำดับ feature, hash ของข้อมูลที่ใช้เทรน, sha256 ของโมเดล
+#       model.pkl
+#       artifact/          CompiledForest แบบ mmap (เฉพาะ RandomForest)
+#
+# - รุ่นใหม่ถูกเขียนลงโฟลเดอร์ชั่วคราวก่อน แล้วค่อย rename เป็น vNNNN (รุ่นที่เห็นใน registry จึงครบเสมอ)
+# - รุ่นที่บันทึกแล้วไม่ถูกแก้ไขอีก การ rollback คือการชี้ CURRENT กลับไปรุ่นเดิม
+REGISTRY_DIR = os.environ.get(
+    "DIABETES_MODEL_REGISTRY", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+)
+CURRENT = "CURRENT"
+MANIFEST = "manifest.json"
+MODEL_FILE = "model.pkl"
+ARTIFACT_DIR = "artifact"
+VERSION_RE = re.compile(r"v(\d{4,})")
+
+# ช่วงค่าของข้อมูลที่ใช้ warm up โมเดลก่อนสลับรุ่น (ช่วงเดียวกับที่ forest_compiler ใช้ตรวจผล)
+WARMUP_LOW = [0, 40, 30, 0, 0, 15, 0.05, 18]
+WARMUP_HIGH = [15, 200, 120, 60, 500, 55, 2.5, 85]
+
+
+def data_fingerprint(manifest):
+    # ส่วนของ manifest ชุดข้อมูล (dataset.read_manifest()) ที่ระบุว่าเทรนจากข้อมูลชุดไหน
+    return {key: manifest.get(key) for key in ["version", "source", "source_sha256", "rows", "files"]}
+
+
+def _library_versions():
+    import sklearn
+
+    return {"python": sys.version.split()[0], "numpy": np.__version__, "sklearn": sklearn.__version__}
+
+
+class ModelRegistry:
+    def __init__(self, root=REGISTRY_DIR):
+        self.root = root
+
+    def path(self, version):
+        return os.path.join(self.root, version)
+
+    def versions(self):
+        # เรียงจากเก่าไปใหม่
+        if not os.path.isdir(self.root):
+            return []
+        found = [name for name in os.listdir(self.root)
+                 if VERSION_RE.fullmatch(name) and os.path.exists(os.path.join(self.root, name, MANIFEST))]
+        return sorted(found, key=lambda name: int(VERSION_RE.fullmatch(name).group(1)))
+
+    def manifest(self, version):
+        with open(os.path.join(self.path(version), MANIFEST), encoding="utf-8") as f:
+            return json.load(f)
+
+    def current(self):
+        try:
+            with open(os.path.join(self.root, CURRENT), encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def pointer_stamp(self):
+        # ใช้ตรวจว่า CURRENT เปลี่ยนหรือยังโดยไม่ต้องเปิดไฟล์ (os.replace ได้ inode ใหม่ทุกครั้ง)
+        try:
+            st = os.stat(os.path.join(self.root, CURRENT))
+        except FileNotFoundError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def promote(self, version):
+        if version not in self.versions():
+            raise ValueError(f"ไม่พบโมเดลรุ่น {version} ใน {self.root}")
+        tmp = os.path.join(self.root, f".{CURRENT}.{os.getpid()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(version + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.root, CURRENT))
+
+    def rollback(self):
+        # ชี้ CURRENT กลับไปรุ่นก่อนหน้ารุ่นที่ใช้อยู่
+        versions = self.versions()
+        current = self.current()
+        if current not in versions or versions.index(current) == 0:
+            raise ValueError("ไม่มีรุ่นก่อนหน้าให้ย้อนกลับ")
+        previous = versions[versions.index(current) - 1]
+        self.promote(previous)
+        return previous
+
+    def _next_version(self):
+        versions = self.versions()
+        last = int(VERSION_RE.fullmatch(versions[-1]).group(1)) if versions else 0
+        return f"v{last + 1:04d}"
+
+    def register(self, model, name=None, params=None, metrics=None, data=None, source=None, promote=False):
+        # บันทึกโมเดลเป็นรุ่นใหม่ คืนค่า manifest (data: ผลของ data_fingerprint)
+        features = list(getattr(model, "feature_names_in_", FEATURES))
+        if features != FEATURES:
+            raise ValueError(f"ลำดับ feature ของโมเดลไม่ตรงกับแอป: {features}")
+
+        os.makedirs(self.root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".staging-", dir=self.root)
+        try:
+            pkl = os.path.join(staging, MODEL_FILE)
+            joblib.dump(model, pkl)
+            artifact = None
+            if is_forest(model):
+                CompiledForest.from_estimator(model).save_artifact(os.path.join(staging, ARTIFACT_DIR), FEATURES, source=pkl)
+                artifact = ARTIFACT_DIR
+            manifest = {
+                "name": name or type(model).__name__,
+                "estimator": type(model).__name__,
+                "params": params,
+                "metrics": metrics or {},
+                "features": FEATURES,
+                "data": data,
+                "model_sha256": file_sha256(pkl),
+                "artifact": artifact,
+                "source": source,
+                "libraries": _library_versions(),
+                "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            }
+            # ถ้ามีอีก process บันทึกรุ่นเลขเดียวกันไปก่อน rename จะล้มเหลว ให้ลองเลขถัดไป
+            while True:
+                manifest["version"] = self._next_version()
+                with open(os.path.join(staging, MANIFEST), "w", encoding="utf-8") as f:
+                    json.dump(manifest, f, ensure_ascii=False, indent=2)
+                try:
+                    os.rename(staging, self.path(manifest["version"]))
+                    break
+                except OSError:
+                    if not os.path.exists(self.path(manifest["version"])):
+                        raise
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        if promote:
+            self.promote(manifest["version"])
+        return manifest
+
+    def load(self, version, compiled=True):
+        # คืนค่า (โมเดล, manifest) เปิด artifact แบบ mmap เมื่อมี (เหมือน load_model() ใน app.py)
+        manifest = self.manifest(version)
+        path = self.path(version)
+        if compiled and manifest.get("artifact"):
+            try:
+                return CompiledForest.load_artifact(os.path.join(path, manifest["artifact"])), manifest
+            except ValueError:
+                # artifact รุ่นเก่า (รุ่นที่บันทึกแล้วไม่ถูกแก้ไข) แปลงจาก model.pkl ใหม่ในหน่วยความจำแทน
+                return CompiledForest.from_estimator(joblib.load(os.path.join(path, MODEL_FILE))), manifest
+        model = joblib.load(os.path.join(path, MODEL_FILE))
+        return model, manifest
+
+
+def warm_up(service, rows=1000, seed=0):
+    # เรียกโมเดลทั้งแบบทีละแถวและทั้ง batch ก่อนใช้งานจริง (โหลดหน้า mmap, สร้าง cache ภายในของ sklearn/NumPy)
+    X = np.random.default_rng(seed).uniform(WARMUP_LOW, WARMUP_HIGH, size=(rows, len(FEATURES)))
+    for row in X[:32]:
+        service.predict_proba(row)
+    service.predict_proba(X)
+
+
+# ตัวทำนายที่สลับรุ่นโมเดลได้ขณะแอปทำงาน (ใช้แทน PredictionService ได้ทุกที่ รวมถึง MicroBatcher)
+# - thread เบื้องหลังตรวจ CURRENT ทุก interval วินาที เมื่อเปลี่ยนจะโหลดรุ่นใหม่และ warm up ให้เสร็จก่อน
+#   แล้วจึงสลับ (คำขอที่กำลังทำงานอยู่ใช้รุ่นเดิมจนจบ ไม่มีคำขอไหนต้องรอโหลดโมเดล)
+# - ถ้าโหลดรุ่นใหม่ไม่สำเร็จจะใช้รุ่นเดิมต่อและเก็บข้อผิดพลาดไว้ใน last_error
+# - ถ้า registry ยังว่าง หรือโหลดรุ่น CURRENT ไม่สำเร็จตอนเริ่ม ใช้ fallback() (โมเดลไฟล์เดิมของแอป)
+#   แทนการหยุดทั้งแอป (ข้อผิดพลาดเก็บไว้ใน last_error)
+class ModelReloader:
+    def __init__(self, registry, fallback, threshold=0.5, compiled=True, interval=10):
+        self.registry = registry
+        self.threshold = threshold
+        self.compiled = compiled
+        self.interval = interval
+        self.swaps = 0
+        self.last_error = None
+        self.warmup_ms = 0.0
+        self.manifest = None
+        self._lock = threading.Lock()
+
+        self._stamp = registry.pointer_stamp()
+        version = registry.current()
+        self.service = None
+        if version:
+            try:
+                self.service = self._load(version)
+            except Exception as e:
+                self.last_error = f"{version}: {e}"
+        if self.service is None:
+            self.service = fallback()
+        if interval:
+            threading.Thread(target=self._watch, name="model-reloader", daemon=True).start()
+
+    @property
+    def version(self):
+        return self.service.version
+
+    def predict_proba(self, X):
+        return self.service.predict_proba(X)
+
+    def predict(self, X):
+        return self.service.predict(X)
+
+    def predict_with_version(self, X):
+        # ใช้ service ตัวเดียวกันทั้งผลและรุ่น (สลับรุ่นระหว่างทำนายก็ไม่ระบุรุ่นผิด)
+        return self.service.predict_with_version(X)
+
+    def predict_one(self, features):
+        return self.service.predict_one(features)
+
+    def _load(self, version):
+        model, manifest = self.registry.load(version, compiled=self.compiled)
+        service = PredictionService(model, threshold=self.threshold, version=version)
+        started = time.perf_counter()
+        warm_up(service)
+        self.warmup_ms = (time.perf_counter() - started) * 1000
+        self.manifest = manifest
+        return service
+
+    def reload(self):
+        # ตรวจ CURRENT ทันที คืนค่า True เมื่อสลับรุ่น
+        with self._lock:
+            stamp = self.registry.pointer_stamp()
+            if stamp == self._stamp:
+                return False
+            self._stamp = stamp
+            version = self.registry.current()
+            if version is None or version == self.service.version:
+                return False
+            try:
+                service = self._load(version)
+            except Exception as e:
+                self.last_error = f"{version}: {e}"
+                return False
+            self.service = service
+            self.swaps += 1
+            self.last_error = None
+            return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            self.reload()
+
+
+# ใช้งาน: python model_registry.py [list | promote <รุ่น> | rollback | import <ไฟล์.pkl> [--promote]]
+if __name__ == "__main__":
+    registry = ModelRegistry()
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "list":
+        current = registry.current()
+        for version in registry.versions():
+            m = registry.manifest(version)
+            metrics = ", ".join(f"{k}={v:.4f}" if isinstance(v, float) else f"{k}={v}" for k, v in m["metrics"].items())
+            print(f"{'*' if version == current else ' '} {version}  {m['created']}  {m['name']:<20} {metrics}")
+    elif command == "promote" and len(sys.argv) > 2:
+        registry.promote(sys.argv[2])
+        print(f"✅ ใช้โมเดลรุ่น {sys.argv[2]}")
+    elif command == "rollback":
+        print(f"✅ ย้อนกลับไปใช้โมเดลรุ่น {registry.rollback()}")
+    elif command == "import" and len(sys.argv) > 2:
+        # นำไฟล์ .pkl ที่มีอยู่แล้วเข้า registry (ไม่รู้ข้อมูลที่ใช้เทรน จึงไม่มี data hash)
+        manifest = registry.register(joblib.load(sys.argv[2]), source=os.path.basename(sys.argv[2]),
+                                     promote="--promote" in sys.argv)
+        print(f"✅ บันทึกเป็นรุ่น {manifest['version']}")
+    else:
+        print("ใช้งาน: python model_registry.py [list | promote <รุ่น> | rollback | import <ไฟล์.pkl> [--promote]]")
+        sys.exit(1)
@@ -0,0 +1,209 @@
+import bisect
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from prediction_service import cache_key
+
+# ขอบบนของช่อง histogram latency (ms) ช่องสุดท้ายคือมากกว่า 1000 ms
+LATENCY_BUCKETS_MS = [0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000]
+
+
+# histogram ของ latency แบบช่องคงที่ (ใช้หน่วยความจำคงที่ไม่ว่าจะมีคำขอกี่ครั้ง)
+class LatencyHistogram:
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms):
+        self.counts[bisect.bisect_left(self.buckets, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+
+    def quantile(self, q):
+        # ประมาณจากขอบบนของช่องที่ผลสะสมถึง q
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        running = 0
+        for i, c in enumerate(self.counts):
+            running += c
+            if running >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def snapshot(self):
+        labels = [f"≤{b:g}" for b in self.buckets] + [f">{self.buckets[-1]:g}"]
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p99_ms": self.quantile(0.99),
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+# ตัวทำนายที่อ่านแคชผลก่อน แล้วจึงส่งให้ MicroBatcher (ถ้ามี) หรือโมเดลโดยตรง
+# key ของแคชปัด BMI (cache_key) แต่ข้อมูลที่ส่งให้โมเดลเป็นค่าจริงที่ไม่ปัด
+class CachedPredictor:
+    def __init__(self, predictor, cache, batcher=None, bmi_precision=1):
+        self.predictor = predictor
+        self.cache = cache
+        self.batcher = batcher
+        self.bmi_precision = bmi_precision
+
+    @property
+    def version(self):
+        return self.predictor.version
+
+    def lookup(self, features):
+        # คืนค่า (ผลทำนาย, True ถ้าได้จากแคช)
+        version = self.predictor.version
+        key = cache_key(features, self.bmi_precision)
+        result = self.cache.get(version, key)
+        if result is not None:
+            return result, True
+        if self.batcher is not None:
+            result = self.batcher.predict_one(features)
+        else:
+            result = self.predictor.predict_one(features)
+        # ไม่เก็บผลลงแคชถ้าโมเดลเพิ่งสลับรุ่นระหว่างทำนาย
+        if self.predictor.version == version:
+            self.cache.put(version, key, result)
+        return result, False
+
+    def predict_one(self, features):
+        return self.lookup(features)[0]
+
+
+# แบ่งคำขอระหว่างโมเดลหลัก (primary) กับโมเดลที่กำลังทดลอง (candidate)
+# - A/B: ผู้ใช้ percent% ได้ผลจาก candidate (เลือกจาก hash ของอีเมล ผู้ใช้คนเดิมจึงได้โมเดลเดิมทุกครั้ง)
+# - shadow: ทำนายด้วยอีกโมเดลหนึ่งใน thread เบื้องหลัง ไม่ให้ผู้ใช้ต้องรอ แล้วเก็บผลไว้เทียบ
+#   ถ้างาน shadow ค้างเกิน max_pending จะข้ามไป (ไม่ให้คิวโตไม่จำกัดเมื่อโหลดสูง)
+# - ถ้า candidate ทำนายผิดพลาด ใช้ผลของ primary แทน
+# - เก็บ histogram latency แยกตามรุ่นโมเดลและบทบาท (serve / shadow) เฉพาะคำขอที่โมเดลทำนายจริง
+#   ผลที่ได้จากแคชนับแยกเป็น cache hit (ไม่เช่นนั้น latency ของรุ่นที่แคชอุ่นแล้วจะดูเร็วกว่าความจริง)
+# - ถ้า candidate ถูก promote เป็นรุ่นหลักแล้ว (รุ่นเดียวกับ primary) เลิกแบ่งคำขอและเลิก shadow
+class ModelRouter:
+    def __init__(self, primary, candidate=None, percent=0, shadow=True, salt="", max_pending=64):
+        self.arms = {"primary": primary, "candidate": candidate}
+        self.percent = percent if candidate is not None else 0
+        self.shadow = shadow and candidate is not None
+        self.salt = salt
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._hits = {}
+        self.retired = None
+        self._pending = 0
+        self.shadow_skipped = 0
+        self.compared = 0
+        self.disagreed = 0
+        self.fallbacks = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow") if self.shadow else None
+
+    def arm(self, user):
+        if not self.percent or not user:
+            return "primary"
+        digest = hashlib.sha256(f"{self.salt}:{user}".encode("utf-8")).digest()
+        return "candidate" if int.from_bytes(digest[:4], "big") % 10000 < self.percent * 100 else "primary"
+
+    def _observe(self, version, role, ms):
+        with self._lock:
+            hist = self._histograms.get((version, role))
+            if hist is None:
+                hist = self._histograms[(version, role)] = LatencyHistogram()
+            hist.observe(ms)
+
+    def _hit(self, version, role):
+        with self._lock:
+            self._hits[(version, role)] = self._hits.get((version, role), 0) + 1
+
+    def _timed(self, arms, name, role, features):
+        model = arms[name]
+        version = model.version
+        started = time.perf_counter()
+        if hasattr(model, "lookup"):
+            (label, proba), hit = model.lookup(features)
+        else:
+            (label, proba), hit = model.predict_one(features), False
+        ms = (time.perf_counter() - started) * 1000
+        if hit:
+            self._hit(version, role)
+        else:
+            self._observe(version, role, ms)
+        return {"arm": name, "version": version, "prediction": label, "proba": proba, "latency_ms": ms,
+                "cache_hit": hit}
+
+    def _retire_promoted(self):
+        # candidate กลายเป็นรุ่นเดียวกับ primary (promote แล้วโมเดลหลักสลับรุ่น): เลิกทดลอง
+        candidate = self.arms["candidate"]
+        if candidate is None or candidate.version != self.arms["primary"].version:
+            return
+        # สลับทั้ง dict คำขอที่กำลังทำงานอยู่จึงใช้ชุดเดิมจนจบ
+        with self._lock:
+            self.retired = candidate.version
+            self.percent = 0
+            self.shadow = False
+            self.arms = {"primary": self.arms["primary"], "candidate": None}
+
+    def _run_shadow(self, arms, name, features, served):
+        try:
+            out = self._timed(arms, name, "shadow", features)
+        except Exception as e:
+            out = {"arm": name, "version": arms[name].version, "error": str(e)}
+        with self._lock:
+            self._pending -= 1
+            if "error" not in out:
+                self.compared += 1
+                self.disagreed += out["prediction"] != served["prediction"]
+        return out
+
+    def predict(self, features, user=None):
+        # คืนค่า (ผลที่ใช้ตอบผู้ใช้, Future ของผล shadow หรือ None)
+        self._retire_promoted()
+        arms, shadow_on = self.arms, self.shadow
+        name = self.arm(user) if arms["candidate"] is not None else "primary"
+        try:
+            served = self._timed(arms, name, "serve", features)
+        except Exception:
+            if name == "primary":
+                raise
+            with self._lock:
+                self.fallbacks += 1
+            name = "primary"
+            served = self._timed(arms, name, "serve", features)
+
+        shadow = None
+        if shadow_on and arms["candidate"] is not None:
+            other = "candidate" if name == "primary" else "primary"
+            with self._lock:
+                accept = self._pending < self.max_pending
+                if accept:
+                    self._pending += 1
+                else:
+                    self.shadow_skipped += 1
+            if accept:
+                shadow = self._executor.submit(self._run_shadow, arms, other, features, served)
+        return served, shadow
+
+    def stats(self):
+        with self._lock:
+            histograms = {}
+            for version, role in sorted(set(self._histograms) | set(self._hits)):
+                snapshot = self._histograms.get((version, role), LatencyHistogram()).snapshot()
+                hits = self._hits.get((version, role), 0)
+                snapshot["cache_hits"] = hits
+                snapshot["hit_rate"] = hits / (hits + snapshot["count"])
+                histograms[f"{version} ({role})"] = snapshot
+            return {
+                "histograms": histograms,
+                "compared": self.compared,
+                "disagreed": self.disagreed,
+                "shadow_skipped": self.shadow_skipped,
+                "fallbacks": self.fallbacks,
+            }
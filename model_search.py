@@ -0,0 +1,132 @@
+import math
+import time
+
+import numpy as np
+from joblib import Memory, Parallel, delayed
+from sklearn.base import clone
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+
+# ค้นหา hyperparameter ของหลายโมเดลพร้อมกัน
+# - งาน (โมเดล, พารามิเตอร์, fold) ของทุกโมเดลถูกกระจายไปบน process pool ในคราวเดียว (joblib/loky)
+# - ผลของแต่ละงานถูกจำไว้บนดิสก์ด้วย joblib.Memory (คีย์ = ชนิดโมเดล + พารามิเตอร์ + fold + ข้อมูล)
+#   รันซ้ำจะเทรนเฉพาะจุดใน grid ที่ยังไม่เคยรัน
+# - โหมด "halving" (successive halving): รอบแรกเทรนทุกพารามิเตอร์ด้วยข้อมูลส่วนน้อย
+#   แล้วเก็บไว้เฉพาะ 1/factor ที่ดีที่สุดไปเทรนด้วยข้อมูลมากขึ้นทีละ factor เท่า
+#   รอบสุดท้ายใช้ข้อมูลเต็มเสมอ คะแนนของทุกโมเดลจึงเทียบกันได้
+# - X ใช้เป็น DataFrame ตามที่ได้จาก dataset.load_frame() ทั้งตอนเทรน ตอนให้คะแนน และตอน refit
+#   (โมเดลทุกตัวจึงมี feature_names_in_ ตรงกับ FEATURES และไม่ถูกเรียกด้วย ndarray ที่ไม่มีชื่อคอลัมน์)
+CACHE_DIR = ".search_cache"
+
+
+def _rows(X, idx):
+    return X.iloc[idx] if hasattr(X, "iloc") else X[idx]
+
+
+def _fit_and_score(estimator, params, X, y, train_idx, test_idx, scoring):
+    model = clone(estimator).set_params(**params)
+    started = time.perf_counter()
+    model.fit(_rows(X, train_idx), y[train_idx])
+    fit_time = time.perf_counter() - started
+    score = get_scorer(scoring)(model, _rows(X, test_idx), y[test_idx])
+    return {"score": float(score), "fit_time": fit_time}
+
+
+class ModelSearch:
+    def __init__(self, candidates, scoring="accuracy", cv=5, n_jobs=-1, cache_dir=CACHE_DIR,
+                 random_state=42, verbose=0):
+        # candidates: {ชื่อ: (estimator, param_grid)}
+        self.candidates = candidates
+        self.scoring = scoring
+        self.cv = cv
+        self.n_jobs = n_jobs
+        self.random_state = random_state
+        self.verbose = verbose
+        self.memory = Memory(cache_dir, verbose=0)
+        self._fit_and_score = self.memory.cache(_fit_and_score)
+        self.fits = 0
+        self.cached = 0
+
+    def _folds(self, X, y, n_samples):
+        # fold เดิมทุกครั้ง (random_state คงที่) และใช้ข้อมูล train ส่วนแรกตามลำดับสุ่มที่คงที่เมื่อใช้ข้อมูลไม่เต็ม
+        folds = StratifiedKFold(self.cv, shuffle=True, random_state=self.random_state).split(X, y)
+        rng = np.random.default_rng(self.random_state)
+        for train_idx, test_idx in folds:
+            train_idx = rng.permutation(train_idx)
+            if n_samples is not None and n_samples < len(train_idx):
+                train_idx = np.sort(train_idx[:n_samples])
+            else:
+                train_idx = np.sort(train_idx)
+            yield train_idx, test_idx
+
+    def _evaluate(self, X, y, jobs, n_samples=None):
+        # jobs: list ของ (ชื่อ, params) คืนค่า list ของผลเฉลี่ยข้าม fold ตามลำดับ jobs
+        folds = list(self._folds(X, y, n_samples))
+        tasks = [(name, params, train_idx, test_idx)
+                 for name, params in jobs for train_idx, test_idx in folds]
+        for name, params, train_idx, test_idx in tasks:
+            if self._fit_and_score.check_call_in_cache(
+                    self.candidates[name][0], params, X, y, train_idx, test_idx, self.scoring):
+                self.cached += 1
+            else:
+                self.fits += 1
+        outputs = Parallel(n_jobs=self.n_jobs, verbose=self.verbose)(
+            delayed(self._fit_and_score)(self.candidates[name][0], params, X, y, train_idx, test_idx, self.scoring)
+            for name, params, train_idx, test_idx in tasks
+        )
+        results = []
+        for i, (name, params) in enumerate(jobs):
+            per_fold = outputs[i * len(folds):(i + 1) * len(folds)]
+            scores = [o["score"] for o in per_fold]
+            results.append({
+                "model": name,
+                "params": params,
+                "mean_score": float(np.mean(scores)),
+                "std_score": float(np.std(scores)),
+                "mean_fit_time": float(np.mean([o["fit_time"] for o in per_fold])),
+                "n_samples": n_samples or int(len(X) * (self.cv - 1) / self.cv),
+            })
+        return results
+
+    def grid(self, X, y):
+        # ลองทุกจุดใน grid ของทุกโมเดลด้วยข้อมูลเต็ม
+        y = np.asarray(y)
+        jobs = [(name, params) for name, (_, grid) in self.candidates.items() for params in ParameterGrid(grid)]
+        return self._rank(self._evaluate(X, y, jobs))
+
+    def halving(self, X, y, factor=3, min_samples=None):
+        y = np.asarray(y)
+        n_train = int(len(X) * (self.cv - 1) / self.cv)
+        alive = {name: list(ParameterGrid(grid)) for name, (_, grid) in self.candidates.items()}
+        n_rounds = max(1, math.ceil(math.log(max(len(c) for c in alive.values()), factor)) + 1)
+        if min_samples is None:
+            min_samples = max(n_train // factor ** (n_rounds - 1), 2 * len(np.unique(y)) * self.cv)
+
+        history = []
+        for r in range(n_rounds):
+            last = r == n_rounds - 1
+            n_samples = None if last else min(n_train, min_samples * factor ** r)
+            jobs = [(name, params) for name, params_list in alive.items() for params in params_list]
+            results = self._evaluate(X, y, jobs, n_samples)
+            for res in results:
+                res["round"] = r
+            history.extend(results)
+            if last:
+                break
+            # เก็บไว้ 1/factor ที่ดีที่สุดของแต่ละโมเดล (อย่างน้อย 1)
+            for name in alive:
+                ranked = sorted((res for res in results if res["model"] == name),
+                                key=lambda res: res["mean_score"], reverse=True)
+                keep = max(1, math.ceil(len(ranked) / factor))
+                alive[name] = [res["params"] for res in ranked[:keep]]
+        final = [res for res in history if res["round"] == n_rounds - 1]
+        return self._rank(final), history
+
+    @staticmethod
+    def _rank(results):
+        return sorted(results, key=lambda res: (-res["mean_score"], res["std_score"]))
+
+    def refit(self, result, X, y):
+        # เทรนโมเดลที่เลือกด้วยข้อมูล train ทั้งหมด
+        estimator = self.candidates[result["model"]][0]
+        return clone(estimator).set_params(**result["params"]).fit(X, y)
@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# ลำดับคอลัมน์ที่โมเดลใช้ตอนเทรน (Pima Indians Diabetes dataset)
+FEATURES = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness',
+            'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age']
+BMI_INDEX = FEATURES.index('BMI')
+
+
+# บริการทำนายผลที่ห่อโมเดลไว้
+# - คำนวณ predict_proba ครั้งเดียว แล้วตัดสินผลจาก threshold (ไม่เรียก predict ซ้ำ)
+# - รับข้อมูลได้ทีละหลายแถว (NumPy array หรือ DataFrame) เพื่อทำนายแบบ vectorized
+# - โมเดล sklearn ที่เทรนด้วย DataFrame (มี feature_names_in_) ได้ข้อมูลเป็น DataFrame ตาม FEATURES
+#   เหมือนตอนเทรน ส่วน CompiledForest ได้ ndarray
+class PredictionService:
+    def __init__(self, model, threshold=0.5, version=None):
+        self.model = model
+        self.threshold = threshold
+        self.version = version      # ใช้แยกแคชของโมเดลแต่ละรุ่น
+        self._pos = list(model.classes_).index(1)
+        self._named = hasattr(model, "feature_names_in_")
+
+    def to_matrix(self, X):
+        if isinstance(X, pd.DataFrame):
+            # ถ้ามีชื่อคอลัมน์ครบ ให้เรียงตามลำดับที่โมเดลต้องการ
+            if set(FEATURES).issubset(X.columns):
+                X = X[FEATURES]
+            X = X.to_numpy()
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != len(FEATURES):
+            raise ValueError(f"ต้องมีข้อมูล {len(FEATURES)} คอลัมน์ แต่ได้ {X.shape[1]}")
+        return X
+
+    def predict_proba(self, X):
+        # ความน่าจะเป็นที่จะเป็นเบาหวาน (class 1) ของทุกแถว
+        X = self.to_matrix(X)
+        if self._named:
+            X = pd.DataFrame(X, columns=FEATURES)
+        return self.model.predict_proba(X)[:, self._pos]
+
+    def predict(self, X):
+        # ใช้ ">" เพื่อให้ผลตรงกับ model.predict เดิมเมื่อ threshold = 0.5
+        proba = self.predict_proba(X)
+        return (proba > self.threshold).astype(int), proba
+
+    def predict_with_version(self, X):
+        # (labels, proba, รุ่นของโมเดลที่ทำนาย)
+        labels, proba = self.predict(X)
+        return labels, proba, self.version
+
+    def predict_one(self, features):
+        labels, proba = self.predict([features])
+        return int(labels[0]), float(proba[0])
+
+
+def normalize_features(features):
+    # แปลงข้อมูล 8 ค่าให้เป็น tuple ของ float (ข้อมูลที่ส่งให้โมเดลตามที่ผู้ใช้กรอก ไม่ปัดค่า)
+    return tuple(float(v) for v in features)
+
+
+def cache_key(features, bmi_precision=1):
+    # key ของแคชผลการทำนาย: ปัด BMI ตามความละเอียดที่กำหนด ให้ส่วนสูง/น้ำหนักที่ต่างกันเล็กน้อยใช้ผลร่วมกัน
+    # (ใช้เป็น key เท่านั้น โมเดลยังได้ค่า BMI จริง)
+    values = list(normalize_features(features))
+    values[BMI_INDEX] = round(values[BMI_INDEX], bmi_precision)
+    return tuple(values)
+
+
+# แคชผลการทำนายแบบ LRU ใช้ข้อมูล 8 ค่า (ที่ normalize แล้ว) เป็น key
+# ล้างแคชทั้งหมดอัตโนมัติเมื่อรุ่นของโมเดลเปลี่ยน
+class PredictionCache:
+    def __init__(self, maxsize=10_000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._version = None
+
+    def _check_version(self, version):
+        if version != self._version:
+            self._data.clear()
+            self._version = version
+
+    def get(self, version, key):
+        with self._lock:
+            self._check_version(version)
+            result = self._data.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, version, key, result):
+        with self._lock:
+            self._check_version(version)
+            self._data[key] = result
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "size": len(self._data),
+            }
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import firestore_reads
+
+# แคชโปรไฟล์ผู้ใช้ต่อ session (เก็บใน st.session_state) พร้อมเลขรุ่นของแต่ละอีเมลที่แชร์กันทั้ง process
+# - อ่าน users/{email} จาก Firestore ครั้งเดียว แล้วใช้ซ้ำทุก rerun ตราบที่เลขรุ่นไม่เปลี่ยน
+# - เมื่อมีการแก้ไขโปรไฟล์ (โดยเจ้าของหรือแอดมิน) ให้เรียก update()/evict() เพื่อเพิ่มเลขรุ่น
+#   ทุก session ที่ถือแคชของอีเมลนั้นจะโหลดใหม่ในการ rerun ถัดไป
+# - มี TTL กันข้อมูลค้าง กรณีถูกแก้จาก process อื่น
+SESSION_KEY = "_profile_cache"
+
+_lock = threading.Lock()
+_versions = {}
+
+
+def current_version(email):
+    with _lock:
+        return _versions.get(email, 0)
+
+
+def _bump(email):
+    with _lock:
+        _versions[email] = _versions.get(email, 0) + 1
+        return _versions[email]
+
+
+def get_profile(session_state, db, email, ttl_seconds=300):
+    # คืนค่า dict ของเอกสาร users/{email} ({} ถ้ายังไม่มีเอกสาร)
+    entry = session_state.get(SESSION_KEY)
+    if (entry and entry["email"] == email
+            and entry["version"] == current_version(email)
+            and time.time() - entry["loaded_at"] < ttl_seconds):
+        return entry["profile"]
+
+    version = current_version(email)
+    doc = firestore_reads.tracked_get(db.collection("users").document(email))
+    profile = doc.to_dict() if doc.exists else {}
+    session_state[SESSION_KEY] = {
+        "email": email, "version": version, "profile": profile, "loaded_at": time.time(),
+    }
+    return profile
+
+
+def update(session_state, email, data):
+    # เรียกหลังเขียน users/{email} แบบ merge: อัปเดตแคชของ session นี้ทันที และให้ session อื่นโหลดใหม่
+    version = _bump(email)
+    entry = session_state.get(SESSION_KEY)
+    if entry and entry["email"] == email:
+        entry["profile"] = {**entry["profile"], **data}
+        entry["version"] = version
+
+
+def evict(email):
+    # เรียกเมื่อโปรไฟล์ของ email ถูกแก้หรือลบจากที่อื่น (เช่น แอดมินเปลี่ยนสิทธิ์)
+    _bump(email)
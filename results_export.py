@@ -0,0 +1,73 @@
+import csv
+import io
+
+from openpyxl import Workbook
+
+import results_pager
+from risk_status import add_status_column
+
+# คอลัมน์ของไฟล์ส่งออก (ต้องรู้หัวตารางก่อนเริ่มเขียนแบบ stream)
+EXPORT_COLUMNS = [
+    "สถานะ", "ชื่อ-นามสกุล", "result", "glucose", "bmi", "datetime", "user",
+    "name", "role", "pregnancies", "blood_pressure", "skin_thickness", "insulin",
+    "weight", "height_cm", "diabetes_pedigree", "age",
+]
+
+
+def iter_firestore_rows(db, page_size=500, **filters):
+    # ไล่ดึง collection results ทีละหน้าด้วย cursor ใช้หน่วยความจำไม่เกินขนาดหน้า
+    # filters ส่งต่อให้ results_pager.fetch_page (risk_level / token / user)
+    after = None
+    while True:
+        docs, has_next = results_pager.fetch_page(db, page_size, after, **filters)
+        if docs:
+            yield add_status_column([doc.to_dict() for doc in docs])
+        if not has_next:
+            return
+        after = docs[-1]
+
+
+def iter_chunks(items, chunk_size=500):
+    # แบ่ง list ที่อยู่ในหน่วยความจำอยู่แล้ว (เช่น ผลค้นหาจาก result_store) เป็นก้อนๆ
+    for i in range(0, len(items), chunk_size):
+        yield items[i:i + chunk_size]
+
+
+# st.download_button ส่งไฟล์ให้เบราว์เซอร์จาก bytes ก้อนเดียว (ไม่รองรับการ stream)
+# จึงสร้างไฟล์ใน BytesIO: การอ่าน Firestore ใช้หน่วยความจำไม่เกินขนาดหน้า แต่หน่วยความจำสูงสุดของการส่งออก
+# เท่ากับขนาดไฟล์ที่ส่งออก (ชั่วขณะประมาณ 2 เท่าตอน getvalue() คัดลอกเป็น bytes)
+def write_csv(chunks):
+    out = io.BytesIO()
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    writer = csv.DictWriter(text, fieldnames=EXPORT_COLUMNS, restval="", extrasaction="ignore")
+    writer.writeheader()
+    for rows in chunks:
+        for row in rows:
+            writer.writerow(row)
+    text.flush()
+    text.detach()
+    return out.getvalue()
+
+
+def write_xlsx(chunks):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("results")
+    ws.append(EXPORT_COLUMNS)
+    for rows in chunks:
+        for row in rows:
+            values = []
+            for col in EXPORT_COLUMNS:
+                v = row.get(col, "")
+                # openpyxl ไม่รองรับ datetime ที่มี timezone
+                if hasattr(v, "tzinfo") and v.tzinfo is not None:
+                    v = v.replace(tzinfo=None)
+                values.append(v)
+            ws.append(values)
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+def export(fmt, chunks):
+    # chunks คือ iterable ของ list[dict] (ทีละหน้า) คืนค่าเป็น bytes ของไฟล์ทั้งไฟล์
+    return write_xlsx(chunks) if fmt == "xlsx" else write_csv(chunks)
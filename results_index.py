@@ -0,0 +1,70 @@
+import time
+from datetime import datetime
+
+import firestore_reads
+import results_pager
+from risk_status import risk_level
+from user_directory import search_tokens
+
+# ฟิลด์ที่บันทึกเพิ่มในทุกผล (results) เพื่อให้กรองในหน้าแอดมินด้วย index ของ Firestore ได้
+# - risk_level: "high" / "watch" / "normal" (ใช้คู่กับ composite index (risk_level, datetime))
+# - name_tokens: token ตัวพิมพ์เล็กของอีเมล ชื่อ และนามสกุล (array_contains คู่กับ datetime)
+#   เป็น prefix ของแต่ละคำ 2-12 ตัวอักษร จึงค้นได้เฉพาะคำค้นที่ตรงกับต้นคำ
+# ผลที่บันทึกก่อนมีฟิลด์เหล่านี้จะหาไม่เจอด้วย index จนกว่าจะ backfill() ครบ
+# backfill() ที่ทำจนจบจะเขียน app_meta/results_index ไว้ หน้าแอดมินใช้ index เมื่อมีเอกสารนี้แล้วเท่านั้น
+MAX_BATCH_WRITES = 500
+MARKER = "app_meta/results_index"
+MARKER_VERSION = 1
+MARKER_RECHECK_SECONDS = 60
+
+_marker = {"done": False, "checked_at": 0.0}
+
+
+def indexed_fields(record, profile):
+    # ผลที่นำเข้าจากไฟล์อาจไม่มีโปรไฟล์ ใช้ชื่อที่บันทึกไว้ในผลแทน
+    return {
+        "risk_level": risk_level(record.get("glucose", 0), record.get("result")),
+        "name_tokens": search_tokens(record.get("user"), profile.get("name") or record.get("name") or "",
+                                     profile.get("lastname", "")),
+    }
+
+
+def backfill_done(db):
+    # ตรวจเอกสาร marker (เมื่อพบแล้วจำไว้ทั้ง process ถ้ายังไม่พบตรวจซ้ำไม่เกินทุก MARKER_RECHECK_SECONDS)
+    if _marker["done"]:
+        return True
+    if time.monotonic() - _marker["checked_at"] < MARKER_RECHECK_SECONDS and _marker["checked_at"]:
+        return False
+    doc = firestore_reads.tracked_get(db.document(MARKER))
+    _marker["done"] = doc.exists and doc.to_dict().get("version", 0) >= MARKER_VERSION
+    _marker["checked_at"] = time.monotonic()
+    return _marker["done"]
+
+
+def backfill(db, profiles, page_size=500):
+    # เติม risk_level / name_tokens ให้ผลที่บันทึกไว้ก่อนมีฟิลด์เหล่านี้ (หรือเมื่อชื่อผู้ใช้เปลี่ยน)
+    # profiles: dict {email: ข้อมูลโปรไฟล์} คืนค่าจำนวนเอกสารที่อัปเดต
+    updated = 0
+    batch, pending = db.batch(), 0
+    after = None
+    while True:
+        docs, has_next = results_pager.fetch_page(db, page_size, after)
+        for doc in docs:
+            d = doc.to_dict()
+            fields = indexed_fields(d, profiles.get(d.get("user"), {}))
+            if all(d.get(k) == v for k, v in fields.items()):
+                continue
+            batch.update(doc.reference, fields)
+            pending += 1
+            updated += 1
+            if pending == MAX_BATCH_WRITES:
+                batch.commit()
+                batch, pending = db.batch(), 0
+        if not has_next:
+            break
+        after = docs[-1]
+    if pending:
+        batch.commit()
+    db.document(MARKER).set({"version": MARKER_VERSION, "completed_at": datetime.now(), "updated": updated})
+    _marker["done"] = True
+    return updated
@@ -0,0 +1,32 @@
+from firebase_admin import firestore
+
+import firestore_reads
+
+
+def filtered_query(db, risk_level=None, token=None, user=None):
+    query = db.collection("results")
+    if risk_level is not None:
+        query = query.where(filter=firestore.FieldFilter("risk_level", "==", risk_level))
+    if token is not None:
+        query = query.where(filter=firestore.FieldFilter("name_tokens", "array_contains", token))
+    if user is not None:
+        query = query.where(filter=firestore.FieldFilter("user", "==", user))
+    return query
+
+
+def fetch_page(db, page_size, after=None, risk_level=None, token=None, user=None):
+    # ดึงผลทีละหน้าเรียงจากใหม่ไปเก่า โดยใช้ cursor (start_after) ต่อจากเอกสารสุดท้ายของหน้าก่อน
+    # ดึงเกินมา 1 รายการเพื่อรู้ว่ายังมีหน้าถัดไปหรือไม่
+    # กรองด้วย risk_level / token (name_tokens) / user ได้ โดยใช้ composite index ใน firestore.indexes.json
+    # จึงอ่านเฉพาะเอกสารที่ตรงเงื่อนไข
+    query = (
+        filtered_query(db, risk_level, token, user)
+        .order_by("datetime", direction=firestore.Query.DESCENDING)
+        .limit(page_size + 1)
+    )
+    if after is not None:
+        query = query.start_after(after)
+
+    docs = list(firestore_reads.tracked(query.stream()))
+    has_next = len(docs) > page_size
+    return docs[:page_size], has_next
@@ -0,0 +1,177 @@
+import itertools
+import threading
+import time
+from collections import defaultdict, deque
+
+from firebase_admin import firestore
+
+import firestore_reads
+from risk_status import RISK_LEVELS, risk_codes
+
+
+# ที่เก็บข้อมูล collection "results" แบบแชร์กันทั้ง process
+# - โหลดครั้งแรกครั้งเดียว: อ่านจากใหม่ไปเก่าแบบ stream และเติมเข้าหัวแถวทีละ APPEND_CHUNK เอกสาร
+#   อ่านไม่เกิน max_records รายการล่าสุด หน่วยความจำสูงสุดจึงเป็น max_records dict + snapshot ไม่เกิน 1 ก้อน
+# - หลังจากนั้นดึงเฉพาะเอกสารที่ถูกเขียนหลังจากที่เห็นล่าสุด (saved_at ซึ่งเป็นเวลาเขียนฝั่งเซิร์ฟเวอร์)
+#   ไม่ใช้ datetime เพราะผลที่นำเข้าจากไฟล์หรือที่ spool เขียนช้ามี datetime เก่ากว่าค่าล่าสุดได้
+#   ถ้าพบเอกสารที่ datetime เก่ากว่ารายการล่าสุดในแคช (ต้องแทรกกลางแถว) จะโหลดใหม่ทั้งหมดแทน
+#   (ผลเก่าที่ยังไม่มี saved_at: ใช้ datetime เป็น high-water แบบเดิม)
+# - โหลดใหม่ทั้งหมดเมื่อครบ TTL (เพื่อเก็บการลบ/แก้ไขที่เกิดขึ้นจากที่อื่น)
+# - มี index ตามอีเมลผู้ใช้และระดับความเสี่ยง สำหรับค้นหา/กรองโดยไม่ต้องไล่ทั้งตาราง
+APPEND_CHUNK = 5000
+
+
+def _chunks(docs):
+    # list ของ (doc_id, dict) ทีละไม่เกิน APPEND_CHUNK เอกสาร (ข้ามเอกสารที่ไม่มี datetime)
+    docs = iter(firestore_reads.tracked(docs))
+    while True:
+        chunk = list(itertools.islice(docs, APPEND_CHUNK))
+        if not chunk:
+            return
+        pairs = [(doc.id, doc.to_dict()) for doc in chunk]
+        del chunk
+        yield [(doc_id, d) for doc_id, d in pairs if "datetime" in d]
+
+
+class ResultStore:
+    def __init__(self, db, ttl_seconds=600, refresh_seconds=10, max_records=200_000):
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = refresh_seconds
+        self.max_records = max_records
+
+        self._lock = threading.Lock()
+        self._reset()
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+        self._dirty = True
+
+    def _reset(self):
+        self._records = deque()                 # (doc_id, dict, status) เรียงตาม datetime จากเก่าไปใหม่
+        self._ids = set()
+        self._by_user = defaultdict(deque)
+        self._by_status = defaultdict(deque)
+        self._high_water = None                 # datetime ของรายการล่าสุด
+        self._saved_high = None                 # saved_at มากที่สุดที่เห็น
+        self.truncated = False
+
+    def _entries(self, chunk):
+        # (doc_id, dict) ทั้งก้อน -> (doc_id, dict, status) คำนวณระดับความเสี่ยงในครั้งเดียว
+        fresh = [(doc_id, d) for doc_id, d in chunk if doc_id not in self._ids]
+        codes = risk_codes([d.get("glucose", 0) for _, d in fresh], [d.get("result") for _, d in fresh])
+        for (doc_id, d), code in zip(fresh, codes):
+            saved = d.get("saved_at")
+            if saved is not None and (self._saved_high is None or saved > self._saved_high):
+                self._saved_high = saved
+            yield doc_id, d, RISK_LEVELS[code]
+
+    def _add(self, entry, left=False):
+        doc_id, d, status = entry
+        self._ids.add(doc_id)
+        for queue in (self._records, self._by_user[d.get("user")], self._by_status[status]):
+            queue.appendleft(entry) if left else queue.append(entry)
+
+    def _append(self, chunk):
+        for entry in self._entries(chunk):
+            if entry[0] in self._ids:
+                continue
+            self._add(entry)
+            self._high_water = entry[1]["datetime"]
+
+        # ตัดรายการเก่าทิ้งเมื่อเกินเพดานหน่วยความจำ
+        # (รายการที่เก่าที่สุดย่อมอยู่หัวแถวของทุก index ด้วย จึง popleft ได้ทันที)
+        while len(self._records) > self.max_records:
+            doc_id, d, status = self._records.popleft()
+            self._ids.discard(doc_id)
+            self._by_user[d.get("user")].popleft()
+            self._by_status[status].popleft()
+            self.truncated = True
+
+    def _full_load(self):
+        # stream จากใหม่ไปเก่า เติมเข้าหัวแถว (ลำดับในแคชจึงยังเป็นเก่าไปใหม่) ไม่ต้องเก็บ snapshot ทั้งหมดไว้ก่อน
+        self._reset()
+        # saved_at ล่าสุดของทั้ง collection (อ่านก่อนโหลด) ใช้เป็นจุดเริ่มของ _fetch_newer
+        # แม้เอกสารนั้นจะเก่าเกินกว่าจะอยู่ใน max_records รายการที่โหลด (ไม่เช่นนั้นจะถูกดึงซ้ำและโหลดใหม่ทุกรอบ)
+        latest = list(firestore_reads.tracked(
+            self.db.collection("results").order_by("saved_at", direction=firestore.Query.DESCENDING).limit(1).stream()
+        ))
+        self._saved_high = latest[0].to_dict().get("saved_at") if latest else None
+        query = (
+            self.db.collection("results")
+            .order_by("datetime", direction=firestore.Query.DESCENDING)
+            .limit(self.max_records + 1)
+        )
+        for chunk in _chunks(query.stream()):
+            for entry in self._entries(chunk):
+                if len(self._records) == self.max_records:
+                    self.truncated = True
+                    break
+                if self._high_water is None:
+                    self._high_water = entry[1]["datetime"]
+                self._add(entry, left=True)
+        self._loaded_at = time.monotonic()
+
+    def _fetch_newer(self):
+        # ใช้ >= แล้วกรองซ้ำด้วย doc id เพื่อไม่พลาดเอกสารที่เวลาเท่ากับ high-water
+        query = self.db.collection("results")
+        if self._saved_high is not None:
+            query = query.where(filter=firestore.FieldFilter("saved_at", ">=", self._saved_high)).order_by("saved_at")
+        elif self._high_water is not None:
+            query = query.where(filter=firestore.FieldFilter("datetime", ">=", self._high_water)).order_by("datetime")
+        else:
+            query = query.order_by("datetime")
+        for chunk in _chunks(query.stream()):
+            # แคชถูกตัดแล้ว: เอกสารที่เก่ากว่ารายการเก่าสุดในแคชอยู่นอกช่วงที่เก็บอยู่แล้ว ข้ามได้
+            oldest = self._records[0][1]["datetime"] if self.truncated and self._records else None
+            fresh = [(doc_id, d) for doc_id, d in chunk
+                     if doc_id not in self._ids and (oldest is None or d["datetime"] >= oldest)]
+            # เอกสารที่ datetime เก่ากว่ารายการล่าสุดต้องแทรกกลางแถว: โหลดใหม่ทั้งหมดแทน
+            if self._high_water is not None and any(d["datetime"] < self._high_water for _, d in fresh):
+                self._full_load()
+                return
+            fresh.sort(key=lambda pair: pair[1]["datetime"])
+            self._append(fresh)
+
+    def refresh(self):
+        with self._lock:
+            now = time.monotonic()
+            if not self._loaded_at or now - self._loaded_at > self.ttl_seconds:
+                self._full_load()
+            elif self._dirty or now - self._checked_at > self.refresh_seconds:
+                self._fetch_newer()
+            self._checked_at = now
+            self._dirty = False
+
+    def records(self, newest_first=False):
+        # คืนค่าเป็น list ของ dict (ห้ามแก้ไข dict ที่ได้ไปตรงๆ ให้ copy ก่อน)
+        self.refresh()
+        with self._lock:
+            data = [d for _, d, _ in self._records]
+        if newest_first:
+            data.reverse()
+        return data
+
+    def users(self):
+        # อีเมลทั้งหมดที่มีผลการทำนาย
+        self.refresh()
+        with self._lock:
+            return [u for u, entries in self._by_user.items() if u and entries]
+
+    def query(self, users=None, status=None):
+        # ค้นหาผ่าน index: คืนค่า list ของ (dict, status) เรียงจากใหม่ไปเก่า
+        self.refresh()
+        with self._lock:
+            if users is not None:
+                entries = [e for u in users for e in self._by_user.get(u, ())]
+                if status is not None:
+                    entries = [e for e in entries if e[2] == status]
+                entries.sort(key=lambda e: e[1]["datetime"], reverse=True)
+            elif status is not None:
+                entries = list(reversed(self._by_status.get(status, ())))
+            else:
+                entries = list(reversed(self._records))
+        return [(d, s) for _, d, s in entries]
+
+    def invalidate(self):
+        # เรียกหลังมีการเขียนผลใหม่ เพื่อให้การอ่านครั้งถัดไปดึงข้อมูลใหม่ทันที
+        self._dirty = True
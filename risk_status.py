@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+# ระดับความเสี่ยงที่ใช้แสดงผลและกรองข้อมูลในหน้าแอดมิน
+RISK_HIGH = "🔴 เสี่ยงสูง (น้ำตาลวิกฤต)"
+RISK_WATCH = "🟡 เฝ้าระวัง"
+RISK_NORMAL = "🟢 ปกติ"
+RISK_LEVELS = [RISK_HIGH, RISK_WATCH, RISK_NORMAL]
+
+# ค่าที่บันทึกลงฟิลด์ risk_level ของ results (ตามลำดับ RISK_LEVELS) ใช้กรองด้วย index ของ Firestore
+RISK_KEYS = ["high", "watch", "normal"]
+RISK_KEY_BY_LABEL = dict(zip(RISK_LEVELS, RISK_KEYS))
+
+# เก็บสถานะเป็น categorical (รหัส int8 ตามลำดับ RISK_LEVELS) แทนข้อความภาษาไทยทีละแถว
+RISK_DTYPE = pd.CategoricalDtype(RISK_LEVELS, ordered=True)
+HIGH_GLUCOSE = 126
+
+
+#ฟังก์ชันประเมินระดับความเสี่ยง
+def get_risk_status(glucose, prediction):
+    if prediction == "เสี่ยง" and glucose >= HIGH_GLUCOSE:
+        return RISK_HIGH
+    elif prediction == "เสี่ยง":
+        return RISK_WATCH
+    else:
+        return RISK_NORMAL
+
+
+# แบบ vectorized: คืนค่ารหัสระดับความเสี่ยง (index ใน RISK_LEVELS) ของทั้ง array ในครั้งเดียว
+# glucose ที่ไม่มีค่า (None/NaN) ถือว่าไม่ถึงเกณฑ์วิกฤต
+def risk_codes(glucose, prediction):
+    try:
+        glucose = np.asarray(glucose, dtype=float)
+    except (TypeError, ValueError):
+        # มีค่าที่ไม่ใช่ตัวเลขปนอยู่ ให้เป็น NaN เฉพาะแถวนั้น
+        glucose = pd.to_numeric(pd.Series(glucose, dtype=object), errors="coerce").to_numpy(dtype=float)
+    risky = np.asarray(prediction, dtype=object) == "เสี่ยง"
+    return np.select([risky & (glucose >= HIGH_GLUCOSE), risky], [0, 1], default=2).astype(np.int8)
+
+
+def add_status_column(rows, column="สถานะ"):
+    # เติมสถานะให้ list ของ dict ในครั้งเดียว (ใช้กับผลที่ดึงมาทีละหน้า)
+    if rows:
+        codes = risk_codes([r.get("glucose", 0) for r in rows], [r.get("result") for r in rows])
+        for row, code in zip(rows, codes):
+            row[column] = RISK_LEVELS[code]
+    return rows
+
+
+def risk_level(glucose, prediction):
+    # ค่า risk_level ("high" / "watch" / "normal") ของผลเดียว สำหรับบันทึกพร้อมผลการทำนาย
+    return RISK_KEYS[risk_codes([glucose], [prediction])[0]]
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# โมดูลของแอปอยู่ที่ราก repo (ไม่ได้เป็น package)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
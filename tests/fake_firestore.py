@@ -0,0 +1,167 @@
+from datetime import datetime
+
+from google.cloud.firestore_v1 import transforms
+
+# Firestore ในหน่วยความจำสำหรับการทดสอบ (เฉพาะส่วนที่โค้ดของแอปใช้)
+# - เอกสารเก็บใน dict {path: data} เช่น "results/abc", "bulk_uploads/x/batches/0000002-0000010"
+# - set(merge=True) รองรับ Increment / ArrayUnion / SERVER_TIMESTAMP แบบเดียวกับเซิร์ฟเวอร์
+# - query รองรับ where (==, >=, array_contains), order_by, limit, start_after, select, stream
+# - fail_commits: จำนวนครั้งที่ commit ถัดไปจะล้มเหลวด้วย error ที่กำหนด (ทดสอบการลองใหม่)
+# - reject_paths: batch ที่มีการเขียนเอกสารเหล่านี้ล้มเหลวด้วย ValueError ทุกครั้ง (งานที่เสีย)
+
+
+def _apply(old, data, merge):
+    out = dict(old or {}) if merge else {}
+    for key, value in data.items():
+        if value is transforms.SERVER_TIMESTAMP:
+            out[key] = datetime.now()
+        elif isinstance(value, transforms.Increment):
+            out[key] = out.get(key, 0) + value.value
+        elif isinstance(value, transforms.ArrayUnion):
+            current = list(out.get(key, []))
+            out[key] = current + [v for v in value.values if v not in current]
+        elif isinstance(value, transforms.ArrayRemove):
+            out[key] = [v for v in out.get(key, []) if v not in value.values]
+        else:
+            out[key] = value
+    return out
+
+
+class Snapshot:
+    def __init__(self, db, path, data):
+        self.reference = DocumentRef(db, path)
+        self.id = path.rsplit("/", 1)[-1]
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field)
+
+
+class DocumentRef:
+    def __init__(self, db, path):
+        self.db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return Query(self.db, f"{self.path}/{name}")
+
+    def get(self, transaction=None):
+        return Snapshot(self.db, self.path, self.db.store.get(self.path))
+
+    def set(self, data, merge=False):
+        self.db.store[self.path] = _apply(self.db.store.get(self.path), data, merge)
+
+    def update(self, data):
+        self.set(data, merge=True)
+
+    def delete(self):
+        self.db.store.pop(self.path, None)
+
+
+class Query:
+    def __init__(self, db, path, filters=(), order=(), n=None, after=None):
+        self.db, self.path, self.filters, self.order, self.n, self.after = db, path, filters, order, n, after
+
+    def _copy(self, **changes):
+        args = dict(db=self.db, path=self.path, filters=self.filters, order=self.order, n=self.n, after=self.after)
+        args.update(changes)
+        return Query(**args)
+
+    def document(self, doc_id):
+        return DocumentRef(self.db, f"{self.path}/{doc_id}")
+
+    def where(self, field=None, op=None, value=None, filter=None):
+        if filter is not None:
+            field, op, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self.filters + ((field, op, value),))
+
+    def order_by(self, field, direction="ASCENDING"):
+        return self._copy(order=self.order + ((field, direction == "DESCENDING"),))
+
+    def limit(self, n):
+        return self._copy(n=n)
+
+    def start_after(self, snapshot):
+        return self._copy(after=snapshot.id)
+
+    def select(self, fields):
+        return self
+
+    def stream(self, transaction=None):
+        prefix = self.path + "/"
+        rows = [(p[len(prefix):], d) for p, d in self.db.store.items()
+                if p.startswith(prefix) and "/" not in p[len(prefix):]]
+        for field, op, value in self.filters:
+            if op == "==":
+                rows = [r for r in rows if r[1].get(field) == value]
+            elif op == ">=":
+                rows = [r for r in rows if field in r[1] and r[1][field] >= value]
+            elif op == "array_contains":
+                rows = [r for r in rows if value in r[1].get(field, [])]
+        for field, desc in reversed(self.order):
+            rows = [r for r in rows if field in r[1]]
+            rows.sort(key=lambda r: (r[1][field], r[0]), reverse=desc)
+        if self.after is not None:
+            ids = [r[0] for r in rows]
+            rows = rows[ids.index(self.after) + 1:]
+        if self.n is not None:
+            rows = rows[:self.n]
+        return iter([Snapshot(self.db, prefix + doc_id, d) for doc_id, d in rows])
+
+
+class Batch:
+    def __init__(self, db):
+        self.db = db
+        self.writes = []
+
+    def set(self, ref, data, merge=False):
+        self.writes.append((ref.path, data, merge))
+
+    def update(self, ref, data):
+        self.writes.append((ref.path, data, True))
+
+    def delete(self, ref):
+        self.writes.append((ref.path, None, False))
+
+    def commit(self):
+        self.db.commits += 1
+        if self.db.fail_commits:
+            self.db.fail_commits -= 1
+            raise self.db.fail_error
+        rejected = [path for path, _, _ in self.writes if path in self.db.reject_paths]
+        if rejected:
+            raise ValueError(f"rejected write: {rejected[0]}")
+        for path, data, merge in self.writes:
+            if data is None:
+                self.db.store.pop(path, None)
+            else:
+                self.db.store[path] = _apply(self.db.store.get(path), data, merge)
+
+
+class FakeFirestore:
+    def __init__(self):
+        self.store = {}
+        self.commits = 0
+        self.fail_commits = 0
+        self.fail_error = None
+        self.reject_paths = set()
+
+    def collection(self, name):
+        return Query(self, name)
+
+    def document(self, path):
+        return DocumentRef(self, path)
+
+    def batch(self):
+        return Batch(self)
+
+    def docs(self, collection):
+        # {doc_id: data} ของเอกสารใน collection (ไม่รวม subcollection)
+        prefix = collection + "/"
+        return {p[len(prefix):]: d for p, d in self.store.items()
+                if p.startswith(prefix) and "/" not in p[len(prefix):]}
@@ -0,0 +1,156 @@
+import io
+
+import numpy as np
+import pytest
+from google.api_core.exceptions import ServiceUnavailable
+from openpyxl import Workbook
+
+import bulk_screening
+from fake_firestore import FakeFirestore
+from prediction_service import PredictionService
+
+ROWS = [
+    # weight, height_cm, age, glucose, blood_pressure, pregnancies, insulin, family_history, q_*, email, name, screened_at
+    [65, 165, 45, 110, 80, 0, 0, 1, 1, 0, 0, 1, "a@example.com", "สมชาย ใจดี", "2025-01-31"],
+    [70, 170, 50, 150, 85, 1, 0, 0, 0, 0, 0, 0, "b@example.com", "Jane Doe", "31/01/2025"],
+    [80, 160, 60, 180, 90, 2, 0, 2, 0, 0, 0, 0, "a@example.com", "สมชาย ใจดี", ""],
+    [0, 160, 60, 180, 90, 2, 0, 2, 0, 0, 0, 0, "c@example.com", "Bad Row", ""],   # weight ต้องมากกว่า 0
+    [55, 150, 30, 95, 70, 0, 0, 0, 0, 0, 0, 0, "", "", "2025-02-01"],
+]
+
+
+class GlucoseModel:
+    # โมเดลจำลอง: เสี่ยงเมื่อ Glucose > 140
+    classes_ = np.array([0, 1])
+
+    def predict_proba(self, X):
+        risky = (np.asarray(X)[:, 1] > 140).astype(float)
+        return np.column_stack([1 - risky, risky])
+
+
+def _csv(rows=ROWS):
+    out = io.StringIO()
+    out.write(",".join(bulk_screening.TEMPLATE_COLUMNS) + "\n")
+    for row in rows:
+        out.write(",".join(str(v) for v in row) + "\n")
+    return out.getvalue().encode("utf-8-sig")
+
+
+def _xlsx(rows=ROWS):
+    wb = Workbook()
+    ws = wb.active
+    ws.append(bulk_screening.TEMPLATE_COLUMNS)
+    for row in rows:
+        ws.append(row)
+    ws.append([None] * len(bulk_screening.TEMPLATE_COLUMNS))   # แถวว่างท้ายชีต
+    out = io.BytesIO()
+    wb.save(out)
+    return out.getvalue()
+
+
+FILES = {"csv": ("clinic.csv", _csv), "xlsx": ("clinic.xlsx", _xlsx)}
+
+
+@pytest.fixture
+def db():
+    return FakeFirestore()
+
+
+@pytest.fixture
+def predictor():
+    return PredictionService(GlucoseModel(), version="v0001")
+
+
+def _run(db, predictor, fmt, chunk_size=2, **kwargs):
+    filename, build = FILES[fmt]
+    return bulk_screening.run(db, predictor, io.BytesIO(build()), filename, uploaded_by="admin@example.com",
+                              chunk_size=chunk_size, **kwargs)
+
+
+@pytest.mark.parametrize("fmt", FILES)
+def test_import_writes_results_and_rollups(db, predictor, fmt):
+    summary = _run(db, predictor, fmt)
+    assert summary["error"] is None
+    assert (summary["rows"], summary["written"], summary["invalid"], summary["skipped"]) == (5, 4, 1, 0)
+    assert summary["errors"] == [(5, "weight ต้องเป็นตัวเลขมากกว่า 0")]
+
+    results = db.docs("results")
+    assert len(results) == 4
+    assert {r["model_version"] for r in results.values()} == {"v0001"}
+    # แถว 2 เสี่ยงจากพฤติกรรม 2 ข้อ แถว 3-4 จากโมเดล
+    assert {doc_id[-7:]: r["result"] for doc_id, r in results.items()} == {
+        "0000002": "เสี่ยง", "0000003": "เสี่ยง", "0000004": "เสี่ยง", "0000006": "ไม่เสี่ยง"}
+    assert db.store["user_stats/a@example.com"]["count"] == 2
+    assert sum(d["count"] for d in db.docs("daily_stats").values()) == 4
+    assert db.store[f"bulk_uploads/{summary['upload_id']}"]["status"] == "done"
+
+
+@pytest.mark.parametrize("fmt", FILES)
+def test_reupload_is_idempotent(db, predictor, fmt):
+    first = _run(db, predictor, fmt)
+    snapshot = {path: dict(data) for path, data in db.store.items() if not path.startswith("bulk_uploads/")}
+    second = _run(db, predictor, fmt)
+    assert second["upload_id"] == first["upload_id"]
+    assert (second["written"], second["skipped"]) == (0, 4)
+    assert {path: data for path, data in db.store.items() if not path.startswith("bulk_uploads/")} == snapshot
+
+
+@pytest.mark.parametrize("fmt", FILES)
+def test_resume_after_failure_does_not_double_count(db, predictor, fmt):
+    db.fail_commits, db.fail_error = 0, ServiceUnavailable("down")
+    original = db.batch
+
+    # batch แรกของผลสำเร็จ batch ที่สองล้มเหลว
+    def failing_batch():
+        batch = original()
+        if db.commits == 1:
+            db.fail_commits = 1
+        return batch
+    db.batch = failing_batch
+    failed = _run(db, predictor, fmt)
+    assert failed["error"].startswith("บันทึกลง Firestore ไม่สำเร็จ")
+    assert failed["written"] == 2 and failed["last_row"] == 3
+
+    db.batch = original
+    resumed = _run(db, predictor, fmt)
+    assert (resumed["written"], resumed["skipped"]) == (2, 2)
+    assert db.store["user_stats/a@example.com"]["count"] == 2
+    assert sum(d["count"] for d in db.docs("daily_stats").values()) == 4
+
+
+def test_dry_run_writes_nothing(db, predictor):
+    summary = _run(db, predictor, "csv", dry_run=True)
+    assert summary["rows"] == 5 and summary["risky"] == 3
+    assert db.store == {}
+
+
+@pytest.mark.parametrize("content, filename, message", [
+    (b"a,b\n1,2\n", "x.csv", "ไฟล์ไม่มีคอลัมน์ที่จำเป็น"),
+    (b"weight\n\xff\xfe\x00", "x.csv", "อ่านไฟล์ไม่ได้"),
+    (b"not a zip", "x.xlsx", "ไฟล์ XLSX เสีย"),
+])
+def test_bad_file_is_reported(db, predictor, content, filename, message):
+    summary = bulk_screening.run(db, predictor, io.BytesIO(content), filename)
+    assert summary["error"].startswith(message)
+
+
+def test_unexpected_value_error_propagates(db):
+    class Broken(PredictionService):
+        def predict_with_version(self, X):
+            raise ValueError("bug")
+
+    with pytest.raises(ValueError, match="bug"):
+        _run(db, Broken(GlucoseModel()), "csv")
+
+
+def test_version_comes_from_the_scoring_call(db):
+    # โมเดลสลับรุ่นทุกครั้งหลังทำนายเสร็จ: แต่ละก้อนยังระบุรุ่นที่ทำนายก้อนนั้นจริง
+    class Swapping(PredictionService):
+        def predict_with_version(self, X):
+            out = super().predict_with_version(X)
+            self.version = f"v{int(self.version[1:]) + 1:04d}"
+            return out
+
+    _run(db, Swapping(GlucoseModel(), version="v0001"), "csv")
+    by_row = {doc_id[-7:]: r["model_version"] for doc_id, r in db.docs("results").items()}
+    assert by_row == {"0000002": "v0001", "0000003": "v0001", "0000004": "v0002", "0000006": "v0003"}
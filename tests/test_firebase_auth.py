@@ -0,0 +1,100 @@
+import os
+
+import pytest
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+# ใช้ปลายทางของ emulator (ไม่ต้องมี st.secrets) ก่อน import firebase_auth
+os.environ.setdefault("FIREBASE_AUTH_EMULATOR_HOST", "127.0.0.1:9099")
+
+import firebase_auth  # noqa: E402
+
+
+class Response:
+    def __init__(self, status, body=None):
+        self.status_code = status
+        self.ok = status < 400
+        self._body = body if body is not None else {"status": status}
+
+    def json(self):
+        return self._body
+
+
+def _refused():
+    reason = NewConnectionError(None, "Connection refused")
+    return requests.ConnectionError(MaxRetryError(None, "/", reason))
+
+
+@pytest.fixture
+def post(monkeypatch):
+    # แทน _session.post ด้วยลำดับผลที่กำหนด (Response หรือ exception) และนับจำนวนครั้งที่เรียก
+    calls = []
+
+    def install(*outcomes):
+        outcomes = list(outcomes)
+
+        def fake_post(url, json=None, timeout=None):
+            calls.append(url)
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        monkeypatch.setattr(firebase_auth._session, "post", fake_post)
+        return calls
+
+    monkeypatch.setattr(firebase_auth.time, "sleep", lambda seconds: None)
+    return install
+
+
+def test_not_sent_classification():
+    assert firebase_auth._not_sent(requests.ConnectTimeout())
+    assert firebase_auth._not_sent(_refused())
+    assert not firebase_auth._not_sent(requests.ReadTimeout())
+    assert not firebase_auth._not_sent(requests.ConnectionError("Connection reset by peer"))
+
+
+@pytest.mark.parametrize("idempotent", [True, False])
+def test_retries_429_and_5xx(post, idempotent):
+    calls = post(Response(503), Response(429), Response(200, {"idToken": "t"}))
+    assert firebase_auth._post("signUp", {}, idempotent=idempotent) == {"idToken": "t"}
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("idempotent", [True, False])
+def test_retries_connection_failures_before_send(post, idempotent):
+    calls = post(requests.ConnectTimeout(), _refused(), Response(200, {"idToken": "t"}))
+    assert firebase_auth._post("signUp", {}, idempotent=idempotent) == {"idToken": "t"}
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("error", [requests.ReadTimeout(), requests.ConnectionError("Connection reset by peer")])
+def test_signup_is_not_retried_after_send(post, error):
+    calls = post(error, Response(200, {"idToken": "t"}))
+    result = firebase_auth.firebase_register("a@example.com", "secret")
+    assert len(calls) == 1
+    assert "error" in result
+
+
+def test_login_retries_read_timeout(post):
+    calls = post(requests.ReadTimeout(), Response(200, {"idToken": "t"}))
+    assert firebase_auth.firebase_login("a@example.com", "secret") == {"idToken": "t"}
+    assert len(calls) == 2
+
+
+def test_gives_up_after_max_retries(post):
+    calls = post(*[Response(503)] * (firebase_auth.MAX_RETRIES + 1))
+    assert firebase_auth._post("signInWithPassword", {}) == {"status": 503}
+    assert len(calls) == firebase_auth.MAX_RETRIES + 1
+
+    post(*[requests.ConnectTimeout()] * (firebase_auth.MAX_RETRIES + 1))
+    assert "ConnectTimeout" in firebase_auth._post("signInWithPassword", {})["error"]["message"]
+
+
+def test_non_json_response(post):
+    class Html(Response):
+        def json(self):
+            raise ValueError("not json")
+
+    post(Html(502), Html(502), Html(502), Html(502))
+    assert "HTTP 502" in firebase_auth._post("token", {})["error"]["message"]
@@ -0,0 +1,136 @@
+import json
+import os
+from datetime import datetime
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore as gcf
+from google.cloud.firestore_v1.base_query import BaseQuery
+from google.cloud.firestore_v1.query import Query
+
+import dashboard_stats
+import results_pager
+import user_stats
+from results_store import ResultStore
+from conftest import ROOT
+
+# ทุก query ที่แอปส่งไป Firestore ต้องมี index รองรับ (emulator ไม่บังคับ composite index จึงตรวจจากไฟล์)
+# สร้าง query ด้วยโค้ดจริงผ่าน client ที่ไม่ต่อเครือข่าย แล้วอ่านรูปแบบจาก protobuf ของ query
+RANGE_OPS = {"LESS_THAN", "LESS_THAN_OR_EQUAL", "GREATER_THAN", "GREATER_THAN_OR_EQUAL", "NOT_EQUAL", "NOT_IN"}
+ARRAY_OPS = {"ARRAY_CONTAINS", "ARRAY_CONTAINS_ANY"}
+
+# ตัวกรองที่หน้าแอดมินและการส่งออกใช้กับ results_pager.fetch_page
+PAGER_FILTERS = [
+    {},
+    {"risk_level": "high"},
+    {"token": "jo"},
+    {"risk_level": "watch", "token": "jo"},
+    {"user": "a@example.com"},
+]
+
+
+@pytest.fixture
+def db():
+    return gcf.Client(project="demo-diabetes-checker", credentials=AnonymousCredentials())
+
+
+@pytest.fixture
+def streamed(monkeypatch):
+    # เก็บ query ที่ถูก stream() แทนการส่งไปเซิร์ฟเวอร์
+    queries = []
+
+    def stream(self, *args, **kwargs):
+        queries.append(self)
+        return iter([])
+
+    monkeypatch.setattr(Query, "stream", stream)
+    return queries
+
+
+def _filters(where):
+    if "composite_filter" in where:
+        for f in where.composite_filter.filters:
+            yield from _filters(f)
+    elif "field_filter" in where:
+        f = where.field_filter
+        yield f.field.field_path, f.op.name
+
+
+def required_index(query):
+    # คืนค่า (collection, ฟิลด์ ==, ฟิลด์ array_contains, [(ฟิลด์เรียง, ทิศทาง)]) หรือ None ถ้าใช้ single-field index ได้
+    pb = query._to_protobuf()
+    filters = list(_filters(pb.where)) if "where" in pb else []
+    eq = {field for field, op in filters if op not in RANGE_OPS | ARRAY_OPS}
+    arr = {field for field, op in filters if op in ARRAY_OPS}
+    orders = [(o.field.field_path, o.direction.name) for o in pb.order_by]
+    for field, op in filters:
+        if op in RANGE_OPS and field not in [f for f, _ in orders]:
+            orders.insert(0, (field, "ASCENDING"))
+    # ตัวกรอง == / array_contains อย่างเดียว Firestore รวม single-field index ได้เอง
+    if not orders or len(eq | arr | {f for f, _ in orders}) == 1:
+        return None
+    return pb.from_[0].collection_id, eq, arr, orders
+
+
+def _defined_indexes():
+    with open(os.path.join(ROOT, "firestore.indexes.json"), encoding="utf-8") as f:
+        return json.load(f)["indexes"]
+
+
+def has_index(required):
+    collection, eq, arr, orders = required
+    for ix in _defined_indexes():
+        fields = ix["fields"]
+        if ix["collectionGroup"] != collection or len(fields) != len(eq) + len(arr) + len(orders):
+            continue
+        tail = [(f["fieldPath"], f.get("order")) for f in fields[len(fields) - len(orders):]]
+        head = fields[:len(fields) - len(orders)]
+        if (tail == orders
+                and {f["fieldPath"] for f in head if f.get("arrayConfig") == "CONTAINS"} == arr
+                and {f["fieldPath"] for f in head if f.get("order")} == eq):
+            return True
+    return False
+
+
+@pytest.mark.parametrize("filters", PAGER_FILTERS, ids=lambda f: "+".join(f) or "all")
+def test_fetch_page_has_index(db, streamed, filters):
+    results_pager.fetch_page(db, 50, **filters)
+    required = required_index(streamed[-1])
+    assert required is None or has_index(required), f"ไม่มี composite index สำหรับ {required}"
+
+
+def test_user_history_has_index(db):
+    required = required_index(user_stats.results_query(db, "a@example.com"))
+    assert required == ("results", {"user"}, set(), [("datetime", "ASCENDING")])
+    assert has_index(required)
+
+
+def test_daily_rollup_scan_uses_single_field_index(db, streamed):
+    dashboard_stats.rebuild_daily(db)
+    assert streamed
+    assert all(required_index(q) is None for q in streamed)
+
+
+def test_result_store_uses_single_field_indexes(db, streamed):
+    store = ResultStore(db)
+    store._full_load()
+    store._saved_high = datetime(2025, 1, 1)
+    store._fetch_newer()
+    store._saved_high, store._high_water = None, datetime(2025, 1, 1)
+    store._fetch_newer()
+    assert len(streamed) == 4
+    assert all(required_index(q) is None for q in streamed)
+
+
+def test_required_index_detects_missing(db):
+    query = results_pager.filtered_query(db, risk_level="high", user="a@example.com").order_by(
+        "datetime", direction=BaseQuery.DESCENDING)
+    required = required_index(query)
+    assert required == ("results", {"risk_level", "user"}, set(), [("datetime", "DESCENDING")])
+    assert not has_index(required)
+
+
+def test_range_on_other_field_needs_index(db):
+    query = db.collection("results").where(
+        filter=gcf.FieldFilter("saved_at", ">=", datetime(2025, 1, 1))).order_by("datetime")
+    assert required_index(query) == ("results", set(), set(), [("saved_at", "ASCENDING"), ("datetime", "ASCENDING")])
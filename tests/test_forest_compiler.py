@@ -0,0 +1,58 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from forest_compiler import ARTIFACT_VERSION, CompiledForest
+from prediction_service import FEATURES
+
+LOW = [0, 40, 30, 0, 0, 15, 0.05, 18]
+HIGH = [15, 200, 120, 60, 500, 55, 2.5, 85]
+
+
+def _data(n, seed, nan_rate=0.0):
+    rng = np.random.default_rng(seed)
+    X = np.round(rng.uniform(LOW, HIGH, size=(n, len(FEATURES))), 1)
+    y = ((X[:, 1] > 130) ^ (rng.random(n) < 0.1)).astype(int)
+    if nan_rate:
+        X[rng.random(X.shape) < nan_rate] = np.nan
+    return pd.DataFrame(X, columns=FEATURES), y
+
+
+@pytest.fixture(scope="module", params=[0.0, 0.1], ids=["fit-complete", "fit-with-nan"])
+def model(request):
+    X, y = _data(400, 0, request.param)
+    return RandomForestClassifier(n_estimators=25, max_depth=12, random_state=0).fit(X, y)
+
+
+@pytest.mark.parametrize("nan_rate", [0.0, 0.05, 1.0], ids=["complete", "some-nan", "all-nan"])
+def test_predict_proba_matches_sklearn(model, nan_rate):
+    X, _ = _data(500, 1, nan_rate)
+    compiled = CompiledForest.from_estimator(model)
+    assert np.array_equal(compiled.predict_proba(X.to_numpy()), model.predict_proba(X))
+    assert np.array_equal(compiled.predict(X.to_numpy()), model.predict(X))
+
+
+def test_single_row(model):
+    X, _ = _data(1, 2)
+    compiled = CompiledForest.from_estimator(model)
+    assert np.array_equal(compiled.predict_proba(X.to_numpy()[0]), model.predict_proba(X))
+
+
+def test_artifact_roundtrip(model, tmp_path):
+    X, _ = _data(200, 3, 0.05)
+    CompiledForest.from_estimator(model).save_artifact(tmp_path / "artifact", FEATURES)
+    loaded = CompiledForest.load_artifact(tmp_path / "artifact")
+    assert loaded.manifest["format_version"] == ARTIFACT_VERSION
+    assert np.array_equal(loaded.predict_proba(X.to_numpy()), model.predict_proba(X))
+
+
+def test_old_artifact_is_rejected(model, tmp_path):
+    CompiledForest.from_estimator(model).save_artifact(tmp_path, FEATURES)
+    manifest = json.loads((tmp_path / "manifest.json").read_text(encoding="utf-8"))
+    manifest["format_version"] = ARTIFACT_VERSION - 1
+    (tmp_path / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+    with pytest.raises(ValueError):
+        CompiledForest.load_artifact(tmp_path)
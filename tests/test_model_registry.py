@@ -0,0 +1,98 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+
+from forest_compiler import ARTIFACT_VERSION, CompiledForest
+from model_registry import ARTIFACT_DIR, CURRENT, ModelReloader, ModelRegistry
+from prediction_service import FEATURES, PredictionService
+
+
+def _fit(estimator, seed=0):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.uniform([0, 40, 30, 0, 0, 15, 0.05, 18], [15, 200, 120, 60, 500, 55, 2.5, 85],
+                                 size=(200, len(FEATURES))), columns=FEATURES)
+    return estimator.fit(X, (X["Glucose"] > 130).astype(int))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return ModelRegistry(str(tmp_path / "models"))
+
+
+@pytest.fixture
+def two_versions(registry):
+    first = registry.register(_fit(RandomForestClassifier(n_estimators=5, random_state=0)), promote=True)
+    second = registry.register(_fit(LogisticRegression(max_iter=1000)))
+    return first["version"], second["version"]
+
+
+def _fallback():
+    return PredictionService(_fit(LogisticRegression(max_iter=1000), seed=1), version="file")
+
+
+def test_register_without_promote_keeps_current(registry, two_versions):
+    first, second = two_versions
+    assert registry.versions() == [first, second] == ["v0001", "v0002"]
+    assert registry.current() == first
+    assert registry.manifest(first)["artifact"] == ARTIFACT_DIR
+    assert registry.manifest(second)["artifact"] is None
+
+
+def test_promote_and_rollback(registry, two_versions):
+    first, second = two_versions
+    registry.promote(second)
+    assert registry.current() == second
+    assert registry.rollback() == first
+    assert registry.current() == first
+    with pytest.raises(ValueError):
+        registry.rollback()
+
+
+def test_promote_unknown_version(registry, two_versions):
+    with pytest.raises(ValueError):
+        registry.promote("v0099")
+    assert registry.current() == two_versions[0]
+
+
+def test_reloader_swaps_on_promote_and_rollback(registry, two_versions):
+    first, second = two_versions
+    reloader = ModelReloader(registry, _fallback, interval=0)
+    assert reloader.version == first
+    assert isinstance(reloader.service.model, CompiledForest)
+    assert not reloader.reload()
+
+    registry.promote(second)
+    assert reloader.reload()
+    assert reloader.version == second
+    labels, _, version = reloader.predict_with_version(np.zeros((3, len(FEATURES))))
+    assert version == second and len(labels) == 3
+
+    registry.rollback()
+    assert reloader.reload()
+    assert reloader.version == first
+    assert reloader.swaps == 2
+
+
+def test_reloader_falls_back_to_file_model_on_broken_current(registry, two_versions):
+    with open(os.path.join(registry.root, CURRENT), "w", encoding="utf-8") as f:
+        f.write("v0042\n")
+    reloader = ModelReloader(registry, _fallback, interval=0)
+    assert reloader.version == "file"
+    assert reloader.last_error.startswith("v0042")
+
+
+def test_load_recompiles_older_artifact(registry, two_versions):
+    first = two_versions[0]
+    path = os.path.join(registry.path(first), ARTIFACT_DIR, "manifest.json")
+    with open(path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    manifest["format_version"] = ARTIFACT_VERSION - 1
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    model, _ = registry.load(first)
+    assert isinstance(model, CompiledForest)
@@ -0,0 +1,149 @@
+from datetime import datetime
+
+import pytest
+from firebase_admin import firestore
+from google.api_core.exceptions import ServiceUnavailable
+
+from fake_firestore import FakeFirestore
+from write_behind import WriteBehindQueue
+
+# worker เบื้องหลังรอ flush_ms นานมาก การทดสอบจึงเรียก flush() เองได้โดยไม่แข่งกับ worker
+IDLE_MS = 3_600_000
+
+
+@pytest.fixture
+def db():
+    return FakeFirestore()
+
+
+@pytest.fixture
+def make_queue(db, tmp_path):
+    def make(**kwargs):
+        options = dict(spool_path=str(tmp_path / "spool.sqlite3"), flush_ms=IDLE_MS, max_backoff=0, max_attempts=3)
+        options.update(kwargs)
+        return WriteBehindQueue(db, **options)
+    return make
+
+
+def _write(doc_id, **data):
+    return [(f"results/{doc_id}", dict(data or {"n": 1}), False)]
+
+
+def _drain(queue):
+    while queue.flush():
+        pass
+
+
+def test_enqueue_spools_until_flush(db, make_queue):
+    queue = make_queue()
+    job = queue.enqueue(_write("a"))
+    assert isinstance(job, int)
+    assert queue.pending() == 1 and db.store == {}
+    _drain(queue)
+    assert queue.pending() == 0 and queue.flushed == 1
+    assert db.store["results/a"] == {"n": 1}
+
+
+def test_transforms_survive_the_spool(db, make_queue):
+    queue = make_queue()
+    queue.enqueue([("results/a", {"saved_at": firestore.SERVER_TIMESTAMP}, False),
+                   ("user_stats/u", {"count": firestore.Increment(2), "entries": firestore.ArrayUnion([{"id": "a"}])},
+                    True)])
+    _drain(queue)
+    assert isinstance(db.store["results/a"]["saved_at"], datetime)
+    assert db.store["user_stats/u"] == {"count": 2, "entries": [{"id": "a"}]}
+
+
+def test_transient_error_is_retried(db, make_queue):
+    queue = make_queue()
+    queue.enqueue(_write("a"))
+    db.fail_commits, db.fail_error = 1, ServiceUnavailable("down")
+    with pytest.raises(ServiceUnavailable):
+        queue.flush()
+    assert queue.pending() == 1 and queue.dead_letters() == 0
+    _drain(queue)
+    assert "results/a" in db.store and queue.pending() == 0
+
+
+def test_spool_survives_restart(db, make_queue):
+    make_queue().enqueue(_write("a"))
+    queue = make_queue()
+    _drain(queue)
+    assert "results/a" in db.store
+
+
+def test_poison_job_is_isolated_and_dead_lettered(db, make_queue):
+    queue = make_queue()
+    for doc_id in ["a", "poison", "b"]:
+        queue.enqueue(_write(doc_id))
+    db.reject_paths.add("results/poison")
+    _drain(queue)
+    assert {"results/a", "results/b"} <= set(db.store)
+    assert queue.dead_letters() == 1 and queue.pending() == 0
+    assert queue.failures == 3 and "poison" in queue.last_error
+
+
+def test_requeue_dead(db, make_queue):
+    queue = make_queue()
+    queue.enqueue(_write("poison"))
+    db.reject_paths.add("results/poison")
+    _drain(queue)
+    assert queue.dead_letters() == 1
+    db.reject_paths.clear()
+    assert queue.requeue_dead() == 1
+    _drain(queue)
+    assert "results/poison" in db.store and queue.dead_letters() == 0
+
+
+def test_child_waits_for_parent(db, make_queue):
+    queue = make_queue()
+    parent = queue.enqueue(_write("a"))
+    queue.enqueue([("results/a", {"shadow": {"prediction": 1}}, True)], after=parent)
+    db.fail_commits, db.fail_error = 1, ServiceUnavailable("down")
+    with pytest.raises(ServiceUnavailable):
+        queue.flush()
+    # มีแต่งานแม่ที่ถูกจอง งานลูกยังไม่ถูกเขียนแยก
+    assert db.commits == 1 and db.store == {}
+    _drain(queue)
+    assert db.store["results/a"] == {"n": 1, "shadow": {"prediction": 1}}
+
+
+def test_child_follows_dead_parent(db, make_queue):
+    queue = make_queue()
+    parent = queue.enqueue(_write("a"))
+    db.reject_paths.add("results/a")
+    _drain(queue)
+    assert queue.dead_letters() == 1
+    # ผล shadow เสร็จหลังงานหลักไปอยู่ dead_letter แล้ว: ไม่ถูกเขียนเป็นเอกสารที่มีแต่ฟิลด์ shadow
+    queue.enqueue([("results/a", {"shadow": {"prediction": 1}}, True)], after=parent)
+    _drain(queue)
+    assert db.store == {} and queue.pending() == 1
+
+    db.reject_paths.clear()
+    queue.requeue_dead()
+    _drain(queue)
+    assert db.store["results/a"] == {"n": 1, "shadow": {"prediction": 1}}
+
+
+def test_children_are_dead_lettered_with_parent(db, make_queue):
+    queue = make_queue()
+    parent = queue.enqueue(_write("a"))
+    queue.enqueue([("results/a", {"shadow": {}}, True)], after=parent)
+    db.reject_paths.add("results/a")
+    _drain(queue)
+    assert queue.dead_letters() == 2 and queue.pending() == 0
+    db.reject_paths.clear()
+    assert queue.requeue_dead() == 2
+    _drain(queue)
+    assert db.store["results/a"] == {"n": 1, "shadow": {}}
+
+
+def test_full_spool_writes_synchronously_but_keeps_children_ordered(db, make_queue):
+    queue = make_queue(max_pending=1)
+    parent = queue.enqueue(_write("a"))
+    assert queue.enqueue(_write("b")) is None
+    assert "results/b" in db.store and "results/a" not in db.store
+    queue.enqueue([("results/a", {"shadow": {}}, True)], after=parent)
+    assert "results/a" not in db.store and queue.pending() == 2
+    _drain(queue)
+    assert db.store["results/a"] == {"n": 1, "shadow": {}}
@@ -1,14 +1,11 @@
-import pandas as pd
+from dataset import load_frame, read_manifest
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.metrics import classification_report
-import joblib
+from sklearn.metrics import classification_report, accuracy_score
+from model_registry import ModelRegistry, data_fingerprint
 
 # โหลดข้อมูล
-url = "https://raw.githubusercontent.com/jbrownlee/Datasets/master/pima-indians-diabetes.data.csv"
-columns = ['Pregnancies', 'Glucose', 'BloodPressure', 'SkinThickness',
-           'Insulin', 'BMI', 'DiabetesPedigreeFunction', 'Age', 'Outcome']
-df = pd.read_csv(url, names=columns)
+df = load_frame()  # จาก cache ในเครื่อง (ดู dataset.py)
 
 # แยก features กับ label
 X = df.drop("Outcome", axis=1)
@@ -18,13 +15,16 @@ y = df["Outcome"]
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
 # สร้างโมเดล
-model = RandomForestClassifier()
+model = RandomForestClassifier(random_state=42)  # ค่าคงที่ เพื่อให้เทรนซ้ำได้โมเดลเดิม
 model.fit(X_train, y_train)
 
 # ประเมินผล
 y_pred = model.predict(X_test)
 print(classification_report(y_test, y_pred))
 
-# บันทึกโมเดล
-joblib.dump(model, "diabetes_model.pkl")
-print("✅ บันทึกโมเดลเป็นไฟล์ 'diabetes_model.pkl' สำเร็จแล้ว")
+# บันทึกโมเดลเป็นรุ่นใหม่ใน registry (ยังไม่ให้แอปใช้ จนกว่าจะ promote)
+manifest = ModelRegistry().register(
+    model, params=model.get_params(), metrics={"test_accuracy": accuracy_score(y_test, y_pred)},
+    data=data_fingerprint(read_manifest()), source="train_model.py",
+)
+print(f"✅ บันทึกโมเดลรุ่น {manifest['version']} สำเร็จแล้ว (python model_registry.py promote {manifest['version']} เพื่อใช้งาน)")
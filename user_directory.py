@@ -0,0 +1,167 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+
+import firestore_reads
+
+NO_PROFILE_NAME = "ผู้ใช้ใหม่ (ไม่มีข้อมูลโปรไฟล์)"
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _search_text(user):
+    # ข้อความที่ใช้ค้นหา: อีเมล ชื่อ และนามสกุล (ตัวพิมพ์เล็ก)
+    return " ".join(filter(None, [user["email"], user.get("name"), user.get("lastname")])).lower()
+
+
+def _tokens(text):
+    # คำที่ใช้ค้นหาแบบขึ้นต้นด้วย (prefix): แต่ละคำ และส่วนหน้า @ ของอีเมล
+    words = set(text.split())
+    words.update(w.split("@", 1)[0] for w in list(words) if "@" in w)
+    return words
+
+
+def search_tokens(email, name="", lastname="", min_prefix=2, max_prefix=12):
+    # token ตัวพิมพ์เล็กสำหรับค้นหาด้วย array_contains ของ Firestore (บันทึกไว้ในแต่ละผล)
+    # เก็บ prefix ทุกความยาวตั้งแต่ min_prefix ถึง max_prefix ตัวอักษร และคำเต็ม
+    tokens = set()
+    for word in _tokens(_search_text({"email": email or "", "name": name, "lastname": lastname})):
+        tokens.add(word)
+        tokens.update(word[:n] for n in range(min_prefix, min(len(word), max_prefix) + 1))
+    return sorted(tokens)
+
+
+# สมุดรายชื่อผู้ใช้สำหรับหน้าแอดมิน แชร์กันทั้ง process
+# - รวมผู้ใช้จาก collection users กับอีเมลที่มีผลการทำนาย (ผู้ใช้ที่ไม่มีโปรไฟล์)
+# - index หลักเป็น dict ตามอีเมล
+# - ค้นหาแบบพิมพ์ไปค้นไป: คำค้นสั้นกว่า 3 ตัวอักษรใช้ prefix ของคำ (list เรียงลำดับ + bisect)
+#   คำค้นตั้งแต่ 3 ตัวอักษรใช้ trigram index หาผู้ที่มีคำค้นเป็นส่วนหนึ่งของชื่อ/อีเมล
+# - การแก้ไขจากหน้าแอดมิน (เปลี่ยนสิทธิ์/ลบ/สมัครใหม่) อัปเดต index ทันทีผ่าน upsert()/remove()
+# - โหลดใหม่ทั้งหมดเมื่อครบ TTL เพื่อเก็บการแก้ไขจาก process อื่น
+class UserDirectory:
+    def __init__(self, db, extra_emails=None, ttl_seconds=300):
+        self.db = db
+        self.extra_emails = extra_emails
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = 0.0
+        self._reset()
+
+    def _reset(self):
+        self._by_email = {}
+        self._text = {}
+        self._trigram_index = defaultdict(set)
+        self._token_index = defaultdict(set)
+        self._sorted_tokens = []
+
+    def _index(self, user, keep_sorted=True):
+        email = user["email"]
+        text = _search_text(user)
+        self._text[email] = text
+        self._by_email[email] = user
+        for gram in _trigrams(text):
+            self._trigram_index[gram].add(email)
+        for token in _tokens(text):
+            if keep_sorted and token not in self._token_index:
+                bisect.insort(self._sorted_tokens, token)
+            self._token_index[token].add(email)
+
+    def _unindex(self, email):
+        text = self._text.pop(email, None)
+        self._by_email.pop(email, None)
+        if text is None:
+            return
+        for gram in _trigrams(text):
+            self._trigram_index[gram].discard(email)
+        for token in _tokens(text):
+            self._token_index[token].discard(email)
+
+    def _full_load(self):
+        self._reset()
+        users = {}
+        for doc in firestore_reads.tracked(self.db.collection("users").stream()):
+            d = doc.to_dict()
+            users[doc.id] = {
+                "email": doc.id,
+                "name": d.get("name") or "",
+                "lastname": d.get("lastname") or "",
+                "role": d.get("role", "user"),
+                "has_profile": True,
+            }
+        for email in (self.extra_emails() if self.extra_emails else []):
+            if email not in users:
+                users[email] = {"email": email, "name": "", "lastname": "", "role": "user", "has_profile": False}
+        # ตอนโหลดทั้งหมดเรียง token ครั้งเดียว แทน insort ทีละคำ
+        for user in users.values():
+            self._index(user, keep_sorted=False)
+        self._sorted_tokens = sorted(self._token_index)
+        self._loaded_at = time.monotonic()
+
+    def refresh(self):
+        with self._lock:
+            if not self._loaded_at or time.monotonic() - self._loaded_at > self.ttl_seconds:
+                self._full_load()
+
+    def __len__(self):
+        self.refresh()
+        return len(self._by_email)
+
+    def get(self, email):
+        self.refresh()
+        return self._by_email.get(email)
+
+    def _prefix_matches(self, prefix):
+        start = bisect.bisect_left(self._sorted_tokens, prefix)
+        matched = set()
+        for token in self._sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            matched |= self._token_index[token]
+        return matched
+
+    def search(self, text=""):
+        # คืนค่า list ของผู้ใช้ที่ตรงกับคำค้น เรียงตามชื่อแล้วอีเมล (คำค้นว่าง = ทุกคน)
+        # คำค้นหลายคำต้องตรงทุกคำ
+        self.refresh()
+        terms = text.lower().split()
+        with self._lock:
+            if not terms:
+                emails = set(self._by_email)
+            else:
+                emails = None
+                for term in terms:
+                    if len(term) < 3:
+                        found = self._prefix_matches(term)
+                    else:
+                        grams = sorted((self._trigram_index.get(g, set()) for g in _trigrams(term)), key=len)
+                        found = set.intersection(*grams) if grams else set()
+                        # trigram ตรงทุกตัวไม่ได้แปลว่าเป็นข้อความต่อเนื่อง ตรวจซ้ำอีกครั้ง
+                        found = {e for e in found if term in self._text[e]}
+                    emails = found if emails is None else emails & found
+                    if not emails:
+                        break
+            users = [self._by_email[e] for e in emails]
+        users.sort(key=lambda u: (not u["has_profile"], u["name"].lower(), u["email"]))
+        return users
+
+    def upsert(self, email, **fields):
+        # เพิ่มหรือแก้ไขผู้ใช้ใน index (เรียกหลังเขียน users/{email})
+        with self._lock:
+            if not self._loaded_at:
+                return
+            user = dict(self._by_email.get(email) or
+                        {"email": email, "name": "", "lastname": "", "role": "user"})
+            user.update({k: v for k, v in fields.items() if k in ("name", "lastname", "role")})
+            user["has_profile"] = True
+            self._unindex(email)
+            self._index(user)
+
+    def remove(self, email):
+        with self._lock:
+            self._unindex(email)
+
+    def invalidate(self):
+        self._loaded_at = 0.0
@@ -0,0 +1,98 @@
+from datetime import datetime
+
+from firebase_admin import firestore
+
+import firestore_reads
+
+# สรุปประวัติของผู้ใช้แต่ละคนในเอกสารเดียว (user_stats/{email}) อัปเดตทุกครั้งที่บันทึกผล
+# - entries: รายการผลตรวจ (id, datetime, glucose, bmi, result, age) ต่อท้ายด้วย ArrayUnion
+#   ArrayUnion ตัดค่าที่ซ้ำทั้ง map ทิ้ง จึงใส่ id ของเอกสารใน results ไว้ในทุกรายการ ผลสองแถวที่ค่าเหมือนกัน
+#   จึงไม่หายไป (count เพิ่มเท่ากับจำนวนรายการที่ต่อท้ายจริง) ส่วนการเขียนเอกสารเดิมซ้ำตอน retry ไม่เกิดรายการซ้ำ
+# - count / risk_count: ตัวนับสะสม (นับทุกผล แม้รายการเก่าจะถูกตัดออกจาก entries แล้ว)
+# - schema_version: ตั้งโดย rebuild() เท่านั้น เอกสารที่ไม่มีค่านี้ (เช่นถูกสร้างจากการบันทึกผลครั้งแรก
+#   หลังเปิดใช้ หรือจากการนำเข้าไฟล์) ยังไม่มีผลเดิมของผู้ใช้ จึงต้อง rebuild ก่อนใช้แสดงประวัติ
+# เอกสาร Firestore จำกัด 1 MiB จึงเก็บ entries ไว้ไม่เกิน MAX_ENTRIES รายการล่าสุด
+# (ตัดรายการเก่าด้วย ArrayRemove ตอนอ่าน ไม่ชนกับ ArrayUnion ที่เขียนพร้อมกัน)
+COLLECTION = "user_stats"
+ENTRY_FIELDS = ["id", "datetime", "glucose", "bmi", "result", "age"]
+SCHEMA_VERSION = 3
+MAX_ENTRIES = 1000
+
+
+def _entry(record):
+    return {k: record.get(k) for k in ENTRY_FIELDS}
+
+
+def stats_write(email, record, doc_id):
+    # การเขียน (path, data, merge) ที่ต่อท้ายผลใหม่ (เอกสาร results/{doc_id}) เข้าเอกสารสรุปของผู้ใช้
+    return stats_write_many(email, [dict(record, id=doc_id)])
+
+
+def stats_write_many(email, records):
+    # ต่อท้ายหลายผลของผู้ใช้คนเดียวในการเขียนครั้งเดียว (ใช้ตอนนำเข้าผลจากไฟล์)
+    # records ต้องมี "id" = id ของเอกสารใน results
+    return (f"{COLLECTION}/{email}", {
+        "email": email,
+        "entries": firestore.ArrayUnion([_entry(r) for r in records]),
+        "count": firestore.Increment(len(records)),
+        "risk_count": firestore.Increment(sum(1 for r in records if r.get("result") == "เสี่ยง")),
+        "updated_at": max(r["datetime"] for r in records),
+    }, True)
+
+
+def _newest(entries, n=MAX_ENTRIES):
+    # รายการที่ไม่มี datetime ถือว่าเก่าที่สุด
+    return sorted(entries, key=lambda e: (e.get("datetime") is not None, e.get("datetime") or datetime.min))[-n:]
+
+
+def load_entries(db, email):
+    # อ่านเอกสารเดียว คืนค่า list ของผลตรวจล่าสุด (None ถ้ายังไม่เคย rebuild ต้องสร้างจากผลเดิมก่อน)
+    ref = db.collection(COLLECTION).document(email)
+    doc = firestore_reads.tracked_get(ref)
+    if not doc.exists:
+        return None
+    d = doc.to_dict()
+    if d.get("schema_version") != SCHEMA_VERSION:
+        return None
+    entries = d.get("entries", [])
+    if len(entries) > MAX_ENTRIES:
+        kept = _newest(entries)
+        kept_ids = {id(e) for e in kept}
+        ref.update({"entries": firestore.ArrayRemove([e for e in entries if id(e) not in kept_ids])})
+        entries = kept
+    return entries
+
+
+def results_query(db, email):
+    # ผลทั้งหมดของผู้ใช้เรียงตามเวลา (composite index (user, datetime ASC) ใน firestore.indexes.json)
+    return db.collection("results").where(filter=firestore.FieldFilter("user", "==", email)).order_by("datetime")
+
+
+def rebuild(db, email):
+    # สร้างเอกสารสรุปใหม่จากผลทั้งหมดของผู้ใช้ (ใช้กับข้อมูลที่บันทึกไว้ก่อนมีเอกสารสรุป)
+    # ทำใน transaction: อ่านเอกสารสรุปและผลทั้งหมดแล้วเขียนทับในครั้งเดียว ถ้ามีการบันทึกผล (ArrayUnion/Increment)
+    # เข้ามาระหว่างนั้น transaction จะชนกันและเริ่มใหม่ จึงไม่ทับรายการที่เพิ่งต่อท้ายจนหายไป
+    ref = db.collection(COLLECTION).document(email)
+
+    @firestore.transactional
+    def run(transaction):
+        snap = ref.get(transaction=transaction)
+        firestore_reads.add(1)
+        if snap.exists and snap.get("schema_version") == SCHEMA_VERSION:
+            # process อื่น rebuild ไปแล้ว
+            return _newest(snap.to_dict().get("entries", []))
+        docs = firestore_reads.tracked(results_query(db, email).stream(transaction=transaction))
+        records = [dict(doc.to_dict(), id=doc.id) for doc in docs]
+        entries = [_entry(r) for r in records if "datetime" in r]
+        kept = _newest(entries)
+        transaction.set(ref, {
+            "email": email,
+            "entries": kept,
+            "count": len(entries),
+            "risk_count": sum(1 for e in entries if e["result"] == "เสี่ยง"),
+            "updated_at": max((e["datetime"] for e in entries), default=None),
+            "schema_version": SCHEMA_VERSION,
+        })
+        return kept
+
+    return run(db.transaction())
@@ -0,0 +1,119 @@
+import json
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+# ตรวจการกรองผลในหน้าแอดมินแบบ indexed กับ Firestore Emulator
+# 1) ตรวจว่าทุกรูปแบบ query ที่ results_pager ใช้ มี composite index อยู่ใน firestore.indexes.json
+# 2) ใส่ข้อมูลตัวอย่างลง emulator แล้วไล่ดึงทีละหน้าด้วย fetch_page เทียบกับการกรองในหน่วยความจำ
+#
+#   firebase emulators:start --only firestore
+#   FIRESTORE_EMULATOR_HOST=127.0.0.1:8080 python verify_firestore_indexes.py
+#
+# (emulator ไม่บังคับ composite index จึงต้องตรวจข้อ 1 แยก ส่วนข้อ 2 ตรวจความถูกต้องของผลลัพธ์)
+# ข้อ 1 ตรวจใน tests/test_firestore_indexes.py ด้วย (สร้าง query จากโค้ดจริงโดยไม่ต้องมี emulator)
+PROJECT_ID = "demo-diabetes-checker"
+COLLECTION = "results"
+
+# รูปแบบ query: (ฟิลด์ที่กรองด้วย ==, ฟิลด์ที่กรองด้วย array_contains, การเรียง datetime)
+QUERY_SHAPES = [
+    (("risk_level",), (), "DESCENDING"),
+    (("user",), (), "DESCENDING"),
+    (("user",), (), "ASCENDING"),
+    ((), ("name_tokens",), "DESCENDING"),
+    (("risk_level",), ("name_tokens",), "DESCENDING"),
+]
+
+
+def check_index_file(path="firestore.indexes.json"):
+    with open(path, encoding="utf-8") as f:
+        indexes = [ix for ix in json.load(f)["indexes"] if ix["collectionGroup"] == COLLECTION]
+    defined = set()
+    for ix in indexes:
+        eq = tuple(sorted(f["fieldPath"] for f in ix["fields"] if f.get("order") and f["fieldPath"] != "datetime"))
+        arr = tuple(sorted(f["fieldPath"] for f in ix["fields"] if f.get("arrayConfig") == "CONTAINS"))
+        order = next(f["order"] for f in ix["fields"] if f["fieldPath"] == "datetime")
+        defined.add((eq, arr, order))
+    missing = [shape for shape in QUERY_SHAPES if shape not in defined]
+    for shape in missing:
+        print(f"❌ ไม่มี composite index สำหรับ {shape}")
+    return not missing
+
+
+def seed(db, n, rng):
+    from results_index import indexed_fields
+
+    names = [("สมชาย", "ใจดี"), ("สมหญิง", "รักดี"), ("John", "Smith"), ("Jane", "Doe"), ("Anan", "Boonmee")]
+    people = [(f"patient{i}@example.com", *names[i % len(names)]) for i in range(12)]
+    start = datetime(2025, 1, 1)
+    records = []
+    batch = db.batch()
+    for i in range(n):
+        email, name, lastname = rng.choice(people)
+        record = {
+            "user": email,
+            "name": name,
+            "result": rng.choice(["เสี่ยง", "ไม่เสี่ยง"]),
+            "glucose": rng.randint(60, 220),
+            "datetime": start + timedelta(minutes=i * 7 + rng.randint(0, 5)),
+        }
+        record.update(indexed_fields(record, {"name": name, "lastname": lastname}))
+        doc_id = f"verify-{i:05d}"
+        batch.set(db.collection(COLLECTION).document(doc_id), record)
+        records.append((doc_id, record))
+        if (i + 1) % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    return records
+
+
+def collect(db, page_size, **filters):
+    import results_pager
+
+    rows, after = [], None
+    while True:
+        docs, has_next = results_pager.fetch_page(db, page_size, after, **filters)
+        rows.extend(doc.id for doc in docs)
+        if not has_next:
+            return rows
+        after = docs[-1]
+
+
+def main():
+    ok = check_index_file()
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        print("ตั้งค่า FIRESTORE_EMULATOR_HOST ก่อน (เช่น 127.0.0.1:8080) เพื่อตรวจกับ emulator")
+        sys.exit(0 if ok else 1)
+
+    from google.cloud import firestore as gcf
+
+    db = gcf.Client(project=PROJECT_ID)
+    rng = random.Random(0)
+    records = seed(db, int(os.environ.get("VERIFY_RECORDS", 2000)), rng)
+
+    cases = [{"risk_level": level} for level in ["high", "watch", "normal"]]
+    cases += [{"token": t} for t in ["สม", "สมชาย", "jo", "patient3@example.com", "boonmee"]]
+    cases += [{"risk_level": "high", "token": "ja"}, {"user": "patient5@example.com"}]
+    for filters in cases:
+        matched = [(doc_id, r) for doc_id, r in records
+                   if all((v in r["name_tokens"]) if k == "token" else r[k] == v for k, v in filters.items())]
+        expected = [doc_id for doc_id, r in sorted(matched, key=lambda m: m[1]["datetime"], reverse=True)]
+        got = collect(db, 37, **filters)  # ขนาดหน้าไม่ลงตัว เพื่อทดสอบ cursor ข้ามหน้า
+        print(f"{'✅' if got == expected else '❌'} {filters}: {len(got)} รายการ (คาดไว้ {len(expected)})")
+        ok = ok and got == expected
+
+    # ลบข้อมูลตัวอย่างออก
+    batch = db.batch()
+    for i, (doc_id, _) in enumerate(records, 1):
+        batch.delete(db.collection(COLLECTION).document(doc_id))
+        if i % 500 == 0:
+            batch.commit()
+            batch = db.batch()
+    batch.commit()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from firebase_admin import firestore
+from google.api_core.exceptions import (
+    Aborted, DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable, TooManyRequests,
+)
+
+# Firestore จำกัดการเขียนไม่เกิน 500 รายการต่อ batch
+MAX_BATCH_WRITES = 500
+# ข้อผิดพลาดชั่วคราว (Firestore/เครือข่ายล่ม) ไม่ใช่ความผิดของงาน จึงไม่นับเป็นครั้งที่ล้มเหลวของงาน
+TRANSIENT_ERRORS = (
+    Aborted, DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable, TooManyRequests,
+    ConnectionError, TimeoutError,
+)
+
+
+def _encode(value):
+    # แปลงค่าที่ JSON ไม่รองรับ (datetime, Increment, ArrayUnion, SERVER_TIMESTAMP) ให้เก็บลง spool ได้
+    if value is firestore.SERVER_TIMESTAMP:
+        return {"__server_timestamp__": True}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, firestore.Increment):
+        return {"__increment__": value.value}
+    if isinstance(value, firestore.ArrayUnion):
+        return {"__array_union__": _encode(value.values)}
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if "__server_timestamp__" in value:
+            return firestore.SERVER_TIMESTAMP
+        if "__datetime__" in value:
+            return datetime.fromisoformat(value["__datetime__"])
+        if "__increment__" in value:
+            return firestore.Increment(value["__increment__"])
+        if "__array_union__" in value:
+            return firestore.ArrayUnion(_decode(value["__array_union__"]))
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def apply_writes(db, writes):
+    # writes คือ list ของ (path, data, merge) เขียนทั้งหมดใน WriteBatch เดียว
+    batch = db.batch()
+    for path, data, merge in writes:
+        batch.set(db.document(path), data, merge=merge)
+    batch.commit()
+
+
+# คิวเขียนข้อมูลแบบ write-behind
+# - enqueue() บันทึกลง SQLite (spool) ก่อนแล้วคืนค่าทันที ข้อมูลไม่หายแม้ process ปิดก่อน flush
+# - worker เบื้องหลังรวมงานเป็น WriteBatch ทุก flush_ms หรือเมื่อมีงานครบ max_batch รายการ
+# - commit ไม่สำเร็จจะลองใหม่แบบ exponential backoff + jitter
+# - batch ที่ล้มเหลวด้วยข้อผิดพลาดที่ไม่ใช่ชั่วคราวจะถูกเขียนใหม่ทีละงาน เพื่อแยกงานที่เสีย (poison) ออก
+#   งานที่เสียรอ backoff ของตัวเอง (next_attempt_at) งานหลังจากนั้นเขียนต่อได้ไม่ต้องรอ
+#   ล้มเหลวครบ max_attempts ครั้งจะย้ายไปตาราง dead_letter (ดูจำนวนด้วย dead_letters() และนำกลับด้วย requeue_dead())
+# - enqueue(writes, after=id): งานที่ต้องเขียนหลังงานอื่น (เช่น merge ผล shadow ลงเอกสารผลหลัก) จะไม่ถูกจอง
+#   จนกว่างานแม่จะเขียนสำเร็จ ถ้างานแม่ไปอยู่ dead_letter งานลูกจะตามไปด้วย (ไม่มีเอกสารที่มีแต่ฟิลด์ของงานลูก)
+# - จำกัดจำนวนงานค้างไม่เกิน max_pending ถ้าเกินจะเขียนตรงแบบ synchronous แทน
+# - หลาย process ใช้ spool ไฟล์เดียวกันได้ (จองงานด้วย claimed_by และมี lease หมดอายุ)
+class WriteBehindQueue:
+    def __init__(self, db, spool_path="write_spool.sqlite3", max_batch=100, flush_ms=500,
+                 max_pending=10_000, lease_seconds=60, max_backoff=30.0, max_attempts=8, on_flush=None):
+        self.db = db
+        self.max_batch = min(max_batch, MAX_BATCH_WRITES)
+        self.flush_ms = flush_ms
+        self.max_pending = max_pending
+        self.lease_seconds = lease_seconds
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.on_flush = on_flush
+
+        self.flushed = 0
+        self.failures = 0
+        self.last_error = None
+        self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+        self._conn = sqlite3.connect(spool_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                writes TEXT NOT NULL,
+                n_writes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                claimed_by TEXT,
+                claimed_at REAL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        # spool ที่สร้างก่อนมี backoff รายงาน: เพิ่มคอลัมน์ที่ขาด
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(spool)")}
+        if "next_attempt_at" not in columns:
+            self._conn.execute("ALTER TABLE spool ADD COLUMN next_attempt_at REAL NOT NULL DEFAULT 0")
+        if "last_error" not in columns:
+            self._conn.execute("ALTER TABLE spool ADD COLUMN last_error TEXT")
+        if "parent_id" not in columns:
+            self._conn.execute("ALTER TABLE spool ADD COLUMN parent_id INTEGER")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS dead_letter (
+                id INTEGER PRIMARY KEY,
+                writes TEXT NOT NULL,
+                n_writes INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                attempts INTEGER NOT NULL,
+                last_error TEXT,
+                failed_at REAL NOT NULL
+            )
+        """)
+        if "parent_id" not in {row[1] for row in self._conn.execute("PRAGMA table_info(dead_letter)")}:
+            self._conn.execute("ALTER TABLE dead_letter ADD COLUMN parent_id INTEGER")
+
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def pending(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+
+    def dead_letters(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def requeue_dead(self):
+        # นำงานใน dead_letter กลับเข้าคิว (เช่นหลังแก้ rules หรือข้อมูลแล้ว) คืนค่าจำนวนงาน
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # ใช้ id เดิม ลำดับงานแม่/งานลูกจึงยังอยู่ครบ
+                n = self._conn.execute(
+                    "INSERT INTO spool (id, writes, n_writes, created_at, parent_id) "
+                    "SELECT id, writes, n_writes, created_at, parent_id FROM dead_letter ORDER BY id"
+                ).rowcount
+                self._conn.execute("DELETE FROM dead_letter")
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._wake.set()
+        return n
+
+    def enqueue(self, writes, after=None):
+        # writes: list ของ (path, data, merge) ที่ต้องเขียนพร้อมกัน
+        # after: id ของงานที่ต้องเขียนสำเร็จก่อน คืนค่า id ของงานนี้ (None ถ้าเขียนตรงไปแล้ว)
+        if self.pending() >= self.max_pending and after is None:
+            apply_writes(self.db, writes)
+            if self.on_flush:
+                self.on_flush()
+            return None
+        payload = json.dumps([[path, _encode(data), merge] for path, data, merge in writes], ensure_ascii=False)
+        with self._lock:
+            job_id = self._conn.execute(
+                "INSERT INTO spool (writes, n_writes, created_at, parent_id) VALUES (?, ?, ?, ?)",
+                (payload, len(writes), time.time(), after),
+            ).lastrowid
+        if self.pending() >= self.max_batch:
+            self._wake.set()
+        return job_id
+
+    def _claim(self):
+        # จองงานที่ยังไม่มีใครถือ (หรือ lease หมดอายุแล้ว) และพ้นเวลา backoff แล้ว ไม่เกิน max_batch รายการเขียน
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._conn.execute(
+                    "SELECT id, writes, n_writes FROM spool "
+                    "WHERE (claimed_by IS NULL OR claimed_at < ?) AND next_attempt_at <= ? "
+                    "AND (parent_id IS NULL OR parent_id NOT IN (SELECT id FROM spool UNION SELECT id FROM dead_letter)) "
+                    "ORDER BY id LIMIT ?",
+                    (now - self.lease_seconds, now, self.max_batch),
+                ).fetchall()
+                picked, total = [], 0
+                for row in rows:
+                    if picked and total + row[2] > self.max_batch:
+                        break
+                    picked.append(row)
+                    total += row[2]
+                if picked:
+                    ids = [r[0] for r in picked]
+                    self._conn.execute(
+                        f"UPDATE spool SET claimed_by = ?, claimed_at = ? WHERE id IN ({','.join('?' * len(ids))})",
+                        [self._owner, now, *ids],
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return picked
+
+    def _done(self, ids):
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            self._conn.execute(f"DELETE FROM spool WHERE id IN ({marks})", ids)
+
+    def _fail(self, ids, error):
+        marks = ",".join("?" * len(ids))
+        with self._lock:
+            if isinstance(error, TRANSIENT_ERRORS):
+                # ปล่อยงานคืนคิว worker จะรอ backoff รวมก่อนลองใหม่
+                self._conn.execute(f"UPDATE spool SET claimed_by = NULL WHERE id IN ({marks})", ids)
+                return
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # backoff ของงาน: flush_ms * 2^(ครั้งที่ล้มเหลวก่อนหน้า) ไม่เกิน max_backoff
+                self._conn.execute(
+                    f"UPDATE spool SET claimed_by = NULL, attempts = attempts + 1, last_error = ?, "
+                    f"next_attempt_at = ? + MIN(?, ? * (1 << MIN(attempts, 20))) WHERE id IN ({marks})",
+                    [str(error), time.time(), self.max_backoff, self.flush_ms / 1000, *ids],
+                )
+                dead = [row[0] for row in self._conn.execute(
+                    f"SELECT id FROM spool WHERE id IN ({marks}) AND attempts >= ?", [*ids, self.max_attempts]
+                )]
+                # งานลูกของงานที่ล้มเหลวจนหมดสิทธิ์ย้ายไป dead_letter ด้วย
+                if dead:
+                    marks = ",".join("?" * len(dead))
+                    dead += [row[0] for row in self._conn.execute(
+                        f"SELECT id FROM spool WHERE parent_id IN ({marks})", dead
+                    )]
+                    marks = ",".join("?" * len(dead))
+                    self._conn.execute(
+                        "INSERT INTO dead_letter (id, writes, n_writes, created_at, attempts, last_error, failed_at, parent_id) "
+                        f"SELECT id, writes, n_writes, created_at, attempts, COALESCE(last_error, 'งานแม่ล้มเหลว'), ?, "
+                        f"parent_id FROM spool WHERE id IN ({marks})",
+                        [time.time(), *dead],
+                    )
+                    self._conn.execute(f"DELETE FROM spool WHERE id IN ({marks})", dead)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _apply(self, rows):
+        writes = []
+        for _, payload, _ in rows:
+            writes.extend((path, _decode(data), merge) for path, data, merge in json.loads(payload))
+        apply_writes(self.db, writes)
+
+    def flush(self):
+        # เขียนงานที่ค้างอยู่ 1 batch คืนค่าจำนวนงานที่จัดการแล้ว (0 = ไม่มีงานที่ถึงเวลาเขียน)
+        # ข้อผิดพลาดชั่วคราวโยนต่อให้ worker รอ backoff ส่วนงานที่เสียถูกนับใน failures แล้วเขียนงานถัดไปต่อ
+        rows = self._claim()
+        if not rows:
+            return 0
+        ids = [r[0] for r in rows]
+        try:
+            self._apply(rows)
+        except Exception as e:
+            if isinstance(e, TRANSIENT_ERRORS):
+                self._fail(ids, e)
+                raise
+            if len(rows) == 1:
+                self._fail(ids, e)
+                self._record_failure(e)
+                return 1
+            # ไม่รู้ว่างานไหนทำให้ทั้ง batch ล้มเหลว: เขียนทีละงาน งานที่ดีจึงไม่ติดไปกับงานที่เสีย
+            for i, row in enumerate(rows):
+                try:
+                    self._apply([row])
+                except Exception as e:
+                    if isinstance(e, TRANSIENT_ERRORS):
+                        self._fail(ids[i:], e)
+                        raise
+                    self._fail([row[0]], e)
+                    self._record_failure(e)
+                else:
+                    self._done([row[0]])
+                    self._flushed(1)
+            return len(rows)
+        self._done(ids)
+        self._flushed(len(rows))
+        return len(rows)
+
+    def _flushed(self, n):
+        self.flushed += n
+        if self.on_flush:
+            self.on_flush()
+
+    def _record_failure(self, error):
+        self.failures += 1
+        self.last_error = str(error)
+
+    def _run(self):
+        attempt = 0
+        while True:
+            if attempt:
+                # exponential backoff + jitter ก่อนลองใหม่
+                delay = min(self.max_backoff, (self.flush_ms / 1000) * 2 ** attempt)
+                time.sleep(random.uniform(delay / 2, delay))
+            else:
+                self._wake.wait(self.flush_ms / 1000)
+                self._wake.clear()
+            try:
+                # เขียนต่อไปเรื่อยๆ จนไม่มีงานค้าง
+                while self.flush():
+                    pass
+                attempt = 0
+            except Exception as e:
+                self._record_failure(e)
+                attempt += 1